@@ -1,24 +1,54 @@
+import argparse
 import json
+import os
 import requests
+import sqlite3
 import sys
-from bs4 import BeautifulSoup
-from send_email import send_notification_email
+import time
+from typing import Callable
 from utils import (
     save_cookies,
     load_cookies,
-    extract_csrf_token,
+    extract_csrf_token_from_response,
     load_config,
+    load_selections,
+    validate_selection,
+    build_query_payload,
+    format_room_path,
+    parse_query_result,
+    get_bill_csrf_token,
+    invalidate_bill_csrf_token,
+    CsrfTokenRejected,
+    post_electric_query,
+    mark_session_verified,
+    file_lock,
+    cookies_changed_on_disk,
+    is_session_recently_verified,
+    log_fields,
     setup_logger,
 )
 from config import (
     BASE_DOMAIN,
     USER_CONFIG_FILE,
-    QUERY_URL,
     COOKIE_FILE,
+    CRON_MIGRATION_MARKER,
+    EMAIL_DIGEST,
+    ALERT_REARM_MARGIN,
+    ALERT_COOLDOWN_HOURS,
+    ALERT_REPEAT_HOURS,
+    ALERT_RESOLVED_NOTICE,
+    DEPLETION_REARM_FACTOR,
+    METRICS_ENABLED,
+    METRICS_FILE,
+    METRICS_TEXTFILE,
+    SESSION_META_FILE,
+    SESSION_OPTIMISTIC,
+    SESSION_TRUST_SECONDS,
+    SHARD_MIN_ROOMS,
+    SHARD_PROCESSES,
     VERIFY_LOGIN_URL,
     LOGIN_PAGE_URL,
     LOGIN_URL,
-    LOAD_ELECTRIC_INDEX_URL,
     DEFAULT_HEADERS,
 )
 from crypto_store import (
@@ -26,7 +56,14 @@ from crypto_store import (
     migrate_plaintext_to_encrypted,
     get_key_file_path,
 )
-from scheduler_setup import check_and_update_cron  # 导入用于检查和更新定时任务的函数
+from room_catalog import expand_selections
+from account_pool import uses_account_pool
+from query_cache import get_query_cache, wait_for_refreshes
+from http_client import create_http_session, save_latency_stats
+import metrics
+from reading_store import ReadingStore, readings_from_outcomes
+from forecast import Forecaster, format_hours
+from alert_state import AlertStateStore, LOW_BALANCE, DEPLETION, QUERY_FAILED, FIRE, SUPPRESS, RESOLVE
 
 # --- 1. 日志配置 ---
 logger = setup_logger("TJUEcardQuery")
@@ -39,14 +76,17 @@ def perform_auto_login(session: requests.Session, username: str, password: str)
     print("[信息] 正在尝试自动重新登录...")
     logger.info("尝试自动重新登录")
     try:
-        page_response = session.get(LOGIN_PAGE_URL, timeout=10)  # 设置10秒超时
+        page_response = session.get(LOGIN_PAGE_URL, stream=True)
         page_response.raise_for_status()
-        soup = BeautifulSoup(page_response.text, "html.parser")
-        csrf_input_tag = soup.find("input", {"name": "_csrf"})
-        if not csrf_input_tag or not csrf_input_tag.has_attr("value"):
+        csrf_token = extract_csrf_token_from_response(page_response, tag="input")
+        if not csrf_token:
+            # 会话仍然有效时访问登录页面得到的是个人首页，没有登录表单（例如只是电费页面的Token被服务器更换）
+            if verify_session(session):
+                invalidate_bill_csrf_token(session)
+                logger.info("会话仍然有效，无需重新登录")
+                return True
             logger.error("在登录页面中未找到CSRF token")
             return False
-        csrf_token = csrf_input_tag["value"]
     except requests.RequestException as e:
         logger.error(f"访问登录页面失败: {e}")
         return False
@@ -54,13 +94,13 @@ def perform_auto_login(session: requests.Session, username: str, password: str)
     login_data = {"j_username": username, "j_password": password, "_csrf": csrf_token}
     try:
         headers = {"Referer": LOGIN_PAGE_URL, "Origin": BASE_DOMAIN}
-        response = session.post(
-            LOGIN_URL, data=login_data, headers=headers, timeout=10
-        )  # 设置10秒超时
+        response = session.post(LOGIN_URL, data=login_data, headers=headers)
         response.raise_for_status()
         if "<frameset" not in response.text:
             logger.error("登录失败，服务器返回的页面不包含预期内容")
             return False
+        # 登录后会话已更换，之前缓存的电费页面Token全部作废
+        invalidate_bill_csrf_token(session)
         print("[成功] 自动重新登录成功！")
         logger.info("自动重新登录成功")
         return True
@@ -70,7 +110,22 @@ def perform_auto_login(session: requests.Session, username: str, password: str)
 
 
 # 处理重连逻辑
-def handle_relogin(session: requests.Session, config: dict) -> bool:
+def handle_relogin(
+    session: requests.Session,
+    config: dict,
+    fatal: bool = True,
+    cookie_file: str = COOKIE_FILE,
+    meta_file: str = SESSION_META_FILE,
+    notify: bool = True,
+) -> bool:
+    """
+    使用配置中的凭据重新登录并保存会话。
+
+    :param fatal: 失败时是否退出进程；守护进程中传 False，失败时返回 False 并等待下一轮
+    :param cookie_file: 保存会话的文件，多账号时每个账号各有一个
+    :param meta_file: 记录会话最近一次确认有效时间的文件
+    :param notify: 失败时是否发送失败通知邮件；多账号时为 False，由账号池在全部账号都不可用时统一通知
+    """
     logger.info("开始处理重连逻辑")
     if (
         "credentials" not in config
@@ -81,45 +136,100 @@ def handle_relogin(session: requests.Session, config: dict) -> bool:
         print(f"[错误] {msg}")
         logger.error(msg)
         print(f"\n[操作建议] 请重新运行 setup 更新您的配置。")
-        send_query_email(config, "[警告] 电费查询失败通知", msg, -1)
+        if notify:
+            send_query_email(config, "[警告] 电费查询失败通知", msg, -1)
+        if not fatal:
+            return False
         logger.info("--- 查询脚本运行结束 ---\n")
         sys.exit(1)
 
-    # 2. 尝试登录
-    credentials = config["credentials"]
-    username = credentials["username"]
-    enc_blob = credentials.get("password_enc")
-    logger.debug(f"使用用户名 {credentials['username']} 尝试自动登录")
-
+    # 多个进程同时发现会话失效时只有一个真正登录，其余进程等到锁后直接使用它保存的新会话
     try:
-        password = decrypt_from_storage(enc_blob)
-        logger.info("密码已成功解密，将用于登录")
-    except Exception as e:
-        msg = f"解密登录密码失败：{e}"
-        print(f"[错误] {msg}")
-        logger.error(msg)
-        send_query_email(config, "[警告] 电费查询失败通知", msg, -1)
-        logger.info("--- 查询脚本运行结束 ---\n")
-        sys.exit(1)
-
-    if perform_auto_login(session, username, password):
-        save_cookies(session, COOKIE_FILE)
-        logger.info("重连成功并保存新的会话")
-        return True
-    else:
-        # 3. 处理登录失败
-        msg = "自动重新登录失败。保存的密码可能已更改。"
+        with file_lock(cookie_file):
+            if cookies_changed_on_disk(session, cookie_file) and load_cookies(session, cookie_file):
+                with metrics.timed("session_verify"):
+                    refreshed = verify_session(session)
+                if refreshed:
+                    logger.info("其他进程已经刷新了会话，直接使用新的会话")
+                    # 缓存的电费页面Token属于旧会话
+                    invalidate_bill_csrf_token(session)
+                    mark_session_verified(meta_file)
+                    metrics.inc("relogin_total", "reused")
+                    return True
+
+            # 2. 尝试登录
+            credentials = config["credentials"]
+            username = credentials["username"]
+            enc_blob = credentials.get("password_enc")
+            logger.debug(f"使用用户名 {credentials['username']} 尝试自动登录")
+
+            try:
+                password = decrypt_from_storage(enc_blob)
+                logger.info("密码已成功解密，将用于登录")
+            except Exception as e:
+                msg = f"解密登录密码失败：{e}"
+                print(f"[错误] {msg}")
+                logger.error(msg)
+                if notify:
+                    send_query_email(config, "[警告] 电费查询失败通知", msg, -1)
+                if not fatal:
+                    return False
+                logger.info("--- 查询脚本运行结束 ---\n")
+                sys.exit(1)
+
+            with metrics.timed("relogin") as relogin_timer:
+                logged_in = perform_auto_login(session, username, password)
+            metrics.inc("relogin_total", "success" if logged_in else "failure")
+            if logged_in:
+                save_cookies(session, cookie_file)
+                mark_session_verified(meta_file)
+                logger.info(
+                    "重连成功并保存新的会话",
+                    extra=log_fields(phase="relogin", duration_ms=relogin_timer.ms, result="success"),
+                )
+                return True
+            else:
+                # 3. 处理登录失败
+                msg = "自动重新登录失败。保存的密码可能已更改。"
+                print(f"[错误] {msg}")
+                logger.error(msg, extra=log_fields(phase="relogin", duration_ms=relogin_timer.ms, result="failure"))
+                print(f"\n[操作建议] 请重新运行 setup 更新您的配置。")
+                if notify:
+                    send_query_email(config, "[警告] 电费查询失败通知", msg, -1)
+                if not fatal:
+                    return False
+                logger.info("--- 查询脚本运行结束 ---\n")
+                sys.exit(1)
+    except TimeoutError as e:
+        msg = f"等待其他进程登录超时：{e}"
         print(f"[错误] {msg}")
         logger.error(msg)
-        print(f"\n[操作建议] 请重新运行 setup 更新您的配置。")
-        send_query_email(config, "[警告] 电费查询失败通知", msg, -1)
+        if not fatal:
+            return False
         logger.info("--- 查询脚本运行结束 ---\n")
         sys.exit(1)
 
 
 # 一个辅助函数，用于发送查询结果邮件
-def send_query_email(config: dict, subject: str, body: str, current_electricity: float):
-    """检查配置并发送邮件，如果未配置则静默跳过。"""
+def send_query_email(
+    config: dict,
+    subject: str,
+    body: str,
+    current_electricity: float,
+    hours_to_zero: float | None = None,
+    dispatcher=None,
+    alert_room: str | None = None,
+    alerts: AlertStateStore | None = None,
+):
+    """
+    检查配置并发送邮件，如果未配置则静默跳过。
+
+    :param hours_to_zero: 预计耗尽时间（小时），未知时为None
+    :param dispatcher: send_email.NotificationDispatcher，批量查询时复用SMTP连接；开启汇总时只登记通知，
+        由调用方统一发送。为None时单独发送这一封邮件
+    :param alert_room: 房间标识，与 alerts 一起用于告警去重；为None时不记录告警状态，每次都发送
+    :param alerts: 告警状态存储
+    """
     if not config:
         logger.warning("尝试发送邮件，但传入的config为None。")
         print("[警告] 未配置邮箱通知，无法发送邮件。")
@@ -137,19 +247,27 @@ def send_query_email(config: dict, subject: str, body: str, current_electricity:
             logger.warning("未配置加密的邮箱授权码（auth_code_enc），跳过发送邮件。")
             return
 
-        try:
-            auth_code = decrypt_from_storage(enc_blob)
-            logger.info("邮箱授权码已成功解密")
-        except Exception as e:
-            print(f"[警告] 解密邮箱授权码失败：{e}，跳过发送邮件。")
-            logger.error(f"解密邮箱授权码失败：{e}，跳过发送邮件。")
-            return
-
         # 检查是否设置了通知阈值
         threshold = notifier_config.get("notification_threshold", -1)
+        # 预计在该小时数内耗尽时，即使电量高于阈值也发送提醒
+        depletion_alert_hours = notifier_config.get("depletion_alert_hours", -1)
+        depleting_soon = (
+            depletion_alert_hours >= 0
+            and hours_to_zero is not None
+            and hours_to_zero <= depletion_alert_hours
+        )
 
         # 判断是否需要发送邮件
-        if threshold >= 0 and current_electricity > threshold:
+        alert_type = None  # 需要去重的告警类型；未设置阈值时的正常通知不去重
+        if depleting_soon and current_electricity >= 0 and (
+            threshold < 0 or current_electricity > threshold
+        ):
+            logger.info(
+                f"预计{format_hours(hours_to_zero)}后电量耗尽，低于设置的提醒时间({depletion_alert_hours}小时)，发送邮件通知。"
+            )
+            subject = f"[警告] 预计{format_hours(hours_to_zero)}后电量耗尽，剩余电量{current_electricity}度"
+            alert_type = DEPLETION
+        elif threshold >= 0 and current_electricity > threshold:
             # 当前电量高于阈值且不是失败通知，则不发送邮件
             logger.info(
                 f"剩余电量({current_electricity}度)高于设置的通知阈值({threshold}度)，不发送邮件。"
@@ -157,13 +275,14 @@ def send_query_email(config: dict, subject: str, body: str, current_electricity:
             print(
                 f"[信息] 剩余电量({current_electricity}度)高于设置的通知阈值({threshold}度)，不发送邮件。"
             )
-            return
+            subject = None
         elif threshold >= 0 and current_electricity >= 0:
             # 剩余电量低于阈值且不是失败通知，则发送邮件
             logger.info(
                 f"剩余电量({current_electricity}度)低于设置的通知阈值({threshold}度)，发送邮件通知。"
             )
             subject = f"[警告] 剩余电量({current_electricity}度)低于设置的通知阈值({threshold}度)"
+            alert_type = LOW_BALANCE
         elif current_electricity >= 0:
             # 未设置阈值，正常通知
             logger.info(
@@ -173,221 +292,705 @@ def send_query_email(config: dict, subject: str, body: str, current_electricity:
         else:
             # 失败通知
             logger.info("查询失败，发送失败通知。")
+            alert_type = QUERY_FAILED
+
+        # 告警去重：在解密授权码、建立SMTP连接之前判断，被抑制的告警不产生任何开销
+        pending_states = []  # 邮件发送成功后需要保存的告警状态
+        resolved_lines = []
+        if alerts is not None and alert_room:
+            cooldown_hours = notifier_config.get("cooldown_hours", ALERT_COOLDOWN_HOURS)
+            repeat_hours = notifier_config.get("repeat_hours", ALERT_REPEAT_HOURS)
+            margin = notifier_config.get("rearm_margin", ALERT_REARM_MARGIN)
+            succeeded = current_electricity >= 0
+            rearmed = {
+                QUERY_FAILED: succeeded,
+                LOW_BALANCE: succeeded and (threshold < 0 or current_electricity > threshold + margin),
+                DEPLETION: succeeded
+                and (
+                    depletion_alert_hours < 0
+                    or hours_to_zero is None
+                    or hours_to_zero > depletion_alert_hours * DEPLETION_REARM_FACTOR
+                ),
+            }
+            resolved_text = {
+                QUERY_FAILED: "电费查询已恢复正常。",
+                LOW_BALANCE: f"剩余电量已回升至{current_electricity}度，低电量告警解除。",
+                DEPLETION: "预计可用时间已回升，即将耗尽告警解除。",
+            }
+            try:
+                for kind in (QUERY_FAILED, LOW_BALANCE, DEPLETION):
+                    decision, state = alerts.evaluate(
+                        alert_room, kind, kind == alert_type, rearmed[kind], cooldown_hours, repeat_hours
+                    )
+                    if decision == SUPPRESS:
+                        logger.info(f"告警 {kind} 仍未解除且已通知过，不重复发送。 | 房间: {alert_room}")
+                        if state is not None:
+                            alerts.save(alert_room, kind, state)
+                        print("[信息] 该告警已通知过且尚未解除，不重复发送邮件。")
+                        subject = None
+                    elif decision == RESOLVE:
+                        logger.info(f"告警 {kind} 已解除。 | 房间: {alert_room}")
+                        if notifier_config.get("resolved_notice", ALERT_RESOLVED_NOTICE):
+                            resolved_lines.append(resolved_text[kind])
+                            pending_states.append((kind, state))
+                        else:
+                            alerts.save(alert_room, kind, state)
+                    elif decision == FIRE:
+                        pending_states.append((kind, state))
+            except sqlite3.Error as e:
+                # 状态库不可用时退回到每次都发送
+                logger.warning(f"读取告警状态失败，按无状态方式发送: {e}")
+                pending_states, resolved_lines = [], []
+
+            if resolved_lines:
+                notice = "\n".join(resolved_lines)
+                if subject is None:
+                    subject = "[恢复] 电费告警已解除"
+                    body = f"{notice}\n\n{body}"
+                else:
+                    body = f"{body}\n\n{notice}"
+
+        if subject is None:
+            return
+
+        def save_alert_states():
+            for kind, state in pending_states:
+                try:
+                    alerts.save(alert_room, kind, state)
+                except sqlite3.Error as e:
+                    logger.warning(f"保存告警状态失败: {e}")
+
+        try:
+            auth_code = decrypt_from_storage(enc_blob)
+            logger.info("邮箱授权码已成功解密")
+        except Exception as e:
+            print(f"[警告] 解密邮箱授权码失败：{e}，跳过发送邮件。")
+            logger.error(f"解密邮箱授权码失败：{e}，跳过发送邮件。")
+            return
+
+        if dispatcher is not None and dispatcher.digest:
+            # 汇总邮件发送成功后才保存告警状态，发送失败时下次运行会重新告警
+            dispatcher.queue(
+                notifier_config["email"], auth_code, notifier_config["email"], subject, body, on_sent=save_alert_states
+            )
+            logger.info("邮件通知已加入汇总，将在全部房间查询完成后发送。")
+            return
 
         print("[信息] 正在发送邮件通知...")
-        success, error_msg = send_notification_email(
-            sender_email=notifier_config["email"],
-            auth_code=auth_code,
-            recipient_email=notifier_config["email"],
-            subject=subject,
-            body=body,
-        )
+        with metrics.timed("email_send"):
+            if dispatcher is not None:
+                success, error_msg = dispatcher.send(
+                    notifier_config["email"], auth_code, notifier_config["email"], subject, body
+                )
+            else:
+                from send_email import send_notification_email  # smtplib/email 只在需要发邮件时加载
+
+                success, error_msg = send_notification_email(
+                    sender_email=notifier_config["email"],
+                    auth_code=auth_code,
+                    recipient_email=notifier_config["email"],
+                    subject=subject,
+                    body=body,
+                )
         if success:
-            logger.info(f"邮件通知发送成功到{notifier_config['email']}。")
-            print("[成功] 邮件通知发送成功。")
-        else:
-            print(f"[警告] 邮件通知发送失败，请检查 setup 中的邮箱配置。")
-            logger.error(
-                f"邮件通知发送失败到{notifier_config['email']}。错误信息: {error_msg}"
-            )
-            logger.debug(
-                f"发送邮件详细信息: 发件人={notifier_config['email']}, 收件人={notifier_config['email']}, 主题={subject}"
-            )
+            save_alert_states()
+        report_email_result(notifier_config["email"], subject, success, error_msg)
     else:
         logger.info("未配置邮箱通知，跳过发送邮件。")
         # 如果配置文件中没有邮箱信息，则不执行任何操作
         pass
 
 
-# --- 4. 主程序 ---
-if __name__ == "__main__":
-    if not check_and_update_cron():
-        logger.warning("迁移Linux定时任务设置失败。")
-
-    logger.info("--- 查询脚本开始运行 ---")
-    config = load_config(USER_CONFIG_FILE)
-    if not config:
-        msg = "因配置文件中房间参数无效或不存在，脚本退出。"
-        logger.error(msg)
-        print(f"\n[操作建议] 请先运行 setup 来生成 {USER_CONFIG_FILE}。")
-        logger.info("--- 查询脚本运行结束 ---\n")
-        sys.exit(1)
-
-    try:
-        if migrate_plaintext_to_encrypted(USER_CONFIG_FILE):
-            print("[信息] 已自动将配置中的明文密码/授权码迁移为密文并更新了配置文件。")
-            config = load_config(USER_CONFIG_FILE) or config
-    except Exception as e:
-        logger.warning(f"迁移明文配置为密文时出错: {e}")
-
-    selection = config["selection"]
+def report_email_result(recipient: str, subject: str, success: bool, error_msg: str):
+    """输出并记录一封邮件的发送结果。"""
+    metrics.inc("emails_total", "success" if success else "failure")
+    if success:
+        logger.info(f"邮件通知发送成功到{recipient}。", extra=log_fields(phase="email_send", result="success"))
+        print("[成功] 邮件通知发送成功。")
+    else:
+        print(f"[警告] 邮件通知发送失败，请检查 setup 中的邮箱配置。")
+        logger.error(
+            f"邮件通知发送失败到{recipient}。错误信息: {error_msg}",
+            extra=log_fields(phase="email_send", result="failure"),
+        )
+        logger.debug(f"发送邮件详细信息: 收件人={recipient}, 主题={subject}")
 
-    session = requests.Session()
-    session.headers.update(
-        {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36",
-            "X-Requested-With": "XMLHttpRequest",
-        }
-    )
 
-    is_session_valid = False
-    if load_cookies(session, COOKIE_FILE):
-        print("[信息] 正在验证会话有效性...")
-        try:
-            verify_headers = session.headers.copy()
-            del verify_headers["X-Requested-With"]
-            verify_response = session.get(
-                VERIFY_LOGIN_URL, headers=verify_headers, timeout=10
-            )  # 设置10秒超时
-            verify_response.raise_for_status()
-            if (
-                "j_spring_security_check" not in verify_response.text
-                and "j_username" not in verify_response.text
-            ):
-                print("[成功] 会话验证通过。")
-                logger.info("会话验证通过")
-                is_session_valid = True
-            else:
-                print("[警告] 会话已过期。")
-                logger.warning("会话已过期")
-        except requests.RequestException as e:
-            print("[警告] 会话验证请求失败。")
-            logger.warning(f"会话验证请求失败: {e}")
+# --- 3. 查询流程 ---
 
-    if not is_session_valid:
-        print("[信息] 会话无效或不存在，尝试使用配置文件自动登录...")
-        logger.info("会话无效或不存在，尝试使用配置文件自动登录")
-        if handle_relogin(session, config):
-            is_session_valid = True
 
-    # --- 执行查询 ---
+def verify_session(session: requests.Session) -> bool:
+    """访问 VERIFY_LOGIN_URL 检查本地会话是否仍然有效。"""
+    print("[信息] 正在验证会话有效性...")
+    try:
+        verify_headers = session.headers.copy()
+        del verify_headers["X-Requested-With"]
+        verify_response = session.get(VERIFY_LOGIN_URL, headers=verify_headers)
+        verify_response.raise_for_status()
+        if (
+            "j_spring_security_check" not in verify_response.text
+            and "j_username" not in verify_response.text
+        ):
+            print("[成功] 会话验证通过。")
+            logger.info("会话验证通过")
+            return True
+        print("[警告] 会话已过期。")
+        logger.warning("会话已过期")
+    except requests.RequestException as e:
+        print("[警告] 会话验证请求失败。")
+        logger.warning(f"会话验证请求失败: {e}")
+    return False
+
+
+def query_room(
+    session: requests.Session, selection: dict, relogin: Callable[[], bool]
+) -> dict:
+    """
+    查询单个房间的电费，失败时最多重连重试一次。
+
+    :param session: 已登录（或待重连）的会话，批量查询时所有房间共用
+    :param selection: 房间选择
+    :param relogin: 会话失效时调用的重连函数，返回是否重连成功
+    :return: 查询结果，包含 room_path / success / message / current_elec / meters
+    """
     selected_sysid = selection["system"]["id"]
-    token_page_url = (
-        f"{BASE_DOMAIN}/epay/electric/load4electricbill?elcsysid={selected_sysid}"
-    )
-    query_payload = {
-        "sysid": selected_sysid,
-        "elcarea": selection["area"]["id"],
-        "elcbuis": selection["buis"]["id"],
-        "roomNo": selection["room"]["id"],
+    query_payload = build_query_payload(selection)
+    room_path = format_room_path(selection)
+    outcome = {
+        "room_path": room_path,
+        "query_payload": query_payload,
+        "success": False,
+        "message": "",  # 用于邮件内容
+        "current_elec": -1,
+        "meters": [],
     }
-    room_path = (
-        f"{selection['system']['name']} > {selection['area']['name']} > {selection['district']['name']} > "
-        f"{selection['buis']['name']} > {selection['floor']['name']} > {selection['room']['name']}"
-    )
 
     print(f"\n--- 开始查询电费: {room_path} ---")
 
-    query_successful = False
-    final_message = ""  # 用于邮件内容
-    remaining_electricity = None  # 初始化剩余电量变量
-
     for attempt in range(2):
         try:
-            page_headers = session.headers.copy()
-            del page_headers["X-Requested-With"]
-            page_headers["Referer"] = LOAD_ELECTRIC_INDEX_URL
-            page_response = session.get(
-                token_page_url, headers=page_headers, timeout=10
-            )  # 设置10秒超时
-            page_response.raise_for_status()
-            final_csrf_token = extract_csrf_token(page_response.text)
+            phase = "token_fetch"
+            with metrics.timed(phase) as token_timer:
+                final_csrf_token = get_bill_csrf_token(session, selected_sysid)
 
             if not final_csrf_token:
                 # 将获取Token失败视为会话过期
                 msg = "无法获取执行查询所需的CSRF Token，可能由于会话失效。"
                 print(f"[警告] {msg}")
-                logger.warning(msg)
+                logger.warning(msg, extra=log_fields(query_payload, phase=phase, duration_ms=token_timer.ms))
 
                 if attempt == 0:  # 如果是第一次尝试，则进行重连
                     print("[信息] 正在触发自动重连...")
-                    if handle_relogin(session, config):
+                    if relogin():
                         print("[信息] 重连成功，正在重试查询...")
                         logger.info("重连成功，重试查询。")
                         continue
-                else:
-                    final_message = "重试后依然无法获取Token。"
-                    print(f"[错误] {final_message}")
-                    logger.error(final_message)
-                    break
+                outcome["message"] = f"查询房间: {room_path}\n\n重试后依然无法获取Token。"
+                print("[错误] 重试后依然无法获取Token。")
+                logger.error(
+                    f"重试后依然无法获取Token。 | 查询房间: {room_path}",
+                    extra=log_fields(query_payload, phase=phase, result="failure"),
+                )
+                break
 
             # 执行查询
-            query_headers = {
-                "X-CSRF-TOKEN": final_csrf_token,
-                "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-                "Referer": token_page_url,
-            }
-            query_response = session.post(
-                QUERY_URL, data=query_payload, headers=query_headers, timeout=10
-            )  # 设置10秒超时
-            query_response.raise_for_status()
-            result = query_response.json()
+            phase = "query"
+            with metrics.timed(phase) as query_timer:
+                result = post_electric_query(session, final_csrf_token, query_payload)
 
             # 显示并记录结果
             if result.get("retcode") == 0:
-                result_text = ""
+                result_text, current_elec, meters = parse_query_result(result)
                 if result.get("multiflag"):
                     print(
                         "\n========================\n查询成功！(该房间为一房多表模式)"
                     )
-                    meter_results = []
-                    for meter in result.get("elecRoomData", []):
-                        line = f"  - {meter.get('name')}: 剩余电量 {meter.get('restElecDegree')} 度"
-                        print(line)
-                        meter_results.append(line.strip())
+                    for name, degree in meters:
+                        print(f"  - {name}: 剩余电量 {degree} 度")
                     print("========================")
-                    result_text = " | ".join(meter_results)
-                    current_elec = float(
-                        result.get("elecRoomData", [{}])[0].get("restElecDegree", 0)
-                    )
                 else:
-                    remaining_electricity = result.get("restElecDegree")
-                    current_elec = float(remaining_electricity)
                     print("\n========================")
-                    print(f"查询成功！剩余电量: {remaining_electricity} 度")
+                    print(f"查询成功！{result_text}")
                     print("========================")
-                    result_text = f"剩余电量: {remaining_electricity} 度"
 
                 # 记录成功日志
                 logger.info(
                     "查询成功。\n"
                     f"\t查询房间: {room_path}\n"
                     f"\t查询参数: {query_payload}\n"
-                    f"\t查询结果: {result_text}"
+                    f"\t查询结果: {result_text}",
+                    extra=log_fields(
+                        query_payload, phase=phase, duration_ms=query_timer.ms, retcode=0,
+                        remaining=current_elec, result="success",
+                    ),
+                )
+                outcome.update(
+                    success=True,
+                    message=f"查询房间: {room_path}\n\n查询结果:\n{result_text}",
+                    current_elec=current_elec,
+                    meters=meters,
                 )
-                query_successful = True
-                final_message = f"查询房间: {room_path}\n\n查询结果:\n{result_text}"
                 break  # 查询成功，跳出循环
             else:
                 msg = f"查询失败: {result.get('retmsg')}"
                 print(msg)
                 logger.error(
-                    f"{msg} | 查询房间: {room_path} | 查询参数: {query_payload}"
+                    f"{msg} | 查询房间: {room_path} | 查询参数: {query_payload}",
+                    extra=log_fields(
+                        query_payload, phase=phase, duration_ms=query_timer.ms, retcode=result.get("retcode"),
+                        result="failure",
+                    ),
                 )
-                final_message = f"查询房间: {room_path}\n\n查询失败，服务器返回信息: {result.get('retmsg')}"
+                outcome["message"] = f"查询房间: {room_path}\n\n查询失败，服务器返回信息: {result.get('retmsg')}"
                 break  # 服务器返回错误，无需重试
 
         except (requests.RequestException, json.JSONDecodeError, Exception) as e:
             msg = f"查询过程中发生错误: {e}"
             print(f"[错误] {msg}")
-            logger.error(f"{msg} | 查询房间: {room_path} | 查询参数: {query_payload}")
-            final_message = (
+            logger.error(
+                f"{msg} | 查询房间: {room_path} | 查询参数: {query_payload}",
+                extra=log_fields(query_payload, phase=phase, result="error"),
+            )
+            outcome["message"] = (
                 f"查询房间: {room_path}\n\n查询脚本在执行过程中遇到一个错误: {e}"
             )
+            if isinstance(e, CsrfTokenRejected):
+                # 只有服务器明确拒绝时才丢弃缓存的Token，普通网络错误继续复用
+                invalidate_bill_csrf_token(session, selected_sysid)
             if attempt == 0 and isinstance(e, requests.RequestException):
                 print("[信息] 网络错误，尝试重新连接...")
                 logger.info("网络错误，尝试重新连接")
-                if handle_relogin(session, config):
+                if relogin():
                     print("[信息] 重连成功，重试查询...")
                     logger.info("重连成功，重试查询")
                     continue
             break  # 发生异常，无需重试
 
-    # 无论成功失败，都在最后发送邮件
-    if query_successful:
-        send_query_email(config, "电费查询成功通知", final_message, current_elec)
+    return outcome
+
+
+def attach_forecasts(outcomes: list, forecasts: dict):
+    """
+    把预测结果写入查询结果：hours_to_zero 取一房多表中最先耗尽的电表，
+    meter_hours 保存各电表的预计耗尽时间（{电表: 小时}），供守护进程按电表计算到提醒线的时间。
+    """
+    for outcome in outcomes:
+        if not outcome.get("success"):
+            continue
+        payload = outcome["query_payload"]
+        candidates = {}  # 电表 -> (rest, rate, hours_to_zero)
+        for meter, _ in outcome.get("meters", []):
+            forecast = forecasts.get((str(payload["sysid"]), str(payload["roomNo"]), meter or ""))
+            if forecast and forecast[2] is not None:
+                candidates[meter or ""] = forecast
+        if not candidates:
+            continue
+        _, rate, hours_to_zero = min(candidates.values(), key=lambda c: c[2])
+        outcome["hours_to_zero"] = hours_to_zero
+        outcome["meter_hours"] = {meter: forecast[2] for meter, forecast in candidates.items()}
+        outcome["message"] += (
+            f"\n\n预计可用时间: {format_hours(hours_to_zero)}（按近期平均用电 {rate:.2f} 度/小时估算）"
+        )
+
+
+def alert_room_key(outcome: dict) -> str:
+    """告警状态中的房间标识：有查询参数时为 "sysid/房间id"，否则为房间路径。"""
+    payload = outcome.get("query_payload")
+    if payload:
+        return f"{payload['sysid']}/{payload['roomNo']}"
+    return outcome["room_path"]
+
+
+def notify_room_result(config: dict, outcome: dict, dispatcher=None, alerts: AlertStateStore | None = None):
+    """根据单个房间的查询结果发送邮件通知。"""
+    alert_room = alert_room_key(outcome)
+    if outcome["success"]:
+        send_query_email(
+            config,
+            "电费查询成功通知",
+            outcome["message"],
+            outcome["current_elec"],
+            outcome.get("hours_to_zero"),
+            dispatcher=dispatcher,
+            alert_room=alert_room,
+            alerts=alerts,
+        )
     else:
-        send_query_email(config, "[警告] 电费查询失败通知", final_message, -1)
+        send_query_email(
+            config,
+            "[警告] 电费查询失败通知",
+            outcome["message"],
+            -1,
+            dispatcher=dispatcher,
+            alert_room=alert_room,
+            alerts=alerts,
+        )
         print("\n[操作建议] 请检查网络或运行 setup 刷新配置。")
 
+
+def print_batch_summary(outcomes: list):
+    """批量查询结束后逐个房间汇总结果。"""
+    succeeded = sum(1 for outcome in outcomes if outcome["success"])
+    print(f"\n--- 批量查询完成：成功 {succeeded} 个，失败 {len(outcomes) - succeeded} 个 ---")
+    for outcome in outcomes:
+        if outcome["success"]:
+            print(f"  [成功] {outcome['room_path']}: 剩余电量 {outcome['current_elec']} 度")
+        else:
+            print(f"  [失败] {outcome['room_path']}")
+    logger.info(f"批量查询完成：共 {len(outcomes)} 个房间，成功 {succeeded} 个")
+
+
+def create_session() -> requests.Session:
+    """创建带有默认请求头、连接池和自适应超时的会话。"""
+    return create_http_session()
+
+
+def ensure_session(
+    session: requests.Session,
+    config: dict,
+    fatal: bool = True,
+    cookie_file: str = COOKIE_FILE,
+    meta_file: str = SESSION_META_FILE,
+    notify: bool = True,
+) -> bool:
+    """
+    加载本地会话并在需要时验证/重连，整个运行过程中只需调用一次。
+
+    :param fatal: 重连失败时是否退出进程，守护进程中为False
+    :param cookie_file: 保存会话的文件，多账号时每个账号各有一个
+    :param meta_file: 记录会话最近一次确认有效时间的文件
+    :param notify: 重连失败时是否发送失败通知邮件，见 handle_relogin
+    :return: 会话是否可用
+    """
+    session_options = config.get("session") or {}
+    is_session_valid = False
+    with metrics.timed("cookie_load"):
+        loaded = load_cookies(session, cookie_file)
+    if loaded:
+        if session_options.get("optimistic", SESSION_OPTIMISTIC) or is_session_recently_verified(
+            meta_file, session_options.get("trust_seconds", SESSION_TRUST_SECONDS)
+        ):
+            # 乐观模式：跳过预检直接查询，查询时发现会话失效再重连
+            print("[信息] 跳过会话验证，直接使用本地会话。")
+            logger.info("跳过会话验证，直接使用本地会话")
+            is_session_valid = True
+        else:
+            with metrics.timed("session_verify"):
+                is_session_valid = verify_session(session)
+            if is_session_valid:
+                mark_session_verified(meta_file)
+
+    if not is_session_valid:
+        print("[信息] 会话无效或不存在，尝试使用配置文件自动登录...")
+        logger.info("会话无效或不存在，尝试使用配置文件自动登录")
+        if handle_relogin(session, config, fatal, cookie_file, meta_file, notify):
+            is_session_valid = True
+    return is_session_valid
+
+
+def run_queries(
+    session: requests.Session | None,
+    config: dict,
+    selections: list,
+    relogin: Callable[[], bool] | None,
+    max_age: float | None = None,
+    background_refresh: bool = True,
+) -> list:
+    """
+    逐个校验并查询全部房间，多个房间时并发执行，房间很多且配置了多个工作进程时分片到多个进程。
+    最近查询过的房间使用查询结果缓存，同一房间只查询一次（见 query_cache.py）。
+
+    :param max_age: 可使用的缓存结果的最长时间（秒），None 表示按 "query_cache" 的设置
+    :param background_refresh: 是否允许先使用较旧的缓存结果、在后台重新查询；为 False 时直接查询
+    :return: 与 selections 顺序一致的查询结果
+    """
+    outcomes = [None] * len(selections)
+    pending = []  # (序号, 房间选择)
+    for index, selection in enumerate(selections):
+        error = validate_selection(selection)
+        if error:
+            room_path = format_room_path(selection)
+            print(f"[错误] 房间 {room_path} 的配置无效: {error}")
+            logger.error(f"房间配置无效，跳过: {error} | 查询房间: {room_path}")
+            outcomes[index] = {
+                "room_path": room_path,
+                "success": False,
+                "message": f"查询房间: {room_path}\n\n房间配置无效: {error}",
+                "current_elec": -1,
+            }
+            continue
+        pending.append((index, selection))
+
+    shard_options = config.get("sharding") or {}
+    processes = resolve_shard_processes(shard_options)
+
+    def fetch(batch: list) -> list:
+        if processes > 1 and len(batch) >= shard_options.get("min_rooms", SHARD_MIN_ROOMS):
+            # 房间很多时分片交给多个工作进程，解析/解密/日志等CPU开销分摊到多个核心
+            from sharded_runner import run_sharded
+
+            return run_sharded(config, batch, processes)
+        return query_selections(session, config, batch, relogin)
+
+    valid_selections = [selection for _, selection in pending]
+    cache = get_query_cache(config) if valid_selections else None
+    if cache is not None:
+        # 多账号时各账号的会话由账号池管理，不在后台另外查询
+        refresh = background_refresh and not uses_account_pool(config)
+        results = cache.run(
+            valid_selections,
+            fetch,
+            (lambda batch: refresh_selections(config, batch)) if refresh else None,
+            max_age,
+            # 先返回了较旧结果的房间，后台重新查询到的结果同样记录读数并按告警状态通知
+            lambda refreshed: record_and_notify(config, refreshed),
+        )
+    else:
+        results = fetch(valid_selections)
+    for (index, _), outcome in zip(pending, results):
+        outcomes[index] = outcome
+    for outcome in outcomes:
+        metrics.inc("rooms_total", "success" if outcome["success"] else "failure")
+    return outcomes
+
+
+def resolve_shard_processes(shard_options: dict) -> int:
+    """用户配置 "sharding" 中的工作进程数，0 表示CPU核心数。"""
+    processes = shard_options.get("processes", SHARD_PROCESSES)
+    return processes if processes > 0 else os.cpu_count() or 1
+
+
+def query_selections(
+    session: requests.Session | None,
+    config: dict,
+    selections: list,
+    relogin: Callable[[], bool] | None,
+    notify_exhausted: bool = True,
+) -> list:
+    """
+    在当前进程中查询已校验的房间：配置了多个账号时交给账号池，否则使用 session。
+
+    :param notify_exhausted: 多账号时全部账号都不可用是否发送失败通知，见 AccountPool.run
+    :return: 与 selections 顺序一致的查询结果
+    """
+    if uses_account_pool(config):
+        from account_pool import get_account_pool
+
+        return get_account_pool(config).run(config, selections, notify_exhausted)
+    return query_with_session(session, config, selections, relogin)
+
+
+def refresh_selections(config: dict, selections: list) -> list:
+    """
+    在后台线程中重新查询房间（查询结果缓存使用）：使用单独的会话，不与前台查询共用 Session，
+    重连失败时只让这些房间查询失败，不退出进程。
+    """
+    session = create_session()
+    load_cookies(session, COOKIE_FILE)
+    return query_with_session(
+        session, config, selections, lambda: handle_relogin(session, config, fatal=False)
+    )
+
+
+def query_with_session(
+    session: requests.Session, config: dict, selections: list, relogin: Callable[[], bool]
+) -> list:
+    """
+    用同一个会话查询已校验的房间，多个房间时并发执行。
+
+    :param relogin: 会话失效时调用的重连函数；多个房间时失败必须返回 False 而不是退出进程
+    :return: 与 selections 顺序一致的查询结果
+    """
+    async_options = config.get("async_query") or {}
+    if len(selections) > 1 and async_options.get("enabled", True):
+        # 多个房间时并发查询，吞吐量取决于并发设置而不是房间数量
+        from async_query import run_batch_async  # 单个房间时无需加载 asyncio
+
+        print(f"[信息] 正在并发查询 {len(selections)} 个房间...")
+        results = run_batch_async(session, selections, relogin, async_options)
+    else:
+        login_failed = False
+
+        def relogin_once() -> bool:
+            # 重连失败后其余房间不再重复登录
+            nonlocal login_failed
+            if login_failed:
+                return False
+            login_failed = not relogin()
+            return not login_failed
+
+        results = [query_room(session, selection, relogin_once) for selection in selections]
+    save_latency_stats(session)
+    return results
+
+
+def finish_run(config: dict, outcomes: list):
+    """记录读数历史与预测，发送通知并输出汇总。"""
+    record_and_notify(config, outcomes)
+    if len(outcomes) > 1:
+        print_batch_summary(outcomes)
+
+
+def record_and_notify(config: dict, outcomes: list):
+    """
+    记录读数历史与预测，并按告警状态发送通知。
+
+    来自查询结果缓存的结果（cached 为 True）已由当初查询它的运行或后台重新查询记录和通知过，在此跳过，
+    读数、告警和邮件只按实际查询到的结果处理。查询结果缓存在后台重新查询到的结果也经由此函数处理。
+    """
+    outcomes = [outcome for outcome in outcomes if not outcome.get("cached")]
+    if any(outcome["success"] for outcome in outcomes):
+        if not uses_account_pool(config):
+            mark_session_verified(SESSION_META_FILE)
+        try:
+            readings = readings_from_outcomes(outcomes)
+            with ReadingStore() as store:
+                store.append(readings)
+                forecasts = Forecaster(store).observe(readings)
+            attach_forecasts(outcomes, forecasts)
+        except sqlite3.Error as e:
+            logger.warning(f"保存电量读数历史失败: {e}")
+
+    # 无论成功失败，都在最后发送邮件；多个房间时复用同一个SMTP连接，并可合并为一封汇总邮件
+    notifier_config = config.get("email_notifier") or {}
+    alerts = None
+    if notifier_config.get("email"):
+        try:
+            alerts = AlertStateStore()
+        except sqlite3.Error as e:
+            logger.warning(f"打开告警状态失败，本次通知不去重: {e}")
+    try:
+        if len(outcomes) > 1 and notifier_config.get("email"):
+            from send_email import NotificationDispatcher
+
+            with NotificationDispatcher(digest=notifier_config.get("digest", EMAIL_DIGEST)) as dispatcher:
+                for outcome in outcomes:
+                    notify_room_result(config, outcome, dispatcher, alerts)
+                if dispatcher.has_pending():
+                    print("[信息] 正在发送汇总邮件通知...")
+                    with metrics.timed("email_send"):
+                        results = dispatcher.flush()
+                    for recipient, subject, success, error_msg in results:
+                        report_email_result(recipient, subject, success, error_msg)
+        else:
+            for outcome in outcomes:
+                notify_room_result(config, outcome, alerts=alerts)
+    finally:
+        if alerts is not None:
+            alerts.close()
+
+
+def export_metrics(config: dict | None) -> None:
+    """按用户配置的 "metrics" 部分导出本次运行的各阶段耗时与计数。"""
+    options = (config or {}).get("metrics") or {}
+    if not options.get("enabled", METRICS_ENABLED):
+        return
+    metrics.export(options.get("json_file", METRICS_FILE), options.get("textfile", METRICS_TEXTFILE))
+
+
+def load_run_config() -> dict | None:
+    """读取用户配置，并在需要时把明文密码/授权码迁移为密文。"""
+    config = load_config(USER_CONFIG_FILE)
+    if not config:
+        return None
+    if config.get("logging"):
+        # 按用户配置重新创建日志处理器（轮转、异步写入、结构化日志）
+        setup_logger("TJUEcardQuery", config["logging"])
+    try:
+        if migrate_plaintext_to_encrypted(USER_CONFIG_FILE):
+            print("[信息] 已自动将配置中的明文密码/授权码迁移为密文并更新了配置文件。")
+            config = load_config(USER_CONFIG_FILE) or config
+    except Exception as e:
+        logger.warning(f"迁移明文配置为密文时出错: {e}")
+    return config
+
+
+def migrate_cron_once() -> bool:
+    """
+    执行一次性的旧定时任务迁移，成功后写入标记文件，之后的启动直接跳过（也不再加载 scheduler_setup）。
+
+    删除标记文件即可让下次启动重新检查。
+    """
+    if os.path.exists(CRON_MIGRATION_MARKER):
+        return True
+    from scheduler_setup import check_and_update_cron  # 导入用于检查和更新定时任务的函数
+
+    if not check_and_update_cron():
+        return False
+    try:
+        with open(CRON_MIGRATION_MARKER, "w", encoding="utf-8") as f:
+            f.write("1\n")
+    except OSError as e:
+        logger.warning(f"写入定时任务迁移标记失败: {e}")
+    return True
+
+
+# --- 4. 主程序 ---
+if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        # 打包后的程序启动多进程查询的工作进程时，工作进程在这里接管执行
+        import multiprocessing
+
+        multiprocessing.freeze_support()
+
+    # 本模块以 __main__ 运行，其他模块按需导入 TJUEcard_main 时使用同一份模块，不再重复加载和初始化
+    sys.modules.setdefault("TJUEcard_main", sys.modules[__name__])
+
+    parser = argparse.ArgumentParser(description="天津大学电费自动化查询")
+    parser.add_argument(
+        "--daemon", action="store_true", help="常驻后台，按配置的间隔定时查询，而不是查询一次后退出"
+    )
+    parser.add_argument(
+        "--processes", type=int, metavar="N", help="房间很多时使用 N 个进程分片查询，0 表示CPU核心数（覆盖配置中的 sharding.processes）"
+    )
+    args = parser.parse_args()
+
+    if not migrate_cron_once():
+        logger.warning("迁移Linux定时任务设置失败。")
+
+    if args.daemon:
+        from daemon import QueryDaemon
+
+        sys.exit(QueryDaemon(sys.modules[__name__]).run())
+
+    logger.info("--- 查询脚本开始运行 ---")
+    run_started = time.perf_counter()
+    config = load_run_config()
+    if not config:
+        msg = "因配置文件中房间参数无效或不存在，脚本退出。"
+        logger.error(msg)
+        print(f"\n[操作建议] 请先运行 setup 来生成 {USER_CONFIG_FILE}。")
+        logger.info("--- 查询脚本运行结束 ---\n")
+        sys.exit(1)
+
+    selections = expand_selections(load_selections(config))
+    if not selections:
+        msg = "配置中没有可查询的房间，脚本退出。"
+        print(f"[错误] {msg}")
+        logger.error(msg)
+        logger.info("--- 查询脚本运行结束 ---\n")
+        sys.exit(1)
+    if args.processes is not None:
+        config["sharding"] = {**(config.get("sharding") or {}), "processes": args.processes}
+    if len(selections) > 1:
+        print(f"[信息] 批量查询模式，共 {len(selections)} 个房间。")
+        logger.info(f"批量查询模式，共 {len(selections)} 个房间")
+
+    # --- 执行查询 ---
+    if uses_account_pool(config):
+        # 多个账号时由账号池为每个账号分别加载会话、按需重连
+        outcomes = run_queries(None, config, selections, None)
+    else:
+        # 会话验证/重连在整个运行过程中只做一次，所有房间共用同一个会话
+        session = create_session()
+        ensure_session(session, config)
+        # 多个房间时查询过程中重连失败只让剩余房间查询失败，已查询到的结果照常记录和通知
+        fatal = len(selections) == 1
+        outcomes = run_queries(session, config, selections, lambda: handle_relogin(session, config, fatal))
+    finish_run(config, outcomes)
+    # 使用了较旧的缓存结果时，等待后台重新查询完成后再退出
+    wait_for_refreshes()
+    metrics.observe("run", time.perf_counter() - run_started)
+    export_metrics(config)
+
     logger.info("--- 查询脚本运行结束 ---\n")
@@ -0,0 +1,301 @@
+"""
+多账号会话池：配置了多个校园账号时，把房间分给各账号并发查询，每个账号有自己的会话文件、限速和健康状态，
+避免所有请求都压在同一个账号上被服务器限流或踢下线。
+
+- 账号来自用户配置的 "accounts" 列表，每项与 "credentials" 的格式相同，可另设 requests_per_second / max_in_flight
+  覆盖 "async_query" 中的设置（限速按账号分别计算）。"credentials" 中的账号（如有）排在最前，继续使用 COOKIE_FILE，
+  其余账号的会话保存在 TJUEcard_session.<用户名>.json。
+- 房间按顺序平均分给当前可用的账号。
+- 某个账号连续自动登录失败 max_login_failures 次后暂停使用 cooldown_minutes 分钟，状态保存在 ACCOUNTS_STATE_FILE，
+  跨次运行有效。账号被暂停后不再尝试登录，剩余房间直接失败，不会拖慢整批查询；这些房间随后改由其他可用账号重新查询。
+- 单个账号登录失败时不发送失败通知邮件；只有本次运行中有账号登录失败、且全部账号都不可用时才发送一封。
+
+配置示例：
+    "accounts": [
+        {"username": "3020000001", "password_enc": {...}},
+        {"username": "3020000002", "password_enc": {...}, "requests_per_second": 2}
+    ],
+    "account_pool": {"max_login_failures": 3, "cooldown_minutes": 60}
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from config import (
+    ACCOUNT_COOLDOWN_MINUTES,
+    ACCOUNT_MAX_LOGIN_FAILURES,
+    ACCOUNTS_STATE_FILE,
+    BASE_DIR,
+    COOKIE_FILE,
+    SESSION_META_FILE,
+)
+from utils import build_query_payload, file_lock, format_room_path, setup_logger, split_evenly, write_json_atomic
+
+logger = setup_logger("TJUEcardQuery")
+
+# 可以在单个账号中覆盖的 "async_query" 选项
+_ACCOUNT_QUERY_OPTIONS = ("requests_per_second", "max_in_flight")
+
+
+def configured_accounts(config: dict) -> list:
+    """
+    用户配置中的全部账号（"credentials" 在前，之后是 "accounts"，按用户名去重），缺少用户名或密码的条目被忽略。
+
+    :return: [(账号配置, 会话文件, 会话确认时间文件), ...]
+    """
+    accounts, seen = [], set()
+    credentials = config.get("credentials") or {}
+    if credentials.get("username") and credentials.get("password_enc"):
+        accounts.append((credentials, COOKIE_FILE, SESSION_META_FILE))
+        seen.add(str(credentials["username"]))
+    for entry in config.get("accounts") or []:
+        if not isinstance(entry, dict) or not entry.get("username") or not entry.get("password_enc"):
+            logger.warning("accounts 中有缺少用户名或密码的账号，已忽略")
+            continue
+        username = str(entry["username"])
+        if username in seen:
+            continue
+        seen.add(username)
+        safe_name = re.sub(r"[^0-9A-Za-z_.-]", "_", username)
+        accounts.append((
+            entry,
+            os.path.join(BASE_DIR, f"TJUEcard_session.{safe_name}.json"),
+            os.path.join(BASE_DIR, f"TJUEcard_session.{safe_name}.meta.json"),
+        ))
+    return accounts
+
+
+def uses_account_pool(config: dict | None) -> bool:
+    """是否配置了多个账号。"""
+    return bool(config and config.get("accounts")) and len(configured_accounts(config)) > 1
+
+
+class Account:
+    """
+    一个账号的会话与健康状态。
+
+    :param credentials: 账号配置，包含 username / password_enc
+    :param cookie_file: 该账号的会话文件
+    :param meta_file: 该账号的会话确认时间文件
+    """
+
+    def __init__(self, credentials: dict, cookie_file: str, meta_file: str):
+        self.credentials = credentials
+        self.username = str(credentials["username"])
+        self.cookie_file = cookie_file
+        self.meta_file = meta_file
+        self.session = None
+        self.failures = 0  # 连续自动登录失败次数
+        self.disabled_until = 0.0  # 暂停使用到该时间
+        self._ready = False  # 会话是否已加载/验证
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return time.time() >= self.disabled_until
+
+    def run_config(self, config: dict) -> dict:
+        """查询该账号的房间时使用的配置：凭据换成本账号的，并应用账号自己的限速。"""
+        async_options = dict(config.get("async_query") or {})
+        async_options.update({key: self.credentials[key] for key in _ACCOUNT_QUERY_OPTIONS if key in self.credentials})
+        return {**config, "credentials": self.credentials, "accounts": [], "async_query": async_options}
+
+    def record_login(self, success: bool, max_failures: int, cooldown_minutes: float) -> None:
+        """记录一次自动登录的结果，连续失败达到上限时暂停使用该账号。"""
+        with self._lock:
+            if success:
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.failures < max_failures:
+                return
+            self.disabled_until = time.time() + cooldown_minutes * 60
+        msg = f"账号 {self.username} 连续 {self.failures} 次自动登录失败，暂停使用 {cooldown_minutes:g} 分钟"
+        print(f"[警告] {msg}。")
+        logger.warning(msg)
+        metrics.inc("account_disabled_total")
+
+    def prepare(self, config: dict) -> bool:
+        """首次使用时加载该账号的会话并在需要时登录，返回会话是否可用。"""
+        from TJUEcard_main import create_session, ensure_session
+
+        if self.session is None:
+            self.session = create_session()
+            self._ready = False
+        if not self._ready:
+            self._ready = ensure_session(
+                self.session, config, False, self.cookie_file, self.meta_file, notify=False
+            )
+        return self._ready
+
+
+class AccountPool:
+    """
+    多个账号组成的会话池。
+
+    :param accounts: configured_accounts 的返回值
+    :param options: 用户配置中的 "account_pool" 部分，可包含 max_login_failures / cooldown_minutes
+    :param state_file: 保存各账号健康状态的文件
+    """
+
+    def __init__(self, accounts: list, options: dict | None = None, state_file: str = ACCOUNTS_STATE_FILE):
+        options = options or {}
+        self.accounts = [Account(*account) for account in accounts]
+        self.max_failures = max(1, int(options.get("max_login_failures", ACCOUNT_MAX_LOGIN_FAILURES)))
+        self.cooldown_minutes = float(options.get("cooldown_minutes", ACCOUNT_COOLDOWN_MINUTES))
+        self.state_file = state_file
+
+    def load_state(self) -> None:
+        """读取其他进程或上次运行记录的健康状态。"""
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if not isinstance(state, dict):
+            return
+        for account in self.accounts:
+            entry = state.get(account.username)
+            if isinstance(entry, dict):
+                account.failures = int(entry.get("failures", 0))
+                account.disabled_until = float(entry.get("disabled_until", 0))
+
+    def save_state(self) -> None:
+        """在文件锁内把本进程中各账号的健康状态合并写回。"""
+        try:
+            with file_lock(self.state_file):
+                try:
+                    with open(self.state_file, "r", encoding="utf-8") as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    state = {}
+                if not isinstance(state, dict):
+                    state = {}
+                for account in self.accounts:
+                    state[account.username] = {"failures": account.failures, "disabled_until": account.disabled_until}
+                write_json_atomic(self.state_file, state, indent=2)
+        except (OSError, TimeoutError) as e:
+            logger.warning(f"保存账号状态失败: {e}")
+
+    def _relogin(self, account: Account, config: dict) -> bool:
+        from TJUEcard_main import handle_relogin
+
+        if not account.available:
+            return False  # 账号已暂停使用，剩余房间直接失败，稍后由其他账号重新查询
+        success = handle_relogin(
+            account.session, config, False, account.cookie_file, account.meta_file, notify=False
+        )
+        account.record_login(success, self.max_failures, self.cooldown_minutes)
+        return success
+
+    def _query_account(self, account: Account, config: dict, selections: list) -> tuple[list, bool]:
+        """
+        用一个账号查询一组房间。
+
+        :return: (查询结果, 该账号在查询中是否出了问题)
+        """
+        from TJUEcard_main import query_with_session
+
+        account_config = account.run_config(config)
+        if not account.prepare(account_config):
+            account.record_login(False, self.max_failures, self.cooldown_minutes)
+            message = f"账号 {account.username} 无法登录"
+            return [_unavailable_outcome(selection, message) for selection in selections], True
+        outcomes = query_with_session(
+            account.session, account_config, selections, lambda: self._relogin(account, account_config)
+        )
+        if any(outcome["success"] for outcome in outcomes):
+            account.failures = 0
+        return outcomes, not account.available
+
+    def run(self, config: dict, selections: list, notify_exhausted: bool = True) -> list:
+        """
+        把房间分给可用账号并发查询；查询中被暂停的账号负责的失败房间改由其余账号再查询一次。
+
+        :param notify_exhausted: 本次有账号登录失败且全部账号都不可用时是否发送一封失败通知邮件；
+            多进程分片的工作进程中为 False，由主进程按各房间的查询结果通知
+        :return: 与 selections 顺序一致的查询结果
+        """
+        self.load_state()
+        outcomes = [None] * len(selections)
+        pending = list(range(len(selections)))
+        excluded = set()  # 本次运行中出过问题的账号
+        while pending:
+            accounts = [account for account in self.accounts if account.available and account.username not in excluded]
+            if not accounts:
+                break
+            groups = split_evenly(pending, len(accounts))
+            print(f"[信息] 使用 {len(groups)} 个账号查询 {len(pending)} 个房间...")
+            logger.info(f"多账号查询：{len(groups)} 个账号，{len(pending)} 个房间")
+            with ThreadPoolExecutor(max_workers=len(groups), thread_name_prefix="TJUEcardAccount") as executor:
+                futures = [
+                    executor.submit(self._query_account, account, config, [selections[index] for index in group])
+                    for account, group in zip(accounts, groups)
+                ]
+            retry = []
+            for account, group, future in zip(accounts, groups, futures):
+                results, failed = future.result()
+                if failed:
+                    excluded.add(account.username)
+                for index, outcome in zip(group, results):
+                    outcomes[index] = outcome
+                    if failed and not outcome["success"]:
+                        retry.append(index)
+            if retry and len(excluded) < len(self.accounts):
+                print(f"[信息] 有 {len(retry)} 个房间所用的账号不可用，改用其他账号重新查询。")
+                logger.info(f"{len(retry)} 个房间改用其他账号重新查询")
+            pending = sorted(retry)
+
+        for index, outcome in enumerate(outcomes):
+            if outcome is None:
+                outcomes[index] = _unavailable_outcome(selections[index], "没有可用的账号（全部暂停使用中）")
+        self.save_state()
+        if pending and excluded and notify_exhausted:
+            self._notify_exhausted(config, sorted(excluded), len(pending))
+        return outcomes
+
+    @staticmethod
+    def _notify_exhausted(config: dict, failed: list, rooms: int) -> None:
+        """全部账号都不可用时发送一封失败通知，代替每个账号各自发送。"""
+        from TJUEcard_main import send_query_email
+
+        msg = f"全部账号都不可用，{rooms} 个房间未能查询。本次登录失败的账号: {', '.join(failed)}，保存的密码可能已更改。"
+        print(f"[错误] {msg}")
+        logger.error(msg)
+        print("\n[操作建议] 请重新运行 setup 或更新配置中的 accounts。")
+        send_query_email(config, "[警告] 电费查询失败通知", msg, -1)
+
+
+def _unavailable_outcome(selection: dict, reason: str) -> dict:
+    room_path = format_room_path(selection)
+    return {
+        "room_path": room_path,
+        "query_payload": build_query_payload(selection),
+        "success": False,
+        "message": f"查询房间: {room_path}\n\n{reason}，本次未能查询。",
+        "current_elec": -1,
+        "meters": [],
+    }
+
+
+_pools: dict = {}  # 账号配置 -> AccountPool，守护进程中各轮查询复用同一组会话
+_pools_lock = threading.Lock()
+
+
+def get_account_pool(config: dict) -> AccountPool:
+    """返回与当前账号配置对应的会话池，配置未改变时复用已有的会话。"""
+    accounts = configured_accounts(config)
+    options = config.get("account_pool") or {}
+    key = json.dumps([account for account, _, _ in accounts] + [options], sort_keys=True, default=str)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = AccountPool(accounts, options)
+        return pool
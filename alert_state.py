@@ -0,0 +1,111 @@
+"""
+告警状态：按 (房间, 告警类型) 记录告警是否处于触发状态以及上次发送时间，避免每次定时查询都重复发送相同的提醒。
+- 迟滞：低于阈值时告警，只有回升到阈值加余量以上才重新布防，在阈值附近波动不会反复发送。
+- 冷却：告警解除后在冷却时间内再次触发，只记录状态不发送邮件；仍处于触发状态时可按 repeat_hours 定期重复提醒。
+- 恢复通知：告警解除时可发送一封"已恢复"通知。
+
+状态表与读数历史保存在同一个数据库（READINGS_FILE）中。
+"""
+
+from __future__ import annotations
+
+import sqlite3
+import time
+
+from config import READINGS_FILE
+
+# 告警类型
+LOW_BALANCE = "low_balance"  # 剩余电量低于 notification_threshold
+DEPLETION = "depletion"  # 预计在 depletion_alert_hours 内耗尽
+QUERY_FAILED = "query_failed"  # 查询失败
+
+# evaluate() 的判定结果
+FIRE = "fire"  # 发送告警
+SUPPRESS = "suppress"  # 告警仍然成立，但不重复发送
+RESOLVE = "resolve"  # 告警解除
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alert_state (
+    room       TEXT    NOT NULL,
+    alert_type TEXT    NOT NULL,
+    active     INTEGER NOT NULL,
+    last_sent  INTEGER,          -- 上次发送告警的时间，从未发送过为 NULL
+    PRIMARY KEY (room, alert_type)
+) WITHOUT ROWID;
+"""
+
+
+class AlertStateStore:
+    """
+    持久化的告警状态。
+
+    :param path: 数据库文件路径，默认 READINGS_FILE
+    """
+
+    def __init__(self, path: str = READINGS_FILE):
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def evaluate(
+        self,
+        room: str,
+        alert_type: str,
+        triggered: bool,
+        rearmed: bool,
+        cooldown_hours: float = 0,
+        repeat_hours: float = 0,
+        now: float | None = None,
+    ) -> tuple[str | None, tuple | None]:
+        """
+        根据本次查询结果判断是否需要发送告警。只读取状态，不写入。
+
+        :param triggered: 本次是否满足告警条件
+        :param rearmed: 本次是否已越过重新布防的界限（例如回升到阈值加余量以上）
+        :param cooldown_hours: 告警解除后再次触发时，距上次发送不足该时间则不发送
+        :param repeat_hours: 告警持续时每隔该时间重复提醒一次，<=0 表示不重复
+        :return: (判定结果, 待保存的新状态)。判定结果为 FIRE / SUPPRESS / RESOLVE / None（无事发生）；
+            新状态需要在邮件发送成功后（SUPPRESS 时立即）用 save() 保存，为 None 时无需保存
+        """
+        now = int(now if now is not None else time.time())
+        row = self.conn.execute(
+            "SELECT active, last_sent FROM alert_state WHERE room = ? AND alert_type = ?", (room, alert_type)
+        ).fetchone()
+        active, last_sent = row if row else (0, None)
+
+        if triggered:
+            if not active:
+                if last_sent is not None and now - last_sent < cooldown_hours * 3600:
+                    # 冷却期内再次触发：只记录为触发状态，不发送
+                    return SUPPRESS, (1, last_sent)
+                return FIRE, (1, now)
+            if repeat_hours > 0 and (last_sent is None or now - last_sent >= repeat_hours * 3600):
+                return FIRE, (1, now)
+            return SUPPRESS, None
+        if active and rearmed:
+            return RESOLVE, (0, last_sent)
+        return None, None
+
+    def save(self, room: str, alert_type: str, state: tuple) -> None:
+        """保存 evaluate() 返回的新状态 (active, last_sent)。"""
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO alert_state (room, alert_type, active, last_sent) VALUES (?, ?, ?, ?)",
+                (room, alert_type, *state),
+            )
+
+    def active_alerts(self) -> list:
+        """返回全部处于触发状态的告警 [(room, alert_type, last_sent), ...]。"""
+        return self.conn.execute(
+            "SELECT room, alert_type, last_sent FROM alert_state WHERE active = 1 ORDER BY room, alert_type"
+        ).fetchall()
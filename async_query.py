@@ -0,0 +1,260 @@
+"""
+基于 asyncio 的批量电费查询引擎：
+- 所有房间共用同一个 requests.Session（同一个 cookie jar），请求在线程池中执行，事件循环负责调度。
+- max_in_flight 限制同时进行中的请求数，requests_per_second 限制每个主机的请求速率。
+- 与同步流程保持相同的语义：先取电费页面的 CSRF Token 再提交查询，Token 缺失或网络错误时重连一次后重试。
+- 多个房间同时发现会话失效时只重连一次，其余房间等待重连结果后直接重试。
+- 重连失败后不再重连，尚未发出请求的房间直接记为查询失败，已查询到的结果照常返回。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from urllib.parse import urlparse
+
+import requests
+
+from config import BASE_DOMAIN, ASYNC_MAX_IN_FLIGHT, ASYNC_REQUESTS_PER_SECOND
+import metrics
+from http_client import mount_adapter
+from utils import (
+    build_query_payload,
+    format_room_path,
+    parse_query_result,
+    get_bill_csrf_token,
+    invalidate_bill_csrf_token,
+    CsrfTokenRejected,
+    post_electric_query,
+    log_fields,
+    setup_logger,
+)
+
+logger = setup_logger("TJUEcardQuery")
+
+
+def _timed(phase: str, func, *args):
+    """在线程池中执行 func，返回 (结果, 耗时毫秒)，耗时同时计入运行指标。"""
+    with metrics.timed(phase) as stopwatch:
+        result = func(*args)
+    return result, stopwatch.ms
+
+
+class _ReloginFailed(Exception):
+    """本批查询中重连已经失败，不再为剩余房间发出请求。"""
+
+
+class HostRateLimiter:
+    """按主机划分的令牌桶限速器。"""
+
+    def __init__(self, requests_per_second: float, burst: int = 1):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self.burst = max(1, burst)
+        self._next_slot: dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, host: str) -> None:
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            # 允许最多 burst 个请求连续发出，之后按固定间隔放行
+            slot = max(self._next_slot.get(host, now), now - self.interval * (self.burst - 1))
+            self._next_slot[host] = slot + self.interval
+        delay = slot - now
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AsyncQueryEngine:
+    """
+    并发执行多个房间的电费查询。
+
+    :param session: 所有房间共用的会话
+    :param relogin: 会话失效时调用的同步重连函数，返回是否重连成功；失败时必须返回 False 而不是退出进程
+                    （例如 handle_relogin(..., fatal=False)），否则已查询到的结果会随进程一起丢失
+    :param max_in_flight: 同时进行中的请求数上限
+    :param requests_per_second: 每个主机每秒最多发起的请求数，<=0 表示不限速
+    """
+
+    def __init__(
+        self,
+        session: requests.Session,
+        relogin: Callable[[], bool],
+        max_in_flight: int = ASYNC_MAX_IN_FLIGHT,
+        requests_per_second: float = ASYNC_REQUESTS_PER_SECOND,
+    ):
+        self.session = session
+        self.relogin = relogin
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.rate_limiter = HostRateLimiter(requests_per_second, burst=self.max_in_flight)
+        self._host = urlparse(BASE_DOMAIN).netloc
+        self._executor: ThreadPoolExecutor | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._relogin_lock: asyncio.Lock | None = None
+        self._generation = 0  # 每次重连成功加一，用于合并并发的重连请求
+        self._relogin_failed = False
+
+        # 连接池需要不小于并发数，避免连接被反复丢弃重建
+        mount_adapter(session, self.max_in_flight)
+
+    async def _call(self, func, *args):
+        """限速、限并发后在线程池中执行一次同步HTTP调用。"""
+        async with self._semaphore:
+            if self._relogin_failed:
+                raise _ReloginFailed()
+            await self.rate_limiter.acquire(self._host)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _relogin(self, seen_generation: int) -> bool:
+        async with self._relogin_lock:
+            if self._generation != seen_generation:
+                # 等待期间其他房间已经完成了重连
+                return True
+            if self._relogin_failed:
+                return False
+            loop = asyncio.get_running_loop()
+            try:
+                ok = await loop.run_in_executor(self._executor, self.relogin)
+            except Exception as e:
+                logger.error(f"重新登录时发生错误: {e}")
+                ok = False
+            if ok:
+                self._generation += 1
+            else:
+                self._relogin_failed = True
+                logger.error("重新登录失败，本批剩余的房间不再查询")
+            return ok
+
+    async def query_room(self, selection: dict) -> dict:
+        """查询单个房间，返回值与 TJUEcard_main.query_room 相同。"""
+        sysid = selection["system"]["id"]
+        query_payload = build_query_payload(selection)
+        room_path = format_room_path(selection)
+        outcome = {
+            "room_path": room_path,
+            "query_payload": query_payload,
+            "success": False,
+            "message": "",
+            "current_elec": -1,
+            "meters": [],
+        }
+
+        for attempt in range(2):
+            generation = self._generation
+            try:
+                phase = "token_fetch"
+                csrf_token, token_ms = await self._call(_timed, phase, get_bill_csrf_token, self.session, sysid)
+                if not csrf_token:
+                    logger.warning(
+                        f"无法获取执行查询所需的CSRF Token，可能由于会话失效。 | 查询房间: {room_path}",
+                        extra=log_fields(query_payload, phase=phase, duration_ms=token_ms),
+                    )
+                    if attempt == 0 and await self._relogin(generation):
+                        continue
+                    outcome["message"] = f"查询房间: {room_path}\n\n重试后依然无法获取Token。"
+                    logger.error(
+                        f"重试后依然无法获取Token。 | 查询房间: {room_path}",
+                        extra=log_fields(query_payload, phase=phase, result="failure"),
+                    )
+                    break
+
+                phase = "query"
+                result, query_ms = await self._call(
+                    _timed, phase, post_electric_query, self.session, csrf_token, query_payload
+                )
+                if result.get("retcode") == 0:
+                    result_text, current_elec, meters = parse_query_result(result)
+                    logger.info(
+                        "查询成功。\n"
+                        f"\t查询房间: {room_path}\n"
+                        f"\t查询参数: {query_payload}\n"
+                        f"\t查询结果: {result_text}",
+                        extra=log_fields(
+                            query_payload, phase=phase, duration_ms=query_ms, retcode=0,
+                            remaining=current_elec, result="success",
+                        ),
+                    )
+                    print(f"[成功] {room_path}: {result_text}")
+                    outcome.update(
+                        success=True,
+                        message=f"查询房间: {room_path}\n\n查询结果:\n{result_text}",
+                        current_elec=current_elec,
+                        meters=meters,
+                    )
+                else:
+                    msg = f"查询失败: {result.get('retmsg')}"
+                    logger.error(
+                        f"{msg} | 查询房间: {room_path} | 查询参数: {query_payload}",
+                        extra=log_fields(
+                            query_payload, phase=phase, duration_ms=query_ms, retcode=result.get("retcode"),
+                            result="failure",
+                        ),
+                    )
+                    outcome["message"] = f"查询房间: {room_path}\n\n查询失败，服务器返回信息: {result.get('retmsg')}"
+                break
+
+            except _ReloginFailed:
+                outcome["message"] = f"查询房间: {room_path}\n\n会话已失效且重新登录失败，未查询该房间。"
+                logger.error(
+                    f"重新登录失败，跳过查询 | 查询房间: {room_path}",
+                    extra=log_fields(query_payload, phase=phase, result="failure"),
+                )
+                break
+
+            except (requests.RequestException, json.JSONDecodeError, Exception) as e:
+                msg = f"查询过程中发生错误: {e}"
+                logger.error(
+                    f"{msg} | 查询房间: {room_path} | 查询参数: {query_payload}",
+                    extra=log_fields(query_payload, phase=phase, result="error"),
+                )
+                outcome["message"] = f"查询房间: {room_path}\n\n查询脚本在执行过程中遇到一个错误: {e}"
+                if isinstance(e, CsrfTokenRejected):
+                    # 只有服务器明确拒绝时才丢弃缓存的Token，普通网络错误继续复用
+                    invalidate_bill_csrf_token(self.session, sysid)
+                if attempt == 0 and isinstance(e, requests.RequestException):
+                    logger.info(f"网络错误，尝试重新连接 | 查询房间: {room_path}")
+                    if await self._relogin(generation):
+                        continue
+                break
+
+        if not outcome["success"]:
+            print(f"[失败] {room_path}")
+        return outcome
+
+    async def run(self, selections: list) -> list:
+        """并发查询全部房间，结果顺序与 selections 一致。"""
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._relogin_lock = asyncio.Lock()
+        with ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="TJUEcardQuery") as executor:
+            self._executor = executor
+            try:
+                return await asyncio.gather(*(self.query_room(selection) for selection in selections))
+            finally:
+                self._executor = None
+
+
+def run_batch_async(
+    session: requests.Session, selections: list, relogin: Callable[[], bool], options: dict | None = None
+) -> list:
+    """
+    同步入口：在新的事件循环中并发查询全部房间。
+
+    :param session: 所有房间共用的会话
+    :param selections: 已校验的房间选择列表
+    :param relogin: 会话失效时调用的非致命重连函数，失败时返回 False
+    :param options: 用户配置中的 "async_query" 部分，可包含 max_in_flight / requests_per_second
+    :return: 每个房间的查询结果
+    """
+    options = options or {}
+    engine = AsyncQueryEngine(
+        session,
+        relogin,
+        max_in_flight=options.get("max_in_flight", ASYNC_MAX_IN_FLIGHT),
+        requests_per_second=options.get("requests_per_second", ASYNC_REQUESTS_PER_SECOND),
+    )
+    return asyncio.run(engine.run(selections))
@@ -0,0 +1,68 @@
+"""
+CSRF Token 提取基准测试：对比 BeautifulSoup 全量解析与流式快速路径。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_csrf.py [--number 200]
+
+fixtures/ 中是电费页面和登录页面的脱敏样本，结构与线上页面一致。
+"""
+
+import argparse
+import io
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from utils import _extract_csrf_token_bs, extract_csrf_token, extract_csrf_token_from_response  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+CASES = [
+    ("load4electricbill.html", "meta"),
+    ("person_index_login.html", "input"),
+]
+
+
+def _make_response(data: bytes) -> requests.Response:
+    """构造一个以流方式读取的响应对象，模拟 stream=True 的请求。"""
+    response = requests.Response()
+    response.status_code = 200
+    response.raw = io.BytesIO(data)
+    response.headers["Content-Length"] = str(len(data))
+    response.encoding = "utf-8"
+    return response
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CSRF Token 提取基准测试")
+    parser.add_argument("--number", type=int, default=200, help="每种方式的重复次数")
+    args = parser.parse_args()
+
+    for filename, tag in CASES:
+        with open(os.path.join(FIXTURES_DIR, filename), "rb") as f:
+            data = f.read()
+        text = data.decode("utf-8")
+
+        expected = _extract_csrf_token_bs(text, tag)
+        assert extract_csrf_token(text, tag) == expected
+        assert extract_csrf_token_from_response(_make_response(data), tag) == expected
+
+        timings = {
+            "BeautifulSoup": timeit.timeit(lambda: _extract_csrf_token_bs(text, tag), number=args.number),
+            "正则(整页文本)": timeit.timeit(lambda: extract_csrf_token(text, tag), number=args.number),
+            "流式(iter_content)": timeit.timeit(
+                lambda: extract_csrf_token_from_response(_make_response(data), tag), number=args.number
+            ),
+        }
+        baseline = timings["BeautifulSoup"]
+        print(f"\n{filename} ({len(data) / 1024:.1f} KB, <{tag} name=\"_csrf\">)")
+        for name, total in timings.items():
+            per_call_us = total / args.number * 1e6
+            print(f"  {name:<20} {per_call_us:10.1f} us/次   x{baseline / total:6.1f}")
+
+
+if __name__ == "__main__":
+    main()
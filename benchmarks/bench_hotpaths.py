@@ -0,0 +1,198 @@
+"""
+每次查询在本地执行的 CPU 热点路径基准测试，结果可保存为 JSON 并与基线对比，用于在部署到低功耗主机之前发现性能退化。
+
+覆盖的路径：
+- extract_csrf_token / extract_csrf_token_from_response：电费页面和登录页面（fixtures/ 中的脱敏样本）
+- load_config：读取并校验 20 个房间的配置文件
+- load_cookies：读取 JSON 会话文件
+- decrypt_from_storage：首次解密（含读取密钥文件）与命中缓存
+- 查询结果解析：json.loads + parse_query_result，单表与一房多表
+- build_message：构造 MIMEText 通知邮件并序列化
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_hotpaths.py --json host_baseline.json          # 在部署主机上记录基线
+    python benchmarks/bench_hotpaths.py --baseline host_baseline.json      # 与基线对比，退化超过阈值时返回 1
+
+各项记录 --repeat 轮中每次调用耗时的中位数和最小值。与基线对比时使用最小值，它受系统中其他进程干扰最小；
+基线与当前结果应在同一台主机上测得。benchmarks/baseline.json 是在开发环境中测得的参考结果，
+只用于了解各项的量级，环境不同时对比会给出警告。
+密钥和配置文件写在临时目录中，不会读写程序目录下的 .tjuecard_key 和会话文件。
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+import crypto_store  # noqa: E402
+from bench_csrf import FIXTURES_DIR, _make_response  # noqa: E402
+from send_email import build_message  # noqa: E402
+from utils import extract_csrf_token, extract_csrf_token_from_response, load_config, load_cookies, parse_query_result  # noqa: E402
+
+
+def _read_fixture(filename: str, mode: str = "r"):
+    with open(os.path.join(FIXTURES_DIR, filename), mode, **({} if "b" in mode else {"encoding": "utf-8"})) as f:
+        return f.read()
+
+
+def build_cases(work_dir: str) -> dict:
+    """
+    准备各项基准测试，返回 {名称: 无参函数}。
+
+    :param work_dir: 存放临时密钥、配置和会话文件的目录
+    """
+    # 使用临时密钥文件，避免创建或改动程序目录下的密钥
+    crypto_store._KEY_FILE_PATH = os.path.join(work_dir, ".tjuecard_key")
+    crypto_store.clear_secret_cache()
+
+    config_path = os.path.join(work_dir, "config.json")
+    config = json.loads(_read_fixture("config.json"))
+    config["credentials"]["password_enc"] = crypto_store.encrypt_for_storage("loadtest-password")
+    config["email_notifier"]["auth_code_enc"] = crypto_store.encrypt_for_storage("abcdefghijklmnop")
+    with open(config_path, "w", encoding="utf-8") as f:
+        json.dump(config, f, ensure_ascii=False, indent=4)
+    password_blob = config["credentials"]["password_enc"]
+
+    cookie_path = os.path.join(work_dir, "TJUEcard_session.json")
+    shutil.copy(os.path.join(FIXTURES_DIR, "session.json"), cookie_path)
+    session = requests.Session()
+
+    bill_bytes = _read_fixture("load4electricbill.html", "rb")
+    login_bytes = _read_fixture("person_index_login.html", "rb")
+    bill_text, login_text = bill_bytes.decode("utf-8"), login_bytes.decode("utf-8")
+    single_result = _read_fixture("query_result.json")
+    multi_result = _read_fixture("query_result_multi.json")
+    body = "查询房间: 北洋园电控 > 北洋园校区 > 格园 > 1号楼 > 3层 > 312\n\n查询结果:\n剩余电量: 86.35 度"
+
+    def load_cookies_case():
+        session.cookies.clear()
+        load_cookies(session, cookie_path)
+
+    def decrypt_cold():
+        crypto_store.clear_secret_cache()
+        crypto_store.decrypt_from_storage(password_blob)
+
+    return {
+        "csrf_meta": lambda: extract_csrf_token(bill_text, "meta"),
+        "csrf_input": lambda: extract_csrf_token(login_text, "input"),
+        "csrf_meta_stream": lambda: extract_csrf_token_from_response(_make_response(bill_bytes), "meta"),
+        "load_config": lambda: load_config(config_path),
+        "load_cookies": load_cookies_case,
+        "decrypt_cold": decrypt_cold,
+        "decrypt_cached": lambda: crypto_store.decrypt_from_storage(password_blob),
+        "parse_result": lambda: parse_query_result(json.loads(single_result)),
+        "parse_result_multi": lambda: parse_query_result(json.loads(multi_result)),
+        "build_message": lambda: build_message("12345@qq.com", "12345@qq.com", "[警告] 电费余额不足提醒", body).as_string(),
+    }
+
+
+def run_case(func, repeat: int, min_time: float) -> dict:
+    """
+    先自动确定每轮调用次数（每轮至少 min_time 秒），再重复 repeat 轮。
+
+    :return: 每次调用耗时（微秒）的中位数与最小值
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    per_call = [total / number * 1e6 for total in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "median_us": round(statistics.median(per_call), 3),
+        "min_us": round(min(per_call), 3),
+        "number": number,
+        "repeat": repeat,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    与基线对比每次调用耗时的最小值。
+
+    :return: 退化超过 threshold 的 [(名称, 基线微秒, 当前微秒, 变化比例), ...]
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        change = result["min_us"] / base["min_us"] - 1
+        result["baseline_us"] = base["min_us"]
+        result["change"] = round(change, 4)
+        if change > threshold:
+            regressions.append((name, base["min_us"], result["min_us"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询热点路径基准测试")
+    parser.add_argument("--repeat", type=int, default=7, help="每项重复的轮数")
+    parser.add_argument("--min-time", type=float, default=0.1, help="每轮的最短耗时（秒）")
+    parser.add_argument("--only", nargs="*", help="只运行名称中包含这些关键字的项目")
+    parser.add_argument("--json", metavar="FILE", help="把结果保存为 JSON（可作为以后的基线）")
+    parser.add_argument("--baseline", metavar="FILE", help="与基线 JSON 对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="比基线慢超过该比例时视为退化")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        cases = build_cases(work_dir)
+        for name, func in cases.items():
+            if args.only and not any(keyword in name for keyword in args.only):
+                continue
+            # load_config / load_cookies 会打印提示信息，计时期间丢弃输出
+            with contextlib.redirect_stdout(io.StringIO()):
+                results[name] = run_case(func, args.repeat, args.min_time)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        meta = baseline.get("meta") or {}
+        if (meta.get("platform"), meta.get("python")) != (platform.platform(), platform.python_version()):
+            print(
+                f"[警告] 基线在其他环境中测得（{meta.get('platform')}，Python {meta.get('python')}），"
+                "对比结果仅供参考，请在本机上重新记录基线。"
+            )
+        regressions = compare(results, baseline, args.threshold)
+
+    print(f"{'项目':<18} {'中位数(us)':>10} {'最小(us)':>10} {'基线最小(us)':>10} {'变化':>6}")
+    for name, result in results.items():
+        base = f"{result['baseline_us']:12.2f}" if "baseline_us" in result else f"{'-':>12}"
+        change = f"{result['change']:+8.1%}" if "change" in result else f"{'-':>8}"
+        print(f"{name:<20} {result['median_us']:12.2f} {result['min_us']:12.2f} {base} {change}")
+
+    if args.json:
+        report = {
+            "meta": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "machine": platform.machine(),
+                "timestamp": int(time.time()),
+            },
+            "results": results,
+        }
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"[成功] 结果已保存到 {args.json}")
+
+    if regressions:
+        for name, base, current, change in regressions:
+            print(f"[警告] {name} 比基线慢 {change:.1%}（{base:.2f} us -> {current:.2f} us）")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
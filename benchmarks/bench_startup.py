@@ -0,0 +1,105 @@
+"""
+启动耗时基准测试：用 python -X importtime 测量导入 TJUEcard_main 的耗时，并列出耗时最多的模块。
+
+用法（在仓库根目录执行）：
+    python benchmarks/bench_startup.py [--runs 10] [--top 15]
+
+--eager 会在导入 TJUEcard_main 之前先导入 bs4 / cryptography / smtplib / email.mime / asyncio / scheduler_setup，
+模拟改为按需加载之前的启动过程，用于对比。
+日志写在临时目录中，不会在程序目录下创建 TJUEcard.log。
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 只在特定代码路径上使用、启动时不应被加载的模块
+LAZY_MODULES = [
+    "bs4",
+    "cryptography.hazmat.primitives.ciphers.aead",
+    "smtplib",
+    "email.mime.text",
+    "asyncio",
+    "scheduler_setup",
+]
+
+
+def measure_once(eager: bool, log_dir: str) -> tuple[float, dict]:
+    """
+    启动一个新的解释器导入 TJUEcard_main。
+
+    :param log_dir: 存放日志文件的临时目录
+    :return: (进程总耗时毫秒, {模块名: 累计导入耗时微秒})
+    """
+    code = "import TJUEcard_main"
+    if eager:
+        code = "; ".join(f"import {name}" for name in LAZY_MODULES) + "; " + code
+    # 导入 TJUEcard_main 时会创建日志文件，先把日志路径改到临时目录（config 只含常量，不影响计时）
+    code = f"import config; config.LOG_FILE = {os.path.join(log_dir, 'TJUEcard.log')!r}; " + code
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # 格式："import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        cumulative[name.strip()] = (int(parts[1]), depth)
+    return wall_ms, cumulative
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TJUEcard_main 启动耗时基准测试")
+    parser.add_argument("--runs", type=int, default=10, help="重复启动次数")
+    parser.add_argument("--top", type=int, default=15, help="列出耗时最多的顶层导入数量")
+    parser.add_argument("--eager", action="store_true", help="同时测量预先导入全部重量级模块的情况，用于对比")
+    args = parser.parse_args()
+
+    modes = [("按需加载", False)] + ([("预先加载", True)] if args.eager else [])
+    with tempfile.TemporaryDirectory(prefix="tjuecard_bench_") as log_dir:
+        for label, eager in modes:
+            walls, imports, last = [], [], {}
+            for _ in range(args.runs):
+                wall_ms, last = measure_once(eager, log_dir)
+                walls.append(wall_ms)
+                # -c 代码中直接导入的模块位于第 0 层（解释器自身启动时导入的 site 等不计入）
+                total_us = sum(
+                    us
+                    for name, (us, depth) in last.items()
+                    if depth == 0 and name in LAZY_MODULES + ["TJUEcard_main"]
+                )
+                imports.append(total_us / 1000)
+
+            print(f"\n[{label}] {args.runs} 次启动")
+            print(f"  进程总耗时  中位数 {statistics.median(walls):8.1f} ms   最小 {min(walls):8.1f} ms")
+            print(f"  导入耗时    中位数 {statistics.median(imports):8.1f} ms   最小 {min(imports):8.1f} ms")
+            loaded = [name for name in LAZY_MODULES if name in last]
+            print(f"  启动时加载的重量级模块: {', '.join(loaded) if loaded else '无'}")
+            print("  耗时最多的直接依赖（最后一次）:")
+            top_level = sorted(
+                ((us, name) for name, (us, depth) in last.items() if depth == 1), reverse=True
+            )[: args.top]
+            for us, name in top_level:
+                print(f"    {us / 1000:8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+批量查询压测：用 AsyncQueryEngine 对模拟服务器（或 --base-url 指定的本机服务器）查询成千上万个房间，
+统计吞吐量、成功/失败数、重连次数以及单个房间查询耗时的 P50/P95/P99。
+
+用法（在仓库根目录执行）：
+    python benchmarks/load_driver.py --rooms 5000 --max-in-flight 16 --latency-ms 20 --jitter-ms 30 --error-rate 0.01
+    python benchmarks/load_driver.py --rooms 2000 --session-ttl 5 --token-rotate-every 200 --json result.json
+
+未指定 --base-url 时在本进程中启动 benchmarks/mock_epay_server.py，故障注入参数与其相同。
+压测不会读写 TJUEcard_session.json / HTTP_LATENCY_FILE 等运行时文件。
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mock_epay_server import MockEpayServer, add_fault_arguments, iter_room_selections, options_from_args  # noqa: E402
+
+
+def percentile(samples: list, p: float) -> float:
+    """最近秩法计算第 p 百分位，samples 需已排序。"""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))
+    return samples[index]
+
+
+def summarize(samples: list) -> dict:
+    """已排序耗时（秒）的 P50/P95/P99/最大值，单位毫秒。"""
+    return {
+        "p50": round(percentile(samples, 50) * 1000, 2),
+        "p95": round(percentile(samples, 95) * 1000, 2),
+        "p99": round(percentile(samples, 99) * 1000, 2),
+        "max": round(samples[-1] * 1000, 2) if samples else 0.0,
+    }
+
+
+def run_load(args, base_url: str) -> dict:
+    # 项目模块在导入时读取 BASE_DOMAIN，必须先设置环境变量
+    os.environ["TJUECARD_BASE_DOMAIN"] = base_url
+    import config
+
+    if config.BASE_DOMAIN != base_url.rstrip("/"):
+        # 非本机地址的覆盖会被忽略，此时不能对真实服务器压测
+        raise SystemExit(f"[错误] 只能压测本机上的服务器: {base_url}")
+    from async_query import AsyncQueryEngine
+    from http_client import create_http_session
+    from TJUEcard_main import perform_auto_login
+
+    if not args.verbose:
+        logging.getLogger("TJUEcardQuery").setLevel(logging.WARNING)
+
+    fanout = tuple(int(value) for value in args.fanout.split(","))
+    selections = list(iter_room_selections(fanout, limit=args.rooms))
+    if len(selections) < args.rooms:
+        print(f"[警告] 模拟目录中只有 {len(selections)} 个房间，可用 --fanout 扩大目录。")
+
+    session = create_http_session(pool_maxsize=args.max_in_flight, load_latency=False)
+    relogins = {"count": 0, "failed": 0}
+
+    def relogin() -> bool:
+        relogins["count"] += 1
+        ok = perform_auto_login(session, args.username, args.password)
+        if not ok:
+            relogins["failed"] += 1
+        return ok
+
+    latencies = []  # 单个房间从开始查询到得到结果的耗时（含排队等待和重连）
+    request_latencies = []  # 单个HTTP请求的耗时（不含排队等待）
+
+    class TimedEngine(AsyncQueryEngine):
+        async def _call(self, func, *args):
+            async with self._semaphore:
+                await self.rate_limiter.acquire(self._host)
+                loop = asyncio.get_running_loop()
+                start = time.perf_counter()
+                try:
+                    return await loop.run_in_executor(self._executor, func, *args)
+                finally:
+                    request_latencies.append(time.perf_counter() - start)
+
+        async def query_room(self, selection: dict) -> dict:
+            start = time.perf_counter()
+            outcome = await super().query_room(selection)
+            latencies.append(time.perf_counter() - start)
+            return outcome
+
+    engine = TimedEngine(session, relogin, max_in_flight=args.max_in_flight, requests_per_second=args.rps)
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        if not relogin():  # 初始登录，与正常运行时加载会话的步骤对应
+            raise SystemExit("[错误] 初始登录失败")
+        relogins["count"] = 0
+        start = time.perf_counter()
+        outcomes = asyncio.run(engine.run(selections))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    request_latencies.sort()
+    succeeded = sum(1 for outcome in outcomes if outcome["success"])
+    return {
+        "rooms": len(outcomes),
+        "succeeded": succeeded,
+        "failed": len(outcomes) - succeeded,
+        "relogins": relogins["count"],
+        "relogins_failed": relogins["failed"],
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(outcomes) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": summarize(latencies),
+        "requests": len(request_latencies),
+        "request_latency_ms": summarize(request_latencies),
+        "max_in_flight": args.max_in_flight,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量电费查询压测")
+    parser.add_argument("--rooms", type=int, default=2000, help="查询的房间数")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="同时进行中的请求数上限")
+    parser.add_argument("--rps", type=float, default=0, help="每秒最多发起的请求数，0 表示不限速")
+    parser.add_argument("--base-url", help="压测本机上已启动的服务器，不在本进程中启动模拟服务器")
+    parser.add_argument("--username", default="loadtest")
+    parser.add_argument("--password", default="loadtest")
+    parser.add_argument("--json", metavar="FILE", help="把结果另存为 JSON")
+    parser.add_argument("--verbose", action="store_true", help="显示每个房间的查询输出并记录日志")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = MockEpayServer(options=options_from_args(args)).start()
+        base_url = server.base_url
+    try:
+        result = run_load(args, base_url)
+    finally:
+        if server is not None:
+            server.stop()
+    if server is not None:
+        result["server"] = server.stats
+
+    print(f"[信息] 服务器: {base_url}，并发 {result['max_in_flight']}")
+    print(f"  房间数      {result['rooms']}（成功 {result['succeeded']}，失败 {result['failed']}）")
+    print(f"  重连次数    {result['relogins']}（失败 {result['relogins_failed']}）")
+    print(f"  总耗时      {result['elapsed_s']:.2f} s")
+    print(f"  吞吐量      {result['throughput_rps']:.1f} 房间/秒")
+    for label, key in (("单房间耗时", "latency_ms"), ("单请求耗时", "request_latency_ms")):
+        latency = result[key]
+        print(
+            f"  {label}  P50 {latency['p50']:.1f} ms   P95 {latency['p95']:.1f} ms   "
+            f"P99 {latency['p99']:.1f} ms   最大 {latency['max']:.1f} ms"
+        )
+    print(f"  请求数      {result['requests']}")
+    if "server" in result:
+        print(f"  服务器统计  {result['server']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"[成功] 结果已保存到 {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,430 @@
+"""
+本地模拟的 epay 电费服务器，用于端到端测试和压测，不访问真实的 59.67.37.10:8180。
+
+模拟的接口与真实服务器的返回格式一致：
+- GET  /epay/person/index                未登录时返回带 <input name="_csrf"> 的登录页，已登录时返回个人首页
+- POST /epay/j_spring_security_check     校验登录页的 _csrf，登录成功后更换 JSESSIONID 并返回 <frameset> 页面
+- GET  /epay/electric/load4electricindex 电控系统列表（li.my_link）
+- GET  /epay/electric/load4electricbill  带 <meta name="_csrf"> 的电费页面，未登录时重定向到登录页
+- POST /epay/electric/queryelectric*     KEY_MAP 对应的各层级列表
+- POST /epay/electric/queryelectricbill  retcode / restElecDegree / multiflag 查询结果
+
+故障注入（命令行参数或 MockOptions）：
+- 延迟：每个请求固定延迟加随机抖动
+- 错误率：按比例返回 503
+- 会话过期：登录后超过 session_ttl 秒失效，或每个请求按 expire_rate 的概率随机失效
+- Token 轮换：每个会话每完成 token_rotate_every 次查询后更换CSRF Token，旧Token提交会得到 403
+
+用法（在仓库根目录执行）：
+    python benchmarks/mock_epay_server.py --port 18180 --latency-ms 50 --error-rate 0.01
+    TJUECARD_BASE_DOMAIN=http://127.0.0.1:18180 python TJUEcard_main.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config 在用到时才导入：压测脚本需要先启动本服务器、再设置 TJUECARD_BASE_DOMAIN，之后才能导入项目模块
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# 层级 -> (请求路径, 下一层级, 请求参数中当前层 id 的字段名)
+_LEVEL_PATHS = {
+    "area": "queryelectricarea",
+    "district": "queryelectricdistricts",
+    "buis": "queryelectricbuis",
+    "floor": "queryelectricfloors",
+    "room": "queryelectricrooms",
+}
+_PATH_LEVELS = {path: level for level, path in _LEVEL_PATHS.items()}
+_LEVELS = ["area", "district", "buis", "floor", "room"]
+_PARENT_KEYS = {"district": "area", "buis": "district", "floor": "build", "room": "floor"}
+
+
+@dataclass
+class MockOptions:
+    """模拟服务器的目录规模与故障注入参数。"""
+
+    fanout: tuple = (1, 2, 5, 6, 20)  # 每个电控系统下 区域/园区/楼栋/楼层/房间 的数量
+    latency_ms: float = 0  # 每个请求的固定延迟
+    jitter_ms: float = 0  # 额外的随机延迟上限
+    error_rate: float = 0  # 返回 503 的概率
+    session_ttl: float = 0  # 会话有效期（秒），0 表示不过期
+    expire_rate: float = 0  # 每个请求随机使会话失效的概率
+    token_rotate_every: int = 0  # 每个会话每完成多少次查询更换一次CSRF Token，0 表示不更换
+    multi_meter_every: int = 10  # 每多少个房间中有一个一房多表的房间
+    reject_users: tuple = ()  # 登录总是失败的用户名（模拟密码已修改的账号）
+
+
+def system_ids() -> list:
+    """模拟的电控系统 [(id, 名称), ...]。"""
+    from config import TARGET_SYSTEMS
+
+    return [(f"{index + 1:03d}", name) for index, name in enumerate(TARGET_SYSTEMS)]
+
+
+def child_ids(parent_id: str, level: str, fanout: tuple) -> list:
+    """某个节点下一层的 [(id, 名称), ...]，id 由上级 id 拼接而成，保证全局唯一。"""
+    count = fanout[_LEVELS.index(level)]
+    prefix = {"area": "A", "district": "D", "buis": "B", "floor": "F", "room": "R"}[level]
+    return [(f"{parent_id}{prefix}{index + 1}", f"{level}{index + 1}") for index in range(count)]
+
+
+def iter_room_selections(fanout: tuple = MockOptions.fanout, limit: int | None = None):
+    """
+    按深度优先顺序生成模拟目录中全部房间的选择（与 setup 生成的 selection 结构相同）。
+
+    :param limit: 最多生成的房间数
+    """
+    produced = 0
+    for sysid, sysname in system_ids():
+        for area_id, area_name in child_ids(sysid, "area", fanout):
+            for district_id, district_name in child_ids(area_id, "district", fanout):
+                for buis_id, buis_name in child_ids(district_id, "buis", fanout):
+                    for floor_id, floor_name in child_ids(buis_id, "floor", fanout):
+                        for room_id, room_name in child_ids(floor_id, "room", fanout):
+                            if limit is not None and produced >= limit:
+                                return
+                            produced += 1
+                            yield {
+                                "system": {"id": sysid, "name": sysname},
+                                "area": {"id": area_id, "name": area_name},
+                                "district": {"id": district_id, "name": district_name},
+                                "buis": {"id": buis_id, "name": buis_name},
+                                "floor": {"id": floor_id, "name": floor_name},
+                                "room": {"id": room_id, "name": room_name},
+                            }
+
+
+def _room_balance(room_id: str, now: float) -> float:
+    """每个房间的剩余电量由房间号决定，并随时间缓慢下降，便于测试预测功能。"""
+    digest = int(hashlib.md5(room_id.encode()).hexdigest()[:8], 16)
+    start = 20 + digest % 200
+    rate = 0.2 + (digest >> 8) % 10 / 10  # 度/小时
+    return round(max(start - (now / 3600 % 240) * rate, 0), 2)
+
+
+class _State:
+    """服务器端的会话与Token状态。"""
+
+    def __init__(self, options: MockOptions):
+        self.options = options
+        self.lock = threading.Lock()
+        self.sessions: dict[str, dict] = {}  # JSESSIONID -> {"user", "created", "token", "queries", "login_token"}
+        self.random = random.Random()
+        self.stats = {"requests": 0, "logins": 0, "queries": 0, "errors_injected": 0, "expired": 0, "rotations": 0}
+
+    def new_session(self, user: str | None) -> str:
+        session_id = secrets.token_hex(16).upper()
+        self.sessions[session_id] = {
+            "user": user,
+            "created": time.time(),
+            "token": secrets.token_hex(16),
+            "queries": 0,
+            "login_token": secrets.token_hex(16),
+        }
+        return session_id
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "Apache-Coyote/1.1"
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def state(self) -> _State:
+        return self.server.state
+
+    # --- 公共部分 ---
+
+    def _send(self, body: str | bytes, content_type="text/html;charset=UTF-8", status=200, headers=None):
+        data = body.encode("utf-8") if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, payload: dict):
+        self._send(json.dumps(payload, ensure_ascii=False), "application/json;charset=UTF-8")
+
+    def _redirect_to_login(self):
+        self._send("", status=302, headers={"Location": "/epay/person/index"})
+
+    def _session_id(self) -> str | None:
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        return cookie["JSESSIONID"].value if "JSESSIONID" in cookie else None
+
+    def _session(self, require_login: bool = True) -> dict | None:
+        """返回当前请求的会话；会话过期或被随机失效时删除并返回 None。"""
+        state, options = self.state, self.state.options
+        session_id = self._session_id()
+        with state.lock:
+            session = state.sessions.get(session_id)
+            if session is None:
+                return None
+            expired = (options.session_ttl and time.time() - session["created"] > options.session_ttl) or (
+                session["user"] and state.random.random() < options.expire_rate
+            )
+            if expired and session["user"]:
+                del state.sessions[session_id]
+                state.stats["expired"] += 1
+                return None
+        if require_login and not session["user"]:
+            return None
+        return session
+
+    def _inject_faults(self) -> bool:
+        """注入延迟和错误，已返回错误响应时返回 True。"""
+        options = self.state.options
+        with self.state.lock:
+            self.state.stats["requests"] += 1
+            delay = options.latency_ms + self.state.random.random() * options.jitter_ms
+            failed = self.state.random.random() < options.error_rate
+            if failed:
+                self.state.stats["errors_injected"] += 1
+        if delay:
+            time.sleep(delay / 1000)
+        if failed:
+            self._send("<html><body>503 Service Unavailable</body></html>", status=503)
+        return failed
+
+    def _read_form(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        data = parse_qs(self.rfile.read(length).decode("utf-8"))
+        return {key: values[0] for key, values in data.items()}
+
+    # --- 请求分发 ---
+
+    def do_GET(self):
+        if self._inject_faults():
+            return
+        url = urlparse(self.path)
+        if url.path == "/epay/person/index":
+            return self._person_index()
+        if url.path == "/epay/electric/load4electricindex":
+            return self._electric_index()
+        if url.path == "/epay/electric/load4electricbill":
+            return self._electric_bill()
+        self._send("<html><body>404 Not Found</body></html>", status=404)
+
+    def do_POST(self):
+        form = self._read_form()
+        if self._inject_faults():
+            return
+        path = urlparse(self.path).path
+        if path == "/epay/j_spring_security_check":
+            return self._login(form)
+        if path == "/epay/electric/queryelectricbill":
+            return self._query_bill(form)
+        level = _PATH_LEVELS.get(path.rsplit("/", 1)[-1])
+        if level and path.startswith("/epay/electric/"):
+            return self._query_level(level, form)
+        self._send("<html><body>404 Not Found</body></html>", status=404)
+
+    # --- 各接口 ---
+
+    def _person_index(self):
+        session = self._session(require_login=False)
+        if session and session["user"]:
+            return self._send("<html><head><title>个人中心</title></head><body>欢迎使用校园卡服务平台</body></html>")
+        headers = {}
+        if session is None:
+            with self.state.lock:
+                session_id = self.state.new_session(None)
+                session = self.state.sessions[session_id]
+            headers["Set-Cookie"] = f"JSESSIONID={session_id}; Path=/epay; HttpOnly"
+        page = re.sub(
+            r'(<input type="hidden" name="_csrf" value=")[^"]*', r"\g<1>" + session["login_token"], self.server.login_page
+        )
+        self._send(page, headers=headers)
+
+    def _login(self, form: dict):
+        session = self._session(require_login=False)
+        if session is None or form.get("_csrf") != session["login_token"] or not form.get("j_username"):
+            return self._send("<html><body>403 Forbidden</body></html>", status=403)
+        if form["j_username"] in self.state.options.reject_users:
+            # 与真实服务器相同：密码错误时重新返回登录页面
+            return self._person_index()
+        with self.state.lock:
+            self.state.sessions.pop(self._session_id(), None)  # 登录后更换会话id，防止会话固定攻击
+            session_id = self.state.new_session(form["j_username"])
+            self.state.stats["logins"] += 1
+        self._send(
+            '<html><frameset rows="80,*"><frame src="/epay/top"/><frame src="/epay/main" name="mainFrame"/></frameset></html>',
+            headers={"Set-Cookie": f"JSESSIONID={session_id}; Path=/epay; HttpOnly"},
+        )
+
+    def _electric_index(self):
+        if self._session() is None:
+            return self._redirect_to_login()
+        items = "".join(
+            f"<li class=\"my_link\" onclick=\"selectSystem('{sysid}')\">{name}</li>" for sysid, name in system_ids()
+        )
+        self._send(f"<html><body><ul class=\"system-list\">{items}<li class=\"my_link\" onclick=\"selectSystem('999')\">其他电控</li></ul></body></html>")
+
+    def _electric_bill(self):
+        session = self._session()
+        if session is None:
+            return self._redirect_to_login()
+        page = re.sub(r'(<meta name="_csrf" content=")[^"]*', r"\g<1>" + session["token"], self.server.bill_page)
+        self._send(page)
+
+    def _check_token(self) -> dict | None:
+        """校验会话和 X-CSRF-TOKEN，失败时已返回响应。"""
+        session = self._session()
+        if session is None:
+            self._redirect_to_login()
+            return None
+        if self.headers.get("X-CSRF-TOKEN") != session["token"]:
+            self._send("<html><body>403 Forbidden: Invalid CSRF Token</body></html>", status=403)
+            return None
+        return session
+
+    def _query_level(self, level: str, form: dict):
+        from config import KEY_MAP
+
+        if self._check_token() is None:
+            return
+        if level == "area":
+            parent_id = form.get("sysid", "")
+        else:
+            parent_id = form.get(_PARENT_KEYS[level], "")
+        keys = KEY_MAP[level]
+        items = [{keys["id"]: item_id, keys["name"]: name} for item_id, name in child_ids(parent_id, level, self.state.options.fanout)]
+        self._send_json({"retcode": 0, keys["list"]: items})
+
+    def _query_bill(self, form: dict):
+        session = self._check_token()
+        if session is None:
+            return
+        options = self.state.options
+        with self.state.lock:
+            self.state.stats["queries"] += 1
+            session["queries"] += 1
+            if options.token_rotate_every and session["queries"] % options.token_rotate_every == 0:
+                session["token"] = secrets.token_hex(16)
+                self.state.stats["rotations"] += 1
+
+        room_id = form.get("roomNo", "")
+        match = re.fullmatch(r"\d{3}A\d+D\d+B\d+F\d+R(\d+)", room_id)
+        if not match or form.get("sysid") != room_id[:3] or not room_id.startswith(form.get("elcbuis", "")):
+            return self._send_json({"retcode": 1, "retmsg": "未查询到该房间信息"})
+        now = time.time()
+        if options.multi_meter_every and int(match.group(1)) % options.multi_meter_every == 0:
+            return self._send_json(
+                {
+                    "retcode": 0,
+                    "multiflag": True,
+                    "elecRoomData": [
+                        {"name": "照明", "restElecDegree": str(_room_balance(room_id + "L", now))},
+                        {"name": "空调", "restElecDegree": str(_room_balance(room_id + "K", now))},
+                    ],
+                }
+            )
+        self._send_json({"retcode": 0, "multiflag": False, "restElecDegree": str(_room_balance(room_id, now))})
+
+
+class MockEpayServer:
+    """
+    在后台线程中运行的模拟服务器。
+
+    :param port: 监听端口，0 表示随机分配
+    :param options: 目录规模与故障注入参数
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, options: MockOptions | None = None):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.state = _State(options or MockOptions())
+        with open(os.path.join(FIXTURES_DIR, "person_index_login.html"), encoding="utf-8") as f:
+            self.httpd.login_page = f.read()
+        with open(os.path.join(FIXTURES_DIR, "load4electricbill.html"), encoding="utf-8") as f:
+            self.httpd.bill_page = f.read()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self) -> dict:
+        return dict(self.httpd.state.stats)
+
+    def start(self) -> "MockEpayServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="MockEpayServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def add_fault_arguments(parser: argparse.ArgumentParser) -> None:
+    """添加故障注入相关的命令行参数（模拟服务器和压测脚本共用）。"""
+    parser.add_argument("--fanout", default="1,2,5,6,20", help="每个电控系统下 区域,园区,楼栋,楼层,房间 的数量")
+    parser.add_argument("--latency-ms", type=float, default=0, help="每个请求的固定延迟（毫秒）")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="额外的随机延迟上限（毫秒）")
+    parser.add_argument("--error-rate", type=float, default=0, help="返回 503 的概率")
+    parser.add_argument("--session-ttl", type=float, default=0, help="会话有效期（秒），0 表示不过期")
+    parser.add_argument("--expire-rate", type=float, default=0, help="每个请求随机使会话失效的概率")
+    parser.add_argument("--token-rotate-every", type=int, default=0, help="每个会话每完成多少次查询更换CSRF Token")
+    parser.add_argument("--reject-users", default="", help="登录总是失败的用户名，多个用逗号分隔")
+
+
+def options_from_args(args: argparse.Namespace) -> MockOptions:
+    return MockOptions(
+        fanout=tuple(int(value) for value in args.fanout.split(",")),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        session_ttl=args.session_ttl,
+        expire_rate=args.expire_rate,
+        token_rotate_every=args.token_rotate_every,
+        reject_users=tuple(name for name in args.reject_users.split(",") if name),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 epay 电费服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18180)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockEpayServer(args.host, args.port, options_from_args(args))
+    rooms = sum(1 for _ in iter_room_selections(server.httpd.state.options.fanout))
+    print(f"[信息] 模拟服务器已启动: {server.base_url}（共 {rooms} 个房间），按 Ctrl+C 停止。")
+    print(f"[信息] 使用方法: TJUECARD_BASE_DOMAIN={server.base_url} python TJUEcard_main.py")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(f"\n[信息] 统计: {server.stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,36 @@
 # -*- coding: utf-8 -*-
 import sys
 import os
+import ipaddress
+from urllib.parse import urlparse
 
 """
 配置文件，统一管理常量
 """
 
+
+def _base_domain(default: str) -> str:
+    """
+    环境变量 TJUECARD_BASE_DOMAIN 可以把所有请求指向本地模拟服务器（见 benchmarks/mock_epay_server.py）。
+    账号密码会随登录请求一起发送，因此只接受本机地址，其他地址忽略并提示。
+    """
+    override = os.environ.get("TJUECARD_BASE_DOMAIN")
+    if not override:
+        return default
+    host = urlparse(override).hostname or ""
+    try:
+        loopback = host == "localhost" or ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        print(f"[警告] 忽略环境变量 TJUECARD_BASE_DOMAIN={override}：只允许指向本机的模拟服务器，仍使用 {default}")
+        return default
+    print(f"[警告] 环境变量 TJUECARD_BASE_DOMAIN 已生效，所有请求（包括账号密码）都发送到 {override}，仅用于本地测试")
+    return override.rstrip("/")
+
+
 # 基础URL配置
-BASE_DOMAIN = "http://59.67.37.10:8180"  # 等同 https://ecard.tju.edu.cn
+BASE_DOMAIN = _base_domain("http://59.67.37.10:8180")  # 等同 https://ecard.tju.edu.cn
 
 # API URL配置
 LOGIN_PAGE_URL = f"{BASE_DOMAIN}/epay/person/index"
@@ -45,8 +68,17 @@ else:
 
 # 文件路径配置
 USER_CONFIG_FILE = os.path.join(BASE_DIR, "TJUEcard_user_config.json")
-COOKIE_FILE = os.path.join(BASE_DIR, "TJUEcard_session.pkl")
+COOKIE_FILE = os.path.join(BASE_DIR, "TJUEcard_session.json")  # 旧版本的 TJUEcard_session.pkl 会在首次加载时自动转换
+SESSION_META_FILE = os.path.join(BASE_DIR, "TJUEcard_session.meta.json")  # 会话最近一次确认有效的时间
+READINGS_FILE = os.path.join(BASE_DIR, "TJUEcard_readings.db")  # 电量读数历史
+CATALOG_FILE = os.path.join(BASE_DIR, "TJUEcard_catalog.db")  # 离线房间目录
+ROOMS_FILE = os.path.join(BASE_DIR, "TJUEcard_rooms.json")  # 批量查询的房间列表（可选，用户配置中没有指定房间时使用）
+HTTP_LATENCY_FILE = os.path.join(BASE_DIR, "TJUEcard_latency.json")  # 最近的请求耗时统计，用于自适应超时
 LOG_FILE = os.path.join(BASE_DIR, "TJUEcard.log")
+CRON_MIGRATION_MARKER = os.path.join(BASE_DIR, ".tjuecard_cron_migrated")  # 旧定时任务迁移完成的标记
+METRICS_FILE = os.path.join(BASE_DIR, "TJUEcard_metrics.json")  # 累计的各阶段耗时与计数
+METRICS_TEXTFILE = os.path.join(BASE_DIR, "TJUEcard.prom")  # 同样的指标，Prometheus textfile 格式
+ACCOUNTS_STATE_FILE = os.path.join(BASE_DIR, "TJUEcard_accounts.json")  # 多账号时各账号的健康状态
 
 # HTTP请求头配置
 DEFAULT_HEADERS = {
@@ -54,9 +86,94 @@ DEFAULT_HEADERS = {
     "X-Requested-With": "XMLHttpRequest",
 }
 
+# 多个进程同时读写会话/配置文件时，等待文件锁的最长时间（秒）
+FILE_LOCK_TIMEOUT = 30
+
+# HTTP客户端配置
+HTTP_POOL_MAXSIZE = 4  # 连接池大小，并发查询时会按并发数自动放大
+HTTP_CONNECT_TIMEOUT = 3.05  # 连接超时（秒）
+HTTP_READ_TIMEOUT_MIN = 3  # 自适应读取超时的下限（秒）
+HTTP_READ_TIMEOUT_MAX = 10  # 自适应读取超时的上限（秒），统计样本不足时使用该值
+HTTP_TIMEOUT_P95_MULTIPLIER = 3  # 读取超时 = 最近请求耗时的 P95 × 该倍数
+HTTP_LATENCY_WINDOW = 50  # 统计最近多少次请求的耗时
+HTTP_GET_RETRIES = 2  # GET 请求失败后的最大重试次数
+HTTP_BACKOFF_FACTOR = 0.5  # 指数退避的基数（秒），第 n 次重试前等待约 factor × 2^(n-1) 秒外加随机抖动
+
+# 会话验证配置（可在用户配置的 "session" 中覆盖）
+SESSION_OPTIMISTIC = False  # 为True时跳过 VERIFY_LOGIN_URL 预检，直接查询，失效时再重连
+SESSION_TRUST_SECONDS = 1800  # 会话在该时间内确认过有效时，即使未开启乐观模式也跳过预检
+
+# 批量异步查询配置（可在用户配置的 "async_query" 中覆盖）
+ASYNC_MAX_IN_FLIGHT = 4  # 同时进行中的请求数上限
+ASYNC_REQUESTS_PER_SECOND = 5.0  # 每个主机每秒最多发起的请求数
+
+# 多进程分片查询配置（可在用户配置的 "sharding" 中覆盖）
+SHARD_PROCESSES = 1  # 工作进程数，1 表示不使用多进程，0 表示使用全部CPU核心
+SHARD_MIN_ROOMS = 200  # 房间数少于该值时仍在当前进程中查询
+SHARD_CHUNKS_PER_PROCESS = 4  # 每个工作进程平均分到的分片数，分片越多各进程的负载越均衡
+
+# 查询结果缓存配置（可在用户配置的 "query_cache" 中覆盖）
+QUERY_CACHE_ENABLED = False  # 默认每次都实际查询；启用后最近查询过的房间使用缓存的结果
+QUERY_CACHE_FRESH_SECONDS = 300  # 在该时间内查询过的房间直接使用上次的结果，不访问服务器
+QUERY_CACHE_STALE_SECONDS = 1800  # 超过 fresh_seconds 但未超过该时间时，先使用上次的结果，同时在后台重新查询
+QUERY_CACHE_WAIT_SECONDS = 60  # 其他进程正在查询同一房间时最多等待的时间（秒），超时后自行查询
+QUERY_CACHE_CLAIM_SECONDS = 600  # "查询中" 标记的有效期（秒），超过后视为标记它的进程已异常退出
+QUERY_CACHE_POLL_SECONDS = 0.5  # 等待其他进程的查询结果时检查的间隔（秒）
+
+# 多账号配置（可在用户配置的 "account_pool" 中用 max_login_failures / cooldown_minutes 覆盖）
+ACCOUNT_MAX_LOGIN_FAILURES = 3  # 连续自动登录失败该次数后暂停使用该账号
+ACCOUNT_COOLDOWN_MINUTES = 60  # 暂停使用的时间（分钟），之后重新尝试登录
+
+# 离线房间目录配置
+CATALOG_WORKERS = 4  # 抓取房间目录时的并发请求数
+CATALOG_MAX_AGE_DAYS = 7  # 增量刷新时，每个节点最迟在抓取后该天数内被重新抓取
+CATALOG_REFRESH_SPREAD = 0.5  # 节点在 max_age 的最后这一比例内按节点分散刷新，避免全量抓取后的节点在同一次运行中同时到期
+
+# 本地只读 HTTP 接口配置（reading_api.py，可用命令行参数覆盖）
+READING_API_HOST = "127.0.0.1"  # 默认只允许本机访问，需要给其他主机访问时改为 "0.0.0.0"
+READING_API_PORT = 18181
+READING_API_REFRESH_SECONDS = 5  # 每隔多少秒检查一次读数历史是否有新数据
+READING_API_SUMMARY_DAYS = 7  # 历史统计覆盖最近多少天
+READING_API_MAX_BULK_ROOMS = 5000  # 批量接口一次最多查询的房间数
+
+# 电量耗尽预测配置
+FORECAST_HALFLIFE_HOURS = 72  # 用电速率指数加权平均的半衰期（小时）
+
+# 守护进程配置（可在用户配置的 "daemon" 中覆盖，单个房间可用 "interval_minutes" 单独设置）
+DAEMON_INTERVAL_MINUTES = 1440  # 每个房间的默认查询间隔（分钟）
+DAEMON_RELOAD_CHECK_SECONDS = 60  # 检查配置文件是否被修改的间隔（秒）
+
+# 自适应查询计划配置（守护进程模式，可在用户配置的 "daemon" 中用同名小写键覆盖，例如 "adaptive": true）
+DAEMON_ADAPTIVE = False  # 为True时按剩余电量和用电速率安排每个房间的下次查询，房间的查询间隔作为上限
+DAEMON_MIN_INTERVAL_MINUTES = 30  # 自适应时两次查询之间的最短间隔（分钟）
+DAEMON_LEAD_FRACTION = 0.25  # 下次查询安排在预计到达提醒线所需时间的该比例处，越小查询越频繁
+DAEMON_RETRY_MINUTES = 60  # 查询失败后重试的间隔（分钟），不超过房间的查询间隔
+DAEMON_REQUESTS_PER_HOUR = 0  # 每小时最多向服务器查询的房间数，0 表示不限制；超出时优先查询最接近提醒线的房间
+
+# 邮件通知配置（可在用户配置的 "email_notifier" 中用 "digest" 覆盖）
+EMAIL_DIGEST = True  # 批量查询时把全部房间的通知合并为一封汇总邮件
+
+# 告警去重配置（可在用户配置的 "email_notifier" 中用 rearm_margin / cooldown_hours / repeat_hours / resolved_notice 覆盖）
+ALERT_REARM_MARGIN = 5  # 低电量告警后，剩余电量回升到 阈值+该余量（度）以上才重新布防
+ALERT_COOLDOWN_HOURS = 12  # 告警解除后该时间内再次触发不重复发送
+ALERT_REPEAT_HOURS = 0  # 告警持续时每隔该时间重复提醒一次，0 表示只在触发时提醒一次
+ALERT_RESOLVED_NOTICE = True  # 告警解除时发送恢复通知
+DEPLETION_REARM_FACTOR = 1.5  # 预计可用时间回升到 depletion_alert_hours 的该倍数以上才重新布防
+
+# 运行指标配置（可在用户配置的 "metrics" 中用 enabled / json_file / textfile 覆盖）
+METRICS_ENABLED = False  # 为True时每次运行结束时导出各阶段耗时与计数（默认不在程序目录中写入指标文件）
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)  # 耗时直方图的分桶上界（秒）
+
 # 日志配置
+# （可在用户配置的 "logging" 中用 async / max_bytes / when / backup_count / compress / json_file 覆盖）
 LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
 LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+LOG_ASYNC = False  # 为True时通过队列由后台线程写日志，查询线程不等待磁盘写入
+LOG_ROTATE_MAX_BYTES = 0  # 日志文件超过该大小时轮转，例如 5 * 1024 * 1024；0 表示不按大小轮转
+LOG_ROTATE_WHEN = None  # 按时间轮转，例如 "midnight"、"W0"，设置后不再按大小轮转
+LOG_BACKUP_COUNT = 5  # 保留的旧日志数量
+LOG_COMPRESS = True  # 开启轮转时，轮转后的旧日志用 gzip 压缩
+LOG_JSON_FILE = None  # JSON Lines 格式的结构化日志路径，None 表示不写，例如 os.path.join(BASE_DIR, "TJUEcard.log.jsonl")
 
 # 目标电控系统列表
 TARGET_SYSTEMS = ["北洋园电控", "卫津路空调电控", "卫津路宿舍电控"]
@@ -66,3 +183,4 @@ _KEY_FILENAME = ".tjuecard_key"
 _KEY_FILE_PATH = os.path.join(BASE_DIR, _KEY_FILENAME)
 _KID = "local-v1"  # key id，便于以后密钥轮换
 _ALG = "AES-256-GCM"
+SECRET_CACHE_SIZE = 16  # 进程内缓存的已解密密文数量上限
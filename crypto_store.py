@@ -1,9 +1,15 @@
 """
 本地密钥文件 + AES-256-GCM 加解密：
 - 数据密钥存放在 config.py 配置的 _KEY_FILE_PATH（默认 BASE_DIR/.tjuecard_key）。
-- JSON 内仅保存密文对象（含算法、版本、nonce、密文）。
+- JSON 内仅保存密文对象（含算法、版本、密钥id、nonce、密文）。
+- 密钥环：密钥文件中可以同时保存多个密钥，按 kid 索引。加密总是使用当前密钥，解密按密文中的 kid 选择密钥，
+  因此轮换密钥后旧密文在重新加密之前仍可解密。只有一个密钥时沿用旧的单行 base64 格式。
+- 密钥环在进程内只加载一次；解密结果按密文缓存（有上限），守护进程和批量查询中不会重复解密同一个密文。
 警告：
 - 删除或丢失密钥文件将导致现有 JSON 中的密文无法解密，需要重新运行 setup 重新生成配置。
+
+轮换密钥：
+    python crypto_store.py --rotate [--retire]
 """
 
 from __future__ import annotations
@@ -11,10 +17,17 @@ from __future__ import annotations
 import os
 import json
 import base64
+from collections import OrderedDict
 from typing import Dict, Any
 
-from cryptography.hazmat.primitives.ciphers.aead import AESGCM
-from config import _KEY_FILE_PATH, _KID, _ALG
+from config import _KEY_FILE_PATH, _KID, _ALG, SECRET_CACHE_SIZE
+from utils import atomic_write, file_lock
+
+# 进程内的密钥环：{"active": 当前kid, "keys": {kid: 密钥}}，首次使用时从文件加载
+_keyring: dict | None = None
+_aead_by_kid: dict = {}
+# 已解密的密文 (kid, nonce, ct) -> 明文，按最近使用淘汰
+_secret_cache: OrderedDict = OrderedDict()
 
 
 def get_key_file_path() -> str:
@@ -22,66 +35,105 @@ def get_key_file_path() -> str:
     return _KEY_FILE_PATH
 
 
-def _read_key_from_file() -> bytes:
+def _read_keyring_from_file() -> dict:
     with open(_KEY_FILE_PATH, "rb") as f:
         data = f.read().strip()
-    return base64.b64decode(data)
+    if data.startswith(b"{"):
+        ring = json.loads(data)
+        return {
+            "active": ring["active"],
+            "keys": {kid: base64.b64decode(key) for kid, key in ring["keys"].items()},
+        }
+    # 旧格式：单个 base64 密钥，对应默认的 kid
+    return {"active": _KID, "keys": {_KID: base64.b64decode(data)}}
 
 
-def _write_key_to_file(key: bytes) -> None:
+def _write_key_to_file(data: bytes) -> None:
     """
-    以尽可能严格的权限写入密钥文件：
+    以尽可能严格的权限原子地写入密钥文件（写入中途崩溃不会留下损坏的密钥文件）：
     - POSIX: 0600
     - Windows: os.chmod 作用有限，仍建议依赖用户账户隔离
     """
     os.makedirs(os.path.dirname(_KEY_FILE_PATH) or ".", exist_ok=True)
+    atomic_write(_KEY_FILE_PATH, data)
+    try:
+        os.chmod(_KEY_FILE_PATH, 0o600)
+    except Exception:
+        pass  # Windows 上不强制
 
-    if os.name == "posix":
-        fd = os.open(_KEY_FILE_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
-        try:
-            with os.fdopen(fd, "wb") as f:
-                f.write(base64.b64encode(key))
-        finally:
-            try:
-                os.close(fd)
-            except Exception:
-                pass
-    else:
-        with open(_KEY_FILE_PATH, "wb") as f:
-            f.write(base64.b64encode(key))
-        try:
-            os.chmod(_KEY_FILE_PATH, 0o600)
-        except Exception:
-            pass  # Windows 上不强制
+
+def _write_keyring_to_file(ring: dict) -> None:
+    if list(ring["keys"]) == [_KID] and ring["active"] == _KID:
+        # 只有默认密钥时保持旧格式，旧版本程序仍可读取
+        _write_key_to_file(base64.b64encode(ring["keys"][_KID]))
+        return
+    data = {
+        "active": ring["active"],
+        "keys": {kid: base64.b64encode(key).decode() for kid, key in ring["keys"].items()},
+    }
+    _write_key_to_file(json.dumps(data, indent=2).encode())
 
 
-def _load_key(create: bool) -> bytes:
+def _load_keyring(create: bool) -> dict:
     """
-    载入本地数据密钥。
-    - create=True：不存在则生成并写入文件
+    载入密钥环（每个进程只读取一次密钥文件）。
+    - create=True：不存在则生成默认密钥并写入文件
     - create=False：不存在则抛出异常
     """
+    global _keyring
+    if _keyring is not None:
+        return _keyring
     if os.path.exists(_KEY_FILE_PATH):
-        return _read_key_from_file()
-    if create:
-        key = os.urandom(32)  # 256-bit
-        _write_key_to_file(key)
-        return key
-    raise FileNotFoundError(f"未找到本地密钥文件：{_KEY_FILE_PATH}")
+        _keyring = _read_keyring_from_file()
+    elif create:
+        _keyring = {"active": _KID, "keys": {_KID: os.urandom(32)}}  # 256-bit
+        _write_keyring_to_file(_keyring)
+    else:
+        raise FileNotFoundError(f"未找到本地密钥文件：{_KEY_FILE_PATH}")
+    return _keyring
+
+
+def _aead(kid: str, create: bool = False):
+    """返回 kid 对应的 AESGCM 实例（每个密钥只构造一次）。"""
+    global _keyring
+    if kid not in _aead_by_kid:
+        ring = _load_keyring(create)
+        if kid not in ring["keys"] and os.path.exists(_KEY_FILE_PATH):
+            # 密钥可能已被其他进程轮换（例如守护进程运行期间执行了 --rotate），重新读取一次
+            _keyring = ring = _read_keyring_from_file()
+        if kid not in ring["keys"]:
+            raise ValueError(f"密钥文件中没有 kid 为 {kid} 的密钥")
+        _aead_by_kid[kid] = _aesgcm(ring["keys"][kid])
+    return _aead_by_kid[kid]
+
+
+def _aesgcm(key: bytes):
+    """按需加载 cryptography，只有真正加解密时才付出导入开销。"""
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+    return AESGCM(key)
+
+
+def clear_secret_cache() -> None:
+    """清空已加载的密钥环和解密缓存（密钥文件被外部修改后调用）。"""
+    global _keyring
+    _keyring = None
+    _aead_by_kid.clear()
+    _secret_cache.clear()
 
 
 def encrypt_for_storage(plaintext: str) -> Dict[str, Any]:
     """
-    使用本地数据密钥加密，返回可直接写入 JSON 的密文对象。
+    使用当前数据密钥加密，返回可直接写入 JSON 的密文对象。
     """
-    key = _load_key(create=True)  # 加密时若不存在则创建
-    aes = AESGCM(key)
+    kid = _load_keyring(create=True)["active"]  # 加密时若不存在则创建
+    aes = _aead(kid)
     nonce = os.urandom(12)
     ct = aes.encrypt(nonce, plaintext.encode("utf-8"), None)
     return {
         "v": 1,
         "alg": _ALG,
-        "kid": _KID,
+        "kid": kid,
         "nonce": base64.b64encode(nonce).decode(),
         "ct": base64.b64encode(ct).decode(),
     }
@@ -89,30 +141,137 @@ def encrypt_for_storage(plaintext: str) -> Dict[str, Any]:
 
 def decrypt_from_storage(blob: Dict[str, Any]) -> str:
     """
-    解密 JSON 中的密文对象，返回明文字符串。
+    解密 JSON 中的密文对象，返回明文字符串。同一密文只解密一次，结果缓存在进程内。
     """
     if not isinstance(blob, dict):
         raise ValueError("密文对象格式错误")
     if blob.get("alg") != _ALG:
         raise ValueError(f"不支持的算法: {blob.get('alg')}")
-    key = _load_key(create=False)  # 解密时必须已有密钥
-    aes = AESGCM(key)
+    kid = blob.get("kid", _KID)
+    cache_key = (kid, blob.get("nonce"), blob.get("ct"))
+    if cache_key in _secret_cache:
+        _secret_cache.move_to_end(cache_key)
+        return _secret_cache[cache_key]
+
+    aes = _aead(kid)  # 解密时必须已有密钥
     nonce = base64.b64decode(blob["nonce"])
     ct = base64.b64decode(blob["ct"])
-    pt = aes.decrypt(nonce, ct, None)
-    return pt.decode("utf-8")
+    pt = aes.decrypt(nonce, ct, None).decode("utf-8")
+
+    _secret_cache[cache_key] = pt
+    while len(_secret_cache) > SECRET_CACHE_SIZE:
+        _secret_cache.popitem(last=False)
+    return pt
+
+
+def _iter_encrypted_blobs(node):
+    """遍历 JSON 对象中的全部密文对象。"""
+    if isinstance(node, dict):
+        if node.get("alg") == _ALG and "ct" in node and "nonce" in node:
+            yield node
+            return
+        for value in node.values():
+            yield from _iter_encrypted_blobs(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _iter_encrypted_blobs(value)
+
+
+def rotate_key() -> str:
+    """
+    生成一个新密钥并设为当前密钥，旧密钥保留在密钥环中，已有密文仍可解密。
+
+    :return: 新密钥的 kid
+    """
+    with file_lock(_KEY_FILE_PATH):
+        ring = _load_keyring(create=True)
+        index = len(ring["keys"]) + 1
+        kid = f"local-v{index}"
+        while kid in ring["keys"]:
+            index += 1
+            kid = f"local-v{index}"
+        ring["keys"][kid] = os.urandom(32)
+        ring["active"] = kid
+        _write_keyring_to_file(ring)
+    return kid
+
+
+def reencrypt_config(config_path: str) -> int:
+    """
+    用当前密钥重新加密配置文件中所有使用旧密钥的密文（批量操作，只读写一次配置文件）。
+
+    :return: 重新加密的密文数量
+    """
+    # 读取和写回之间持有文件锁，避免覆盖其他进程同时写入的配置
+    with file_lock(config_path):
+        with open(config_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        active = _load_keyring(create=False)["active"]
+        count = 0
+        for blob in _iter_encrypted_blobs(data):
+            if blob.get("kid", _KID) == active:
+                continue
+            blob.update(encrypt_for_storage(decrypt_from_storage(blob)))
+            count += 1
+
+        if count:
+            # 与 utils.save_config_to_json 相同的缩进，轮换密钥不改变配置文件的格式
+            atomic_write(config_path, json.dumps(data, ensure_ascii=False, indent=4))
+    return count
+
+
+def retire_keys(config_path: str) -> list:
+    """
+    从密钥环中删除配置文件已不再使用的旧密钥（应在 reencrypt_config 之后调用）。
+
+    :return: 被删除的 kid 列表
+    """
+    with open(config_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    ring = _load_keyring(create=False)
+    in_use = {blob.get("kid", _KID) for blob in _iter_encrypted_blobs(data)} | {ring["active"]}
+    retired = [kid for kid in ring["keys"] if kid not in in_use]
+    if retired:
+        with file_lock(_KEY_FILE_PATH):
+            for kid in retired:
+                del ring["keys"][kid]
+                _aead_by_kid.pop(kid, None)
+            _write_keyring_to_file(ring)
+    return retired
 
 
 def migrate_plaintext_to_encrypted(config_path: str) -> bool:
     """
     将已有 JSON 配置中的明文字段迁移为加密字段：
-      - credentials.password -> credentials.password_enc
+      - credentials.password -> credentials.password_enc（accounts 中的每个账号同样处理）
       - email_notifier.auth_code -> email_notifier.auth_code_enc
-    迁移成功会覆盖写回原文件。返回是否发生了修改。
+    迁移成功会原子地写回原文件（读取和写回之间持有文件锁）。返回是否发生了修改。
     """
     if not os.path.exists(config_path):
         return False
 
+    try:
+        with file_lock(config_path):
+            return _migrate_plaintext_locked(config_path)
+    except TimeoutError:
+        return False
+
+
+def _migrate_password(creds: dict) -> bool:
+    """把 creds 中的明文 password 替换为 password_enc，返回是否发生了修改。"""
+    if "password_enc" in creds or not creds.get("password"):
+        return False
+    try:
+        creds["password_enc"] = encrypt_for_storage(str(creds["password"]))
+        del creds["password"]
+        return True
+    except Exception as e:
+        print(f"[警告] 迁移密码时出错: {e}")
+        return False
+
+
+def _migrate_plaintext_locked(config_path: str) -> bool:
     try:
         with open(config_path, "r", encoding="utf-8") as f:
             data = json.load(f)
@@ -121,22 +280,16 @@ def migrate_plaintext_to_encrypted(config_path: str) -> bool:
 
     changed = False
 
-    # 迁移登录密码
+    # 迁移登录密码（包括多账号配置 accounts 中的每个账号）
     creds = data.get("credentials") or {}
     if isinstance(creds, dict):
-        if (
-            "password_enc" not in creds
-            and "password" in creds
-            and creds.get("password")
-        ):
-            try:
-                enc = encrypt_for_storage(str(creds["password"]))
-                creds["password_enc"] = enc
-                del creds["password"]
-                changed = True
-            except Exception as e:
-                print(f"[警告] 迁移密码时出错: {e}")
+        changed = _migrate_password(creds) or changed
         data["credentials"] = creds
+    accounts = data.get("accounts")
+    if isinstance(accounts, list):
+        for account in accounts:
+            if isinstance(account, dict):
+                changed = _migrate_password(account) or changed
 
     # 迁移邮箱授权码
     notifier = data.get("email_notifier") or {}
@@ -157,9 +310,31 @@ def migrate_plaintext_to_encrypted(config_path: str) -> bool:
 
     if changed:
         try:
-            with open(config_path, "w", encoding="utf-8") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            atomic_write(config_path, json.dumps(data, ensure_ascii=False, indent=2))
         except Exception:
             return False
 
     return changed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from config import USER_CONFIG_FILE
+
+    parser = argparse.ArgumentParser(description="本地数据密钥管理")
+    parser.add_argument("--rotate", action="store_true", help="生成新密钥，并用新密钥重新加密配置文件中的全部密文")
+    parser.add_argument("--retire", action="store_true", help="删除配置文件已不再使用的旧密钥")
+    parser.add_argument("--config", default=USER_CONFIG_FILE, help="用户配置文件路径")
+    args = parser.parse_args()
+
+    if args.rotate:
+        print(f"[成功] 已生成新密钥 {rotate_key()}。")
+        print(f"[成功] 已重新加密 {reencrypt_config(args.config)} 个密文。")
+    if args.retire:
+        retired = retire_keys(args.config)
+        print(f"[成功] 已删除旧密钥: {', '.join(retired)}" if retired else "[信息] 没有可以删除的旧密钥。")
+    if not (args.rotate or args.retire):
+        ring = _load_keyring(create=False)
+        for kid in ring["keys"]:
+            print(f"{kid}{'  (当前)' if kid == ring['active'] else ''}")
@@ -0,0 +1,322 @@
+"""
+守护进程模式：常驻后台，按内部计划定时查询，替代每次由 cron/schtasks 启动新进程。
+- 会话（cookie）和已解密的密码/授权码在进程内保持，不必每次重新启动解释器、加载依赖和验证会话。
+- 每个房间可在配置中用 "interval_minutes" 单独设置查询间隔，未设置时使用 "daemon.interval_minutes"，
+  都未设置时使用 DAEMON_INTERVAL_MINUTES。同一时刻到期的房间合并为一批查询。
+- 启用 "daemon.adaptive" 后按剩余电量和用电速率为每个房间安排下次查询，"daemon.requests_per_hour" 限制每小时查询的房间数
+  （见 poll_scheduler.py）。
+- SIGTERM/SIGINT：完成当前这一批查询后退出。
+- SIGHUP（仅 Linux/macOS）或配置文件被修改：重新加载配置，已有房间保留原计划时间，新增房间立即查询。
+
+用法：
+    python TJUEcard_main.py --daemon
+"""
+
+from __future__ import annotations
+
+import heapq
+import json
+import os
+import signal
+import sqlite3
+import threading
+import time
+
+import metrics
+from config import USER_CONFIG_FILE, DAEMON_INTERVAL_MINUTES, DAEMON_RELOAD_CHECK_SECONDS
+from account_pool import uses_account_pool
+from forecast import Forecaster
+from reading_store import ReadingStore
+from poll_scheduler import NEVER_QUERIED, PollPolicy, RequestBudget, upstream_count
+from room_catalog import expand_selections
+from utils import build_query_payload, load_selections, setup_logger
+
+logger = setup_logger("TJUEcardQuery")
+
+
+def room_key(selection: dict) -> str:
+    """房间在计划表中的唯一标识（由查询参数决定，与房间在配置中的顺序无关）。"""
+    try:
+        return json.dumps(build_query_payload(selection), sort_keys=True, ensure_ascii=False)
+    except (KeyError, TypeError):
+        # 无效的房间配置也需要一个标识，查询时会作为失败结果报告
+        return json.dumps(selection, sort_keys=True, ensure_ascii=False, default=str)
+
+
+class QueryDaemon:
+    """
+    进程内的定时查询调度器。
+
+    :param app: 主程序模块，提供 load_run_config / create_session / ensure_session / handle_relogin /
+        run_queries / finish_run / export_metrics；由 TJUEcard_main 传入自身。
+        以 python TJUEcard_main.py --daemon 运行时主程序模块是 __main__，在这里导入 TJUEcard_main 会再加载并初始化一份
+    :param config_path: 用户配置文件路径，用于检测修改并重新加载
+    """
+
+    def __init__(self, app, config_path: str = USER_CONFIG_FILE):
+        self.app = app
+        self.config_path = config_path
+        self.config: dict | None = None
+        self.session = None
+        self.rooms: dict[str, tuple[dict, float]] = {}  # 房间标识 -> (房间选择, 查询间隔秒数)
+        self.policy: PollPolicy | None = None
+        self.budget = RequestBudget(0)
+        self._urgency: dict[str, float] = {}  # 房间标识 -> 配额不足时的查询顺序，越小越先查询
+        self._intervals: dict[str, float] = {}  # 房间标识 -> 本次安排的查询间隔（秒）
+        self._heap: list[tuple[float, int, str]] = []  # (下次查询时间, 序号, 房间标识)
+        self._due: dict[str, float] = {}  # 房间标识 -> 下次查询时间，与堆中的有效条目一致
+        self._seq = 0
+        self._config_mtime: float | None = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._reload_requested = False
+
+    # --- 计划表 ---
+
+    def _schedule(self, key: str, due: float) -> None:
+        self._due[key] = due
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, key))
+
+    def _pop_due(self, now: float) -> list:
+        """取出所有已到期的房间标识（跳过已被删除或重新安排的过期条目）。"""
+        keys = []
+        while self._heap and self._heap[0][0] <= now:
+            due, _, key = heapq.heappop(self._heap)
+            if self._due.get(key) == due:
+                keys.append(key)
+        return keys
+
+    def _next_due(self) -> float | None:
+        while self._heap:
+            due, _, key = self._heap[0]
+            if self._due.get(key) == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    # --- 配置 ---
+
+    def _config_file_mtime(self) -> float | None:
+        try:
+            return os.stat(self.config_path).st_mtime
+        except OSError:
+            return None
+
+    def load(self) -> bool:
+        """
+        加载（或重新加载）配置并更新计划表。
+
+        :return: 是否成功；重新加载失败时继续使用旧配置
+        """
+        self._config_mtime = self._config_file_mtime()
+        config = self.app.load_run_config()
+        if not config:
+            logger.error("守护进程加载配置失败，继续使用原有配置")
+            return False
+        selections = expand_selections(load_selections(config))
+        if not selections:
+            print("[错误] 配置中没有可查询的房间。")
+            logger.error("守护进程加载配置失败：配置中没有可查询的房间")
+            return False
+
+        default_minutes = (config.get("daemon") or {}).get("interval_minutes", DAEMON_INTERVAL_MINUTES)
+        rooms = {}
+        for selection in selections:
+            minutes = selection.get("interval_minutes", default_minutes)
+            try:
+                interval = max(float(minutes), 1.0) * 60
+            except (TypeError, ValueError):
+                logger.warning(f"房间的 interval_minutes 无效（{minutes}），使用默认间隔")
+                interval = float(default_minutes) * 60
+            rooms[room_key(selection)] = (selection, interval)
+
+        now = time.time()
+        for key in rooms:
+            if key not in self._due:
+                self._schedule(key, now)  # 新增的房间立即查询
+        for key in set(self._due) - set(rooms):
+            del self._due[key]  # 已删除的房间，堆中的条目会在弹出时被跳过
+            self._urgency.pop(key, None)
+            self._intervals.pop(key, None)
+
+        self.config = config
+        self.rooms = rooms
+        self.policy = PollPolicy(config)
+        self._seed_urgency([key for key in rooms if key not in self._urgency])
+        if self.policy.requests_per_hour != self.budget.per_hour:
+            self.budget = RequestBudget(self.policy.requests_per_hour)
+        print(f"[信息] 守护进程已加载配置，共 {len(rooms)} 个房间。")
+        logger.info(f"守护进程已加载配置，共 {len(rooms)} 个房间")
+        return True
+
+    def _seed_urgency(self, keys: list) -> None:
+        """新加入的房间按读数历史中的预测估计紧急程度，没有预测的房间在配额不足时最先查询。"""
+        for key in keys:
+            self._urgency[key] = NEVER_QUERIED
+        if not keys or self.policy.requests_per_hour <= 0:
+            return
+        try:
+            with ReadingStore() as store:
+                forecasts = Forecaster(store).forecast_all()
+        except sqlite3.Error as e:
+            logger.warning(f"读取耗尽预测失败: {e}")
+            return
+        rooms = {}  # (sysid, 房间id) -> 按电表汇总的查询结果
+        for sysid, room_id, meter, last_rest, _, hours_to_zero in forecasts:
+            room = rooms.setdefault((sysid, room_id), {"success": True, "meters": [], "meter_hours": {}})
+            room["meters"].append((meter, last_rest))
+            room["meter_hours"][meter] = hours_to_zero
+        for key in keys:
+            try:
+                payload = build_query_payload(self.rooms[key][0])
+            except (KeyError, TypeError):
+                continue
+            room = rooms.get((str(payload["sysid"]), str(payload["roomNo"])))
+            if room:
+                self._urgency[key] = self.policy.urgency(room)
+
+    # --- 信号 ---
+
+    def _install_signal_handlers(self) -> None:
+        def handle_stop(signum, frame):
+            logger.info(f"收到信号 {signum}，守护进程将在当前查询完成后退出")
+            self._stop.set()
+            self._wakeup.set()
+
+        def handle_reload(signum, frame):
+            logger.info("收到 SIGHUP，将重新加载配置")
+            self._reload_requested = True
+            self._wakeup.set()
+
+        signal.signal(signal.SIGTERM, handle_stop)
+        signal.signal(signal.SIGINT, handle_stop)
+        if hasattr(signal, "SIGHUP"):  # Windows 没有 SIGHUP
+            signal.signal(signal.SIGHUP, handle_reload)
+
+    def stop(self) -> None:
+        """请求守护进程退出（可在其他线程中调用）。"""
+        self._stop.set()
+        self._wakeup.set()
+
+    # --- 主循环 ---
+
+    def run_due(self, now: float) -> None:
+        """查询所有已到期的房间，并安排下一次查询时间。"""
+        keys = self._pop_due(now)
+        if not keys:
+            return
+        keys = self._apply_budget(keys, now)
+        if not keys:
+            return
+        config = self.config
+        selections = [self.rooms[key][0] for key in keys]
+        # 缓存的查询结果不超过查询间隔的一半，避免查询间隔较短的房间一直使用缓存
+        max_age = min(self._intervals.get(key, self.rooms[key][1]) for key in keys) / 2
+        # 设置了每小时配额时不在后台重新查询，实际访问服务器的房间数都在本轮结果中计入配额
+        background_refresh = self.budget.per_hour <= 0
+        logger.info(f"--- 定时查询开始，共 {len(selections)} 个房间 ---")
+
+        outcomes = None
+        if uses_account_pool(config):
+            # 多个账号时由账号池管理各账号的会话，会话在各轮之间保留
+            outcomes = self.app.run_queries(None, config, selections, None, max_age, background_refresh)
+            self.app.finish_run(config, outcomes)
+        else:
+            if self.session is None:
+                self.session = self.app.create_session()
+                if not self.app.ensure_session(self.session, config, fatal=False):
+                    # 登录失败时丢弃会话，下一轮重新尝试
+                    self.session = None
+
+            if self.session is not None:
+                session = self.session
+                outcomes = self.app.run_queries(
+                    session,
+                    config,
+                    selections,
+                    lambda: self.app.handle_relogin(session, config, fatal=False),
+                    max_age,
+                    background_refresh,
+                )
+                self.app.finish_run(config, outcomes)
+            else:
+                print("[错误] 无法建立有效会话，本轮查询跳过。")
+                logger.error("无法建立有效会话，本轮查询跳过")
+
+        metrics.observe("run", time.time() - now)
+        self.app.export_metrics(config)
+
+        finished = time.time()
+        if outcomes is None:
+            for key in keys:
+                self._schedule(key, finished + self.rooms[key][1])
+        else:
+            self.budget.spend(upstream_count(outcomes, now), finished)
+            for key, outcome in zip(keys, outcomes):
+                interval = self.policy.interval(outcome, self.rooms[key][1])
+                self._intervals[key] = interval
+                self._urgency[key] = self.policy.urgency(outcome)
+                self._schedule(key, finished + interval)
+            if self.policy.adaptive:
+                next_due = min(self._due[key] for key in keys)
+                next_time = time.strftime("%m-%d %H:%M", time.localtime(next_due))
+                logger.info(f"自适应查询计划：本批房间最早在 {next_time} 再次查询")
+        logger.info("--- 定时查询结束 ---\n")
+
+    def _apply_budget(self, keys: list, now: float) -> list:
+        """
+        到期房间超出本小时剩余配额时，按紧急程度保留可查询的房间，其余推迟到配额恢复时。
+
+        :return: 本轮查询的房间标识
+        """
+        remaining = self.budget.remaining(now)
+        if remaining is None or len(keys) <= remaining:
+            return keys
+        keys = sorted(keys, key=lambda key: self._urgency.get(key, NEVER_QUERIED))
+        keys, deferred = keys[:remaining], keys[remaining:]
+        # 推迟到本轮查询之后最早有配额可用的时间
+        retry_at = self.budget.next_available(now, len(keys))
+        for key in deferred:
+            self._schedule(key, retry_at)
+        msg = (
+            f"本小时查询配额（{self.budget.per_hour} 个房间）不足，"
+            f"{len(deferred)} 个房间推迟到 {time.strftime('%m-%d %H:%M', time.localtime(retry_at))}"
+        )
+        print(f"[信息] {msg}。")
+        logger.info(msg)
+        return keys
+
+    def run(self) -> int:
+        """
+        运行直到收到退出信号。
+
+        :return: 进程退出码
+        """
+        logger.info("--- 守护进程启动 ---")
+        if not self.load():
+            print(f"\n[操作建议] 请先运行 setup 来生成 {USER_CONFIG_FILE}。")
+            logger.info("--- 守护进程退出 ---\n")
+            return 1
+        self._install_signal_handlers()
+
+        while not self._stop.is_set():
+            if self._reload_requested or self._config_file_mtime() != self._config_mtime:
+                self._reload_requested = False
+                self.load()
+
+            now = time.time()
+            self.run_due(now)
+            if self._stop.is_set():
+                break
+
+            next_due = self._next_due()
+            timeout = DAEMON_RELOAD_CHECK_SECONDS
+            if next_due is not None:
+                timeout = min(timeout, max(next_due - time.time(), 0))
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+        print("[信息] 守护进程已退出。")
+        logger.info("--- 守护进程退出 ---\n")
+        return 0
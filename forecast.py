@@ -0,0 +1,187 @@
+"""
+电量耗尽预测：根据读数历史估算每个电表的用电速率和预计耗尽时间。
+- 增量更新：每个电表只保存一行状态（上次读数、上次时间、用电速率），新读数到来时按连续时间指数加权平均更新，
+  不需要每次重新拟合全部历史。
+- 充值（读数上升）时只重置基准读数，保留已学到的用电速率。
+- 批量计算：forecast_all() 用一条 SQL 对全部电表同时计算预计耗尽时间，不在 Python 中逐个房间循环。
+
+状态表与读数历史保存在同一个数据库（READINGS_FILE）中。
+"""
+
+from __future__ import annotations
+
+import math
+import sqlite3
+import time
+from typing import Iterable
+
+from config import FORECAST_HALFLIFE_HOURS
+from reading_store import ReadingStore
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS forecast_state (
+    sysid     TEXT    NOT NULL,
+    room_id   TEXT    NOT NULL,
+    meter     TEXT    NOT NULL,
+    last_ts   INTEGER NOT NULL,
+    last_rest REAL    NOT NULL,
+    rate      REAL,             -- 用电速率（度/小时），尚无足够数据时为 NULL
+    PRIMARY KEY (sysid, room_id, meter)
+) WITHOUT ROWID;
+"""
+
+
+def update_state(state: tuple | None, ts: int, rest: float, halflife_hours: float = FORECAST_HALFLIFE_HOURS) -> tuple:
+    """
+    用一条新读数更新单个电表的状态。
+
+    :param state: (last_ts, last_rest, rate)，首次读数时为 None
+    :param ts: 新读数的时间戳（秒）
+    :param rest: 新读数（度）
+    :param halflife_hours: 指数加权的半衰期（小时），越小越偏向最近的用电情况
+    :return: 新的 (last_ts, last_rest, rate)
+    """
+    if state is None:
+        return ts, rest, None
+    last_ts, last_rest, rate = state
+    hours = (ts - last_ts) / 3600
+    if hours <= 0:
+        return state
+    if rest > last_rest:
+        # 充值：以新读数为基准重新开始，速率保持不变
+        return ts, rest, rate
+    instant_rate = (last_rest - rest) / hours
+    if rate is None:
+        return ts, rest, instant_rate
+    # 连续时间的指数加权：间隔越长，新观测的权重越大
+    weight = 1 - math.exp(-hours * math.log(2) / halflife_hours)
+    return ts, rest, rate + weight * (instant_rate - rate)
+
+
+def forecast_rows(conn: sqlite3.Connection, within_hours: float | None = None, now: float | None = None) -> list:
+    """
+    在任意连接（包括只读连接）上批量计算所有电表的预计耗尽时间，见 Forecaster.forecast_all。
+
+    :return: [(sysid, room_id, meter, last_rest, rate, hours_to_zero), ...]
+    """
+    sql = """
+        SELECT sysid, room_id, meter, last_rest, rate,
+               MAX(last_rest / rate - (:now - last_ts) / 3600.0, 0) AS hours_to_zero
+        FROM forecast_state
+        WHERE rate > 0
+    """
+    params = {"now": now if now is not None else time.time()}
+    if within_hours is not None:
+        sql += " AND last_rest / rate - (:now - last_ts) / 3600.0 <= :within"
+        params["within"] = within_hours
+    return conn.execute(sql + " ORDER BY hours_to_zero", params).fetchall()
+
+
+class Forecaster:
+    """
+    维护每个电表的增量预测状态。
+
+    :param store: 读数历史，预测状态保存在同一个数据库中
+    :param halflife_hours: 指数加权的半衰期（小时）
+    """
+
+    def __init__(self, store: ReadingStore, halflife_hours: float = FORECAST_HALFLIFE_HOURS):
+        self.conn = store.conn
+        self.halflife_hours = halflife_hours
+        self.conn.executescript(_SCHEMA)
+
+    def observe(self, readings: Iterable[tuple]) -> dict:
+        """
+        用一批新读数增量更新预测状态。
+
+        :param readings: (ts, sysid, room_id, meter, rest)，与 ReadingStore.append 的格式相同
+        :return: {(sysid, room_id, meter): (rest, rate, hours_to_zero)}，无法预测时 hours_to_zero 为 None
+        """
+        readings = sorted(readings, key=lambda row: row[0])
+        if not readings:
+            return {}
+        keys = {(str(sysid), str(room_id), meter or "") for _, sysid, room_id, meter, _ in readings}
+        states = {}
+        for key in keys:
+            row = self.conn.execute(
+                "SELECT last_ts, last_rest, rate FROM forecast_state WHERE sysid = ? AND room_id = ? AND meter = ?", key
+            ).fetchone()
+            states[key] = tuple(row) if row else None
+
+        for ts, sysid, room_id, meter, rest in readings:
+            key = (str(sysid), str(room_id), meter or "")
+            states[key] = update_state(states[key], int(ts), float(rest), self.halflife_hours)
+
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO forecast_state (sysid, room_id, meter, last_ts, last_rest, rate) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(*key, *state) for key, state in states.items()],
+            )
+        return {
+            key: (last_rest, rate, max(last_rest / rate, 0) if rate and rate > 0 else None)
+            for key, (last_ts, last_rest, rate) in states.items()
+        }
+
+    def forecast_all(self, within_hours: float | None = None, now: float | None = None) -> list:
+        """
+        批量计算所有电表的预计耗尽时间（按耗尽时间升序）。
+
+        预计剩余时间会扣除上次读数之后已经过去的时间。
+
+        :param within_hours: 只返回预计在该小时数内耗尽的电表，None 表示全部有速率的电表
+        :param now: 当前时间戳，默认 time.time()
+        :return: [(sysid, room_id, meter, last_rest, rate, hours_to_zero), ...]
+        """
+        return forecast_rows(self.conn, within_hours, now)
+
+    def rebuild(self, store: ReadingStore) -> int:
+        """
+        根据完整的读数历史重新计算全部状态（仅在首次启用或导入历史数据后需要）。
+
+        :return: 处理的读数条数
+        """
+        with self.conn:
+            self.conn.execute("DELETE FROM forecast_state")
+        count = 0
+        key, state, rows = None, None, []
+        cursor = store.conn.execute("SELECT sysid, room_id, meter, ts, rest FROM readings ORDER BY sysid, room_id, meter, ts")
+        for sysid, room_id, meter, ts, rest in cursor:
+            if (sysid, room_id, meter) != key:
+                if key is not None:
+                    rows.append((*key, *state))
+                key, state = (sysid, room_id, meter), None
+            state = update_state(state, ts, rest, self.halflife_hours)
+            count += 1
+        if key is not None:
+            rows.append((*key, *state))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO forecast_state (sysid, room_id, meter, last_ts, last_rest, rate) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return count
+
+
+def format_hours(hours: float) -> str:
+    """把小时数格式化为便于阅读的文本，例如 "约 36 小时" / "约 5.2 天"。"""
+    if hours < 48:
+        return f"约 {hours:.0f} 小时"
+    return f"约 {hours / 24:.1f} 天"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="查看预计即将耗尽电量的房间")
+    parser.add_argument("--within", type=float, default=None, help="只显示预计在该小时数内耗尽的电表")
+    parser.add_argument("--rebuild", action="store_true", help="根据完整的读数历史重新计算预测状态")
+    args = parser.parse_args()
+
+    with ReadingStore() as reading_store:
+        forecaster = Forecaster(reading_store)
+        if args.rebuild:
+            print(f"[成功] 已根据 {forecaster.rebuild(reading_store)} 条历史读数重新计算预测状态。")
+        for sysid, room_id, meter, last_rest, rate, hours in forecaster.forecast_all(args.within):
+            print(f"{sysid} {room_id} {meter or '-'}: 剩余 {last_rest} 度，{rate:.2f} 度/小时，预计{format_hours(hours)}后耗尽")
@@ -0,0 +1,175 @@
+"""
+访问电费系统的共享 HTTP 客户端：
+- create_http_session() 是唯一创建 requests.Session 的地方，统一设置请求头、连接池大小和重试策略，连接保持复用（keep-alive）。
+- 只对幂等的 GET/HEAD 请求在连接失败、读取超时和 502/503/504 时自动重试，采用带随机抖动的指数退避；
+  POST（登录、查询）不自动重试，仍由调用方决定是否重连后再试。
+- 连接超时与读取超时分开设置。读取超时根据最近请求耗时的 P95 自适应调整，并限制在上下限之间：
+  服务器响应正常时很快放弃卡住的请求，服务器整体变慢时自动放宽。调用时显式传入 timeout 则不做调整。
+- 最近的请求耗时保存在 HTTP_LATENCY_FILE 中，由 cron 每次启动的新进程也能沿用之前的统计。
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import (
+    DEFAULT_HEADERS,
+    HTTP_POOL_MAXSIZE,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_READ_TIMEOUT_MIN,
+    HTTP_READ_TIMEOUT_MAX,
+    HTTP_TIMEOUT_P95_MULTIPLIER,
+    HTTP_LATENCY_WINDOW,
+    HTTP_GET_RETRIES,
+    HTTP_BACKOFF_FACTOR,
+    HTTP_LATENCY_FILE,
+)
+from utils import atomic_write
+
+# 至少积累这么多次请求耗时后才开始按百分位调整读取超时
+_MIN_SAMPLES = 5
+
+
+class LatencyTracker:
+    """
+    记录最近若干次请求的耗时（到收到响应头为止），并据此计算读取超时。线程安全，可在多个适配器间共享。
+
+    :param window: 保留的最近请求数
+    """
+
+    def __init__(self, window: int = HTTP_LATENCY_WINDOW):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p: float) -> float | None:
+        """返回最近请求耗时的第 p 百分位（秒），样本不足时返回 None。"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < _MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, max(0, math.ceil(p / 100 * len(samples)) - 1))
+        return samples[index]
+
+    def read_timeout(self) -> float:
+        """根据 P95 计算的读取超时，样本不足时使用上限。"""
+        p95 = self.percentile(95)
+        if p95 is None:
+            return HTTP_READ_TIMEOUT_MAX
+        return min(HTTP_READ_TIMEOUT_MAX, max(HTTP_READ_TIMEOUT_MIN, p95 * HTTP_TIMEOUT_P95_MULTIPLIER))
+
+    def load(self, path: str = HTTP_LATENCY_FILE) -> None:
+        """从文件读取之前运行记录的请求耗时，文件不存在或损坏时忽略。"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                samples = [float(value) for value in json.load(f)["samples"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        with self._lock:
+            self._samples.extend(samples[-self._samples.maxlen:])
+
+    def save(self, path: str = HTTP_LATENCY_FILE) -> None:
+        """保存最近的请求耗时，供下次运行使用。"""
+        with self._lock:
+            samples = [round(value, 4) for value in self._samples]
+        try:
+            atomic_write(path, json.dumps({"samples": samples}))
+        except OSError:
+            pass
+
+
+class EcardAdapter(HTTPAdapter):
+    """
+    带自适应超时的连接适配器：调用方未指定 timeout 时使用 (连接超时, 自适应读取超时)，
+    并记录每次成功请求的耗时。
+
+    :param latency: 共享的耗时统计
+    """
+
+    def __init__(self, latency: LatencyTracker, **kwargs):
+        self.latency = latency
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = (HTTP_CONNECT_TIMEOUT, self.latency.read_timeout())
+        start = time.monotonic()
+        try:
+            response = super().send(request, timeout=timeout, **kwargs)
+        except requests.exceptions.ReadTimeout:
+            # 超时也计入统计，服务器整体变慢时读取超时会随之放宽
+            self.latency.record(time.monotonic() - start)
+            raise
+        retries = getattr(response.raw, "retries", None)
+        if not (retries and retries.history):  # 经过重试的请求耗时包含退避等待，不计入
+            self.latency.record(time.monotonic() - start)
+        return response
+
+
+def _retry_policy() -> Retry:
+    return Retry(
+        total=HTTP_GET_RETRIES,
+        connect=HTTP_GET_RETRIES,
+        read=HTTP_GET_RETRIES,
+        status=HTTP_GET_RETRIES,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=frozenset({"GET", "HEAD"}),  # 只重试幂等请求
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        backoff_jitter=HTTP_BACKOFF_FACTOR,  # 随机抖动，避免多个进程同时重试
+        raise_on_status=False,  # 重试用尽后返回最后一次响应，由调用方按状态码处理
+        respect_retry_after_header=True,
+    )
+
+
+def mount_adapter(session: requests.Session, pool_maxsize: int) -> EcardAdapter:
+    """
+    为会话挂载（或按新的并发数重新挂载）适配器，沿用已有的耗时统计。
+
+    :param pool_maxsize: 每个主机保持的最大连接数，应不小于并发请求数
+    """
+    current = session.get_adapter("http://")
+    if isinstance(current, EcardAdapter) and current._pool_maxsize >= pool_maxsize:
+        return current  # 已有的连接池足够大，继续复用其中的长连接
+    latency = current.latency if isinstance(current, EcardAdapter) else LatencyTracker()
+    adapter = EcardAdapter(
+        latency,
+        pool_connections=1,  # 只访问一个主机
+        pool_maxsize=max(1, int(pool_maxsize)),
+        max_retries=_retry_policy(),
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return adapter
+
+
+def create_http_session(pool_maxsize: int = HTTP_POOL_MAXSIZE, load_latency: bool = True) -> requests.Session:
+    """
+    创建访问电费系统的会话。
+
+    :param pool_maxsize: 连接池大小
+    :param load_latency: 是否读取之前运行记录的请求耗时
+    """
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    adapter = mount_adapter(session, pool_maxsize)
+    if load_latency:
+        adapter.latency.load()
+    return session
+
+
+def save_latency_stats(session: requests.Session) -> None:
+    """保存会话的请求耗时统计（运行结束时调用）。"""
+    adapter = session.get_adapter("http://")
+    if isinstance(adapter, EcardAdapter):
+        adapter.latency.save()
@@ -0,0 +1,239 @@
+"""
+把历史 TJUEcard.log 中的查询成功记录导入电量读数历史（ReadingStore）。
+
+日志中每条成功记录的格式（由 query_room 写入）：
+    2024-03-01 08:00:01 - INFO - 查询成功。
+    \t查询房间: 北洋园电控 > ... > 312
+    \t查询参数: {'sysid': '001', 'elcarea': '...', 'elcbuis': '...', 'roomNo': '...'}
+    \t查询结果: 剩余电量: 86.35 度
+一房多表时查询结果为 "- 照明: 剩余电量 42.17 度 | - 空调: 剩余电量 118.6 度"（旧版本每项前有两个空格）。
+
+- 按固定大小的块读取文件，用正则在整块上匹配完整记录，内存占用与文件大小无关；跨块的记录留到下一块继续匹配。
+- 支持轮转后的旧日志和 gzip 压缩的日志（*.gz），未指定文件时导入 LOG_FILE 及其全部轮转文件（从旧到新）。
+- 读数按批写入，重复导入同一日志不会产生重复数据（同一电表同一秒的读数只保留一条）。
+- 日志时间按本机时区解释，与写入日志时相同。
+
+用法：
+    python log_import.py                              # 导入程序目录下的 TJUEcard.log*
+    python log_import.py old/TJUEcard.log.3.gz old/TJUEcard.log --db TJUEcard_readings.db
+"""
+
+from __future__ import annotations
+
+import argparse
+import ast
+import glob
+import gzip
+import os
+import re
+import time
+from typing import Iterator
+
+from config import LOG_FILE, READINGS_FILE
+from reading_store import ReadingStore
+
+CHUNK_SIZE = 4 * 1024 * 1024  # 每次读取的字节数
+MAX_RECORD_SIZE = 64 * 1024  # 单条记录的最大长度，跨块时最多保留这么多字节
+BATCH_SIZE = 50000  # 每批写入数据库的读数条数
+
+# 以固定文本开头，正则引擎可以先快速查找这段文本，而不是在每个位置尝试匹配时间戳
+_RECORD_RE = re.compile(
+    " - INFO - 查询成功。".encode("utf-8")
+    + rb"\r?\n\t"
+    + "查询房间: ".encode("utf-8")
+    + rb"[^\r\n]*\r?\n\t"
+    + "查询参数: ".encode("utf-8")
+    + rb"([^\r\n]*)\r?\n\t"
+    + "查询结果: ".encode("utf-8")
+    + rb"([^\r\n]*)"
+)
+_PAYLOAD_RE = re.compile(rb"'sysid': '([^']*)'.*'roomNo': '([^']*)'")
+_SINGLE_PREFIX = "剩余电量: ".encode("utf-8")
+_SINGLE_SUFFIX = " 度".encode("utf-8")
+_METER_RE = re.compile("- ([^|]*?): 剩余电量 (\\S+) 度".encode("utf-8"))
+_DATED_SUFFIX_RE = re.compile(r"\d{4}-\d\d-\d\d(?:_\d\d(?:-\d\d){0,2})?")
+_TIMESTAMP_WIDTH = len(b"2024-03-01 08:00:01")
+
+
+def parse_payload(raw: bytes) -> tuple[str, str] | None:
+    """从 "查询参数" 的 dict 文本中取出 (sysid, roomNo)，格式不符时退回到完整解析。"""
+    match = _PAYLOAD_RE.search(raw)
+    if match:
+        return match.group(1).decode("utf-8"), match.group(2).decode("utf-8")
+    try:
+        payload = ast.literal_eval(raw.decode("utf-8"))
+        return str(payload["sysid"]), str(payload["roomNo"])
+    except (ValueError, SyntaxError, KeyError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def parse_result(raw: bytes) -> list:
+    """
+    解析 "查询结果" 文本。
+
+    :return: [(电表名称, 剩余电量), ...]，单表房间的电表名称为空字符串；无法解析的读数被跳过
+    """
+    raw = raw.rstrip()
+    if raw.startswith(_SINGLE_PREFIX) and raw.endswith(_SINGLE_SUFFIX):
+        pairs = [(b"", raw[len(_SINGLE_PREFIX):-len(_SINGLE_SUFFIX)])]
+    else:
+        pairs = _METER_RE.findall(raw)
+    meters = []
+    for name, value in pairs:
+        try:
+            meters.append((name.decode("utf-8").strip(), float(value)))
+        except (ValueError, UnicodeDecodeError):
+            continue  # 服务器返回了非数值的读数，例如 None
+    return meters
+
+
+class _Parser:
+    """
+    解析单条记录。同一批房间在日志中反复出现，按原始文本缓存房间参数和当天零点的时间戳，
+    避免每条记录都重复解码和调用 mktime。
+    """
+
+    _CACHE_LIMIT = 100000
+
+    def __init__(self):
+        self._rooms: dict = {}
+        self._days: dict = {}
+
+    def room(self, raw: bytes) -> tuple[str, str] | None:
+        room = self._rooms.get(raw)
+        if room is None:
+            if len(self._rooms) >= self._CACHE_LIMIT:
+                self._rooms.clear()
+            room = self._rooms[raw] = parse_payload(raw) or ()
+        return room or None
+
+    def timestamp(self, data: bytes, start: int) -> int | None:
+        """
+        :param data: 当前块
+        :param start: " - INFO - 查询成功。" 在块中的位置，其前面是 "YYYY-mm-dd HH:MM:SS"
+        """
+        begin = start - _TIMESTAMP_WIDTH
+        if begin < 0 or (begin > 0 and data[begin - 1] != 0x0A):
+            return None
+        date = data[begin:begin + 10]
+        midnight = self._days.get(date)
+        try:
+            if midnight is None:
+                midnight = self._days[date] = int(time.mktime((int(date[:4]), int(date[5:7]), int(date[8:10]), 0, 0, 0, 0, 0, -1)))
+            return midnight + int(data[begin + 11:begin + 13]) * 3600 + int(data[begin + 14:begin + 16]) * 60 + int(data[begin + 17:start])
+        except ValueError:
+            return None
+
+
+def _open(path: str):
+    return gzip.open(path, "rb") if path.endswith(".gz") else open(path, "rb")
+
+
+def iter_readings(path: str, stats: dict | None = None) -> Iterator[tuple]:
+    """
+    流式解析一个日志文件，逐条产生读数 (ts, sysid, room_id, meter, rest)。
+
+    :param stats: 可选，累加 records（成功记录数）、skipped（无法解析的记录数）、bytes（读取的字节数）
+    """
+    stats = stats if stats is not None else {}
+    parser = _Parser()
+    tail = b""
+    with _open(path) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            stats["bytes"] = stats.get("bytes", 0) + len(chunk)
+            data = tail + chunk if tail else chunk
+            if not data:
+                break
+            end = 0
+            for match in _RECORD_RE.finditer(data):
+                if chunk and match.end() == len(data):
+                    break  # 查询结果可能被截断在块末尾，留到下一块
+                end = match.end()
+                ts = parser.timestamp(data, match.start())
+                raw_payload, raw_result = match.groups()
+                room = parser.room(raw_payload)
+                meters = parse_result(raw_result)
+                if ts is None or room is None or not meters:
+                    stats["skipped"] = stats.get("skipped", 0) + 1
+                    continue
+                stats["records"] = stats.get("records", 0) + 1
+                for meter, rest in meters:
+                    yield ts, room[0], room[1], meter, rest
+            if not chunk:
+                break
+            # 保留可能跨块的最后一部分（从行首开始），之前的内容不可能再属于某条完整记录
+            cut = max(end, len(data) - MAX_RECORD_SIZE)
+            if cut > end:
+                newline = data.find(b"\n", cut)
+                cut = len(data) if newline < 0 else newline + 1
+            tail = data[cut:]
+
+
+def default_log_files(log_file: str = LOG_FILE) -> list:
+    """
+    LOG_FILE 及其轮转文件，按从旧到新的顺序。
+
+    按大小轮转的文件序号越大越旧（TJUEcard.log.5.gz ... TJUEcard.log.1），按时间轮转的文件名中带日期。
+    """
+    numbered, dated = [], []
+    for path in glob.glob(glob.escape(log_file) + ".*"):
+        suffix = path[len(log_file) + 1:]
+        suffix = suffix[:-3] if suffix.endswith(".gz") else suffix
+        if suffix.isdigit():
+            numbered.append((-int(suffix), path))
+        elif _DATED_SUFFIX_RE.fullmatch(suffix):
+            dated.append((suffix, path))
+    files = [path for _, path in sorted(dated)] + [path for _, path in sorted(numbered)]
+    if os.path.exists(log_file):
+        files.append(log_file)
+    return files
+
+
+def import_logs(paths: list, db_path: str = READINGS_FILE, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    导入多个日志文件。
+
+    :return: 统计信息 {"files", "records", "skipped", "readings", "inserted", "bytes", "seconds"}
+    """
+    stats = {"files": 0, "records": 0, "skipped": 0, "readings": 0, "inserted": 0, "bytes": 0}
+    start = time.perf_counter()
+    with ReadingStore(db_path) as store:
+        batch = []
+        for path in paths:
+            stats["files"] += 1
+            for reading in iter_readings(path, stats):
+                batch.append(reading)
+                if len(batch) >= batch_size:
+                    stats["inserted"] += store.append(batch)
+                    stats["readings"] += len(batch)
+                    batch = []
+        if batch:
+            stats["inserted"] += store.append(batch)
+            stats["readings"] += len(batch)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="把历史日志中的查询结果导入电量读数历史")
+    parser.add_argument("files", nargs="*", help="日志文件（可为 .gz），默认导入程序目录下的 TJUEcard.log 及其轮转文件")
+    parser.add_argument("--db", default=READINGS_FILE, help="读数数据库路径")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="每批写入的读数条数")
+    args = parser.parse_args()
+
+    files = args.files or default_log_files()
+    if not files:
+        print("[错误] 没有找到日志文件。")
+        raise SystemExit(1)
+    for path in files:
+        print(f"[信息] 待导入: {path}")
+    result = import_logs(files, args.db, args.batch)
+    mb = result["bytes"] / 1024 / 1024
+    print(
+        f"[成功] 已导入 {result['files']} 个文件（{mb:.1f} MB，{result['seconds']:.1f} 秒）："
+        f"成功记录 {result['records']} 条，读数 {result['readings']} 条，新增 {result['inserted']} 条，"
+        f"无法解析 {result['skipped']} 条。"
+    )
+    if result["inserted"]:
+        print("[信息] 可运行 python forecast.py --rebuild 根据导入的读数重新计算耗尽预测。")
@@ -0,0 +1,188 @@
+"""
+运行指标：记录各阶段耗时（直方图）和事件次数（计数器），在运行结束时导出，便于找出批量查询的时间花在哪里。
+- 阶段：cookie_load / session_verify / relogin / token_fetch / query / email_send / run
+- 计数器：relogin_total、rooms_total、emails_total（按 result 区分）、account_disabled_total、
+  query_cache_total（fresh / stale / shared / miss）
+- 导出时在文件锁内与 METRICS_FILE 中的累计值合并后写回，同时生成 Prometheus textfile（METRICS_TEXTFILE）。
+  两个文件都是原子替换，node_exporter 的 textfile collector 可以直接读取，不需要额外的网络服务；
+  多个进程（定时任务、守护进程）同时导出也不会丢失计数。
+进程内只保存上次导出之后的增量，线程安全，可在并发查询的工作线程中调用。
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from config import METRICS_BUCKETS, METRICS_FILE, METRICS_TEXTFILE
+from utils import atomic_write, file_lock, write_json_atomic
+
+_PREFIX = "tjuecard"
+_FILE_MODE = 0o644  # 导出文件的权限
+_HELP = {
+    "phase_duration_seconds": "各阶段耗时（秒）",
+    "relogin_total": "重新登录次数",
+    "rooms_total": "查询的房间数",
+    "emails_total": "发送的通知邮件数",
+    "account_disabled_total": "因连续登录失败被暂停使用的账号次数",
+    "query_cache_total": "按查询结果缓存的使用情况统计的房间数",
+}
+
+_lock = threading.Lock()
+# 上次导出之后的增量
+# 阶段 -> {"buckets": [落在每个分桶内的次数（非累计）], "sum": 总耗时, "count": 次数}
+_histograms: dict = {}
+# 计数器名称 -> {result: 次数}
+_counters: dict = {}
+
+
+def _new_histogram() -> dict:
+    return {"buckets": [0] * len(METRICS_BUCKETS), "sum": 0.0, "count": 0}
+
+
+def observe(phase: str, seconds: float) -> None:
+    """记录某个阶段的一次耗时。超过最大分桶上界的耗时只计入 +Inf。"""
+    with _lock:
+        histogram = _histograms.setdefault(phase, _new_histogram())
+        for index, bound in enumerate(METRICS_BUCKETS):
+            if seconds <= bound:
+                histogram["buckets"][index] += 1
+                break
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+
+
+class Stopwatch:
+    """timed() 返回的计时结果，with 代码块结束后 seconds 为耗时（秒）。"""
+
+    __slots__ = ("seconds",)
+
+    def __init__(self):
+        self.seconds = 0.0
+
+    @property
+    def ms(self) -> float:
+        """耗时（毫秒），保留一位小数，用于结构化日志。"""
+        return round(self.seconds * 1000, 1)
+
+
+@contextmanager
+def timed(phase: str):
+    """记录 with 代码块的耗时，代码块抛出异常时同样记录。"""
+    stopwatch = Stopwatch()
+    start = time.perf_counter()
+    try:
+        yield stopwatch
+    finally:
+        stopwatch.seconds = time.perf_counter() - start
+        observe(phase, stopwatch.seconds)
+
+
+def inc(name: str, result: str = "", amount: int = 1) -> None:
+    """
+    计数器加一。
+
+    :param name: 计数器名称，例如 "relogin_total"
+    :param result: 结果标签，例如 "success" / "failure"
+    """
+    with _lock:
+        values = _counters.setdefault(name, {})
+        values[result] = values.get(result, 0) + amount
+
+
+def _take_deltas() -> tuple[dict, dict]:
+    global _histograms, _counters
+    with _lock:
+        histograms, counters = _histograms, _counters
+        _histograms, _counters = {}, {}
+    return histograms, counters
+
+
+def _merge(state: dict, histograms: dict, counters: dict) -> None:
+    for phase, delta in histograms.items():
+        total = state["histograms"].setdefault(phase, _new_histogram())
+        total["buckets"] = [a + b for a, b in zip(total["buckets"], delta["buckets"])]
+        total["sum"] += delta["sum"]
+        total["count"] += delta["count"]
+    for name, values in counters.items():
+        total = state["counters"].setdefault(name, {})
+        for result, amount in values.items():
+            total[result] = total.get(result, 0) + amount
+
+
+def _load_state(json_file: str) -> dict:
+    """读取累计值；文件不存在、损坏或分桶设置已改变时从零开始。"""
+    empty = {"version": 1, "buckets": list(METRICS_BUCKETS), "histograms": {}, "counters": {}}
+    try:
+        with open(json_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if not isinstance(state, dict) or state.get("buckets") != list(METRICS_BUCKETS):
+        return empty
+    state.setdefault("histograms", {})
+    state.setdefault("counters", {})
+    return state
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(state: dict) -> str:
+    """把累计值转换为 Prometheus 文本格式。"""
+    lines = []
+    name = f"{_PREFIX}_phase_duration_seconds"
+    lines.append(f"# HELP {name} {_HELP['phase_duration_seconds']}")
+    lines.append(f"# TYPE {name} histogram")
+    for phase in sorted(state["histograms"]):
+        histogram = state["histograms"][phase]
+        cumulative = 0
+        for bound, count in zip(METRICS_BUCKETS, histogram["buckets"]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{phase="{phase}",le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{phase="{phase}",le="+Inf"}} {histogram["count"]}')
+        lines.append(f'{name}_sum{{phase="{phase}"}} {_format_value(histogram["sum"])}')
+        lines.append(f'{name}_count{{phase="{phase}"}} {histogram["count"]}')
+
+    for counter in sorted(state["counters"]):
+        name = f"{_PREFIX}_{counter}"
+        lines.append(f"# HELP {name} {_HELP.get(counter, counter)}")
+        lines.append(f"# TYPE {name} counter")
+        for result, value in sorted(state["counters"][counter].items()):
+            labels = f'{{result="{result}"}}' if result else ""
+            lines.append(f"{name}{labels} {value}")
+
+    name = f"{_PREFIX}_last_export_timestamp_seconds"
+    lines.append(f"# HELP {name} 最近一次导出指标的时间")
+    lines.append(f"# TYPE {name} gauge")
+    lines.append(f"{name} {state['updated']}")
+    return "\n".join(lines) + "\n"
+
+
+def export(json_file: str = METRICS_FILE, textfile: str | None = METRICS_TEXTFILE) -> bool:
+    """
+    把上次导出之后的增量合并到 json_file，并写出 Prometheus textfile。
+
+    :param json_file: 保存累计值的 JSON 文件
+    :param textfile: Prometheus textfile 路径，为 None 时只写 JSON
+    :return: 是否导出成功；失败时增量保留到下次导出
+    """
+    histograms, counters = _take_deltas()
+    try:
+        with file_lock(json_file):
+            state = _load_state(json_file)
+            _merge(state, histograms, counters)
+            state["updated"] = int(time.time())
+            # 指标不含敏感信息，node_exporter 通常以其他用户运行，需要能读取这两个文件
+            write_json_atomic(json_file, state, indent=2, mode=_FILE_MODE)
+            if textfile:
+                atomic_write(textfile, render_prometheus(state), _FILE_MODE)
+        return True
+    except (OSError, TimeoutError) as e:
+        print(f"[警告] 导出运行指标失败: {e}")
+        with _lock:
+            _merge({"histograms": _histograms, "counters": _counters}, histograms, counters)
+        return False
@@ -0,0 +1,156 @@
+"""
+守护进程的自适应查询计划：按每个房间的剩余电量、近期用电速率和到提醒线的距离安排下次查询时间，
+并限制每小时向服务器查询的房间总数，把查询集中在即将用完电的房间上。
+
+- 提醒线：剩余电量降到 notification_threshold，或预计可用时间降到 depletion_alert_hours（取先到者）；
+  都未设置时为电量耗尽。
+- 下次查询间隔 = 预计到达提醒线所需时间 × lead_fraction，限制在 [min_interval_minutes, 房间的查询间隔] 之间。
+  已低于提醒线的房间按最短间隔查询（以便尽快发现充值）；没有用电速率的房间按房间的查询间隔查询。
+- requests_per_hour：最近一小时内实际访问服务器查询的房间数不超过该值（使用缓存结果的房间不计）。
+  设置后守护进程不使用查询结果缓存的后台刷新，所有访问服务器的查询都在本轮中完成并计入配额。
+  到期的房间超出配额时，按距离提醒线的时间从近到远查询，其余房间推迟到配额恢复时。
+
+在用户配置中启用：
+    "daemon": {"adaptive": true, "interval_minutes": 1440, "min_interval_minutes": 30, "requests_per_hour": 200}
+"""
+
+from __future__ import annotations
+
+import collections
+
+from config import (
+    DAEMON_ADAPTIVE,
+    DAEMON_LEAD_FRACTION,
+    DAEMON_MIN_INTERVAL_MINUTES,
+    DAEMON_REQUESTS_PER_HOUR,
+    DAEMON_RETRY_MINUTES,
+)
+
+# 从未查询过的房间在配额不足时最先查询
+NEVER_QUERIED = float("-inf")
+# 没有用电速率（刚开始记录或没有用电）的房间排在有速率的房间之后
+NO_FORECAST = float("inf")
+
+
+def hours_to_alert(outcome: dict, threshold: float = -1, depletion_alert_hours: float = -1) -> float | None:
+    """
+    预计多少小时后到达提醒线，已经低于提醒线时为 0。一房多表时按电表分别计算，取最早的一个。
+
+    :param outcome: 查询结果，需要 finish_run 写入的 meter_hours（各电表的预计耗尽时间）
+    :param threshold: 低电量提醒阈值（度），<0 表示未设置
+    :param depletion_alert_hours: 即将耗尽提醒的小时数，<0 表示未设置
+    :return: 小时数；查询失败或没有用电速率时为 None
+    """
+    if not outcome.get("success"):
+        return None
+    meters = outcome.get("meters") or [("", outcome.get("current_elec", -1))]
+    meter_hours = outcome.get("meter_hours") or {}
+    result = None
+    for meter, rest in meters:
+        try:
+            balance = float(rest)
+        except (TypeError, ValueError):
+            continue
+        if (threshold >= 0 and 0 <= balance <= threshold) or balance == 0:
+            return 0.0
+        hours_to_zero = meter_hours.get(meter or "")
+        if hours_to_zero is None or balance < 0:
+            continue
+        hours = hours_to_zero * (balance - max(threshold, 0)) / balance  # 按该电表当前用电速率线性估算
+        if depletion_alert_hours >= 0:
+            hours = min(hours, hours_to_zero - depletion_alert_hours)
+        hours = max(hours, 0.0)
+        result = hours if result is None else min(result, hours)
+    return result
+
+
+class RequestBudget:
+    """
+    最近一小时内的查询配额。
+
+    :param per_hour: 每小时最多查询的房间数，<=0 表示不限制
+    """
+
+    def __init__(self, per_hour: int):
+        self.per_hour = int(per_hour)
+        self._spent: collections.deque = collections.deque()  # (时间, 房间数)
+        self._total = 0
+
+    def _expire(self, now: float) -> None:
+        while self._spent and self._spent[0][0] <= now - 3600:
+            self._total -= self._spent.popleft()[1]
+
+    def remaining(self, now: float) -> int | None:
+        """当前还能查询的房间数，不限制时为 None。"""
+        if self.per_hour <= 0:
+            return None
+        self._expire(now)
+        return max(self.per_hour - self._total, 0)
+
+    def spend(self, count: int, now: float) -> None:
+        if self.per_hour > 0 and count > 0:
+            self._spent.append((now, count))
+            self._total += count
+
+    def next_available(self, now: float, pending: int = 0) -> float:
+        """
+        下一次有配额可用的时间。
+
+        :param pending: 即将在 now 查询、尚未计入的房间数
+        """
+        self._expire(now)
+        total = self._total + pending
+        for spent_at, count in self._spent:
+            if total < self.per_hour:
+                break
+            # 这一批查询满一小时后释放配额
+            total -= count
+            if total < self.per_hour:
+                return spent_at + 3600
+        return now if total < self.per_hour else now + 3600
+
+
+class PollPolicy:
+    """
+    按用户配置的 "daemon" 和 "email_notifier" 部分计算下次查询时间。
+
+    :param config: 用户配置
+    """
+
+    def __init__(self, config: dict):
+        options = config.get("daemon") or {}
+        notifier = config.get("email_notifier") or {}
+        self.adaptive = bool(options.get("adaptive", DAEMON_ADAPTIVE))
+        self.min_interval = max(float(options.get("min_interval_minutes", DAEMON_MIN_INTERVAL_MINUTES)), 1.0) * 60
+        self.lead_fraction = float(options.get("lead_fraction", DAEMON_LEAD_FRACTION))
+        self.retry_interval = max(float(options.get("retry_minutes", DAEMON_RETRY_MINUTES)), 1.0) * 60
+        self.requests_per_hour = int(options.get("requests_per_hour", DAEMON_REQUESTS_PER_HOUR))
+        self.threshold = float(notifier.get("notification_threshold", -1))
+        self.depletion_alert_hours = float(notifier.get("depletion_alert_hours", -1))
+
+    def urgency(self, outcome: dict) -> float:
+        """配额不足时的查询顺序，值越小越先查询。"""
+        hours = hours_to_alert(outcome, self.threshold, self.depletion_alert_hours)
+        if hours is not None:
+            return hours
+        return 0.0 if not outcome.get("success") else NO_FORECAST
+
+    def interval(self, outcome: dict, max_interval: float) -> float:
+        """
+        根据本次查询结果计算到下次查询的间隔（秒）。
+
+        :param max_interval: 房间的查询间隔，未启用自适应时直接使用
+        """
+        if not self.adaptive:
+            return max_interval
+        if not outcome.get("success"):
+            return min(self.retry_interval, max_interval)
+        hours = hours_to_alert(outcome, self.threshold, self.depletion_alert_hours)
+        if hours is None:
+            return max_interval
+        return min(max(hours * 3600 * self.lead_fraction, self.min_interval), max(max_interval, self.min_interval))
+
+
+def upstream_count(outcomes: list, started: float) -> int:
+    """本轮实际访问了服务器的房间数：使用缓存结果的房间（查询时间早于本轮开始）不计。"""
+    return sum(1 for outcome in outcomes if outcome.get("queried_at", started) >= started)
@@ -0,0 +1,465 @@
+"""
+查询结果缓存与请求合并：多个调用方几乎同时查询同一房间 (sysid, elcarea, elcbuis, roomNo) 时
+（例如定时任务和手动运行重叠、配置中多处订阅了同一房间），只向服务器发起一次 Token 获取和查询，其余调用方共享结果。
+
+- fresh_seconds 内查询过的房间直接返回上次的结果，不访问服务器。
+- 超过 fresh_seconds 但未超过 stale_seconds 时，先返回上次的结果，同时在后台线程中重新查询；
+  后台查询的结果写入缓存，并交给调用方记录读数、判断告警和发送通知（与前台查询到的结果相同），下次查询即可使用。
+- 缓存表与读数历史保存在同一个数据库（READINGS_FILE）中，多个进程共享。进程查询前在表中为房间写入"查询中"标记，
+  其他进程发现标记后等待其结果（最多 wait_seconds），不再重复查询；同一进程的多个线程通过内存中的标记合并。
+- 只缓存查询成功的结果，查询失败的房间下次仍会重新查询。
+- 使用缓存的结果标记为 cached，读数、告警和邮件只按实际查询到的结果（本次前台查询或后台重新查询）处理，
+  不会因旧结果重复发送或解除告警。
+- 默认不启用。
+
+在用户配置中调整：
+    "query_cache": {"enabled": true, "fresh_seconds": 300, "stale_seconds": 1800}
+守护进程设置了 requests_per_hour 时不在后台重新查询，以免超出配额。
+"""
+
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable
+
+import metrics
+from config import (
+    QUERY_CACHE_CLAIM_SECONDS,
+    QUERY_CACHE_ENABLED,
+    QUERY_CACHE_FRESH_SECONDS,
+    QUERY_CACHE_POLL_SECONDS,
+    QUERY_CACHE_STALE_SECONDS,
+    QUERY_CACHE_WAIT_SECONDS,
+    READINGS_FILE,
+)
+from utils import build_query_payload, format_room_path, setup_logger
+
+logger = setup_logger("TJUEcardQuery")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_cache (
+    room_key      TEXT PRIMARY KEY,  -- "sysid/elcarea/elcbuis/roomNo"
+    ts            REAL,              -- 缓存结果的查询时间，没有结果时为 NULL
+    outcome       TEXT,              -- 查询成功的结果（JSON）
+    claimed_by    TEXT,              -- 正在查询该房间的进程，没有时为 NULL
+    claimed_until REAL               -- "查询中" 标记的过期时间
+) WITHOUT ROWID;
+"""
+
+# 一条 SQL 中最多使用的参数个数（旧版本 SQLite 的上限为 999）
+_SQL_BATCH = 500
+
+# 缓存中保存的结果字段
+_CACHED_FIELDS = ("current_elec", "meters", "queried_at")
+
+
+def cache_key(selection: dict) -> str:
+    """房间在缓存中的标识。"""
+    payload = build_query_payload(selection)
+    return f"{payload['sysid']}/{payload['elcarea']}/{payload['elcbuis']}/{payload['roomNo']}"
+
+
+def _result_text(outcome: dict) -> str:
+    return outcome["message"].partition("查询结果:\n")[2]
+
+
+def _for_selection(entry: dict, selection: dict, note: str = "", cached: bool = True) -> dict:
+    """
+    用缓存或共享的结果构造 selection 的查询结果（房间路径使用 selection 自己的）。
+
+    :param entry: 包含 _CACHED_FIELDS 和 result_text 的结果
+    :param note: 附加在查询结果之后的说明
+    :param cached: 结果是否由其他运行或后台重新查询得到（已由其记录读数和发送通知），为 True 时 finish_run 只计入汇总
+    """
+    room_path = format_room_path(selection)
+    message = f"查询房间: {room_path}\n\n查询结果:\n{entry['result_text']}"
+    return {
+        "room_path": room_path,
+        "query_payload": build_query_payload(selection),
+        "success": True,
+        "message": message + note,
+        "cached": cached,
+        **{field: entry[field] for field in _CACHED_FIELDS},
+    }
+
+
+def _cached_note(queried_at: float) -> str:
+    return f"\n\n（{datetime.fromtimestamp(queried_at):%Y-%m-%d %H:%M:%S} 的查询结果）"
+
+
+class _Flight:
+    """进程内正在进行的一次房间查询，其他线程等待 done 后读取 outcome。"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.outcome: dict | None = None
+
+
+class QueryCache:
+    """
+    房间查询结果缓存。
+
+    :param path: 数据库文件路径，默认 READINGS_FILE
+    :param fresh_seconds: 在该时间内的结果直接使用
+    :param stale_seconds: 在该时间内的结果先使用，同时在后台重新查询
+    :param wait_seconds: 等待其他进程查询结果的最长时间
+    """
+
+    def __init__(
+        self,
+        path: str = READINGS_FILE,
+        fresh_seconds: float = QUERY_CACHE_FRESH_SECONDS,
+        stale_seconds: float = QUERY_CACHE_STALE_SECONDS,
+        wait_seconds: float = QUERY_CACHE_WAIT_SECONDS,
+    ):
+        self.path = path
+        self.fresh_seconds = max(0.0, float(fresh_seconds))
+        self.stale_seconds = max(self.fresh_seconds, float(stale_seconds))
+        self.wait_seconds = float(wait_seconds)
+        self.owner = uuid.uuid4().hex  # "查询中" 标记中的进程标识
+        self._flights: dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self._refreshes: list[threading.Thread] = []
+        conn = self._connect()
+        try:
+            conn.executescript(_SCHEMA)
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 每次操作使用单独的连接，可在后台刷新线程和查询线程中同时使用
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    @staticmethod
+    def _select(conn: sqlite3.Connection, keys: list) -> dict:
+        """读取缓存行：房间标识 -> (ts, outcome, claimed_by, claimed_until)。"""
+        rows = {}
+        for start in range(0, len(keys), _SQL_BATCH):
+            chunk = keys[start:start + _SQL_BATCH]
+            for key, *row in conn.execute(
+                "SELECT room_key, ts, outcome, claimed_by, claimed_until FROM query_cache "
+                f"WHERE room_key IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ):
+                rows[key] = tuple(row)
+        return rows
+
+    def _load(self, keys: list) -> dict:
+        """读取已缓存的结果：房间标识 -> 结果。"""
+        try:
+            conn = self._connect()
+            try:
+                rows = self._select(conn, keys)
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"读取查询结果缓存失败: {e}")
+            return {}
+        return {key: json.loads(row[1]) for key, row in rows.items() if row[1]}
+
+    def _claim(self, keys: list, fresh_seconds: float) -> tuple[list, list, dict]:
+        """
+        为房间写入"查询中"标记。
+
+        :return: (由本进程查询的房间, 其他进程正在查询的房间, 在此期间已被其他进程查询过的房间 -> 结果)
+        """
+        now = time.time()
+        mine, others, done = [], [], {}
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    rows = self._select(conn, keys)
+                    for key in keys:
+                        ts, outcome, claimed_by, claimed_until = rows.get(key, (None, None, None, None))
+                        if outcome and now - ts <= fresh_seconds:
+                            done[key] = json.loads(outcome)
+                        elif claimed_by and claimed_by != self.owner and claimed_until > now:
+                            others.append(key)
+                        else:
+                            mine.append(key)
+                    conn.executemany(
+                        "INSERT INTO query_cache (room_key, claimed_by, claimed_until) VALUES (?, ?, ?) "
+                        "ON CONFLICT (room_key) DO UPDATE SET claimed_by = excluded.claimed_by, "
+                        "claimed_until = excluded.claimed_until",
+                        [(key, self.owner, now + QUERY_CACHE_CLAIM_SECONDS) for key in mine],
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"写入查询标记失败，直接查询: {e}")
+            return list(keys), [], {}
+        return mine, others, done
+
+    def _finish(self, keys: list, outcomes: dict) -> None:
+        """保存查询成功的结果，并清除本进程写入的"查询中"标记。"""
+        saved = []
+        for key in keys:
+            outcome = outcomes.get(key)
+            if outcome and outcome["success"]:
+                entry = {field: outcome[field] for field in _CACHED_FIELDS}
+                entry["result_text"] = _result_text(outcome)
+                saved.append((outcome["queried_at"], json.dumps(entry, ensure_ascii=False), key))
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany(
+                        "UPDATE query_cache SET ts = ?, outcome = ?, claimed_by = NULL, claimed_until = NULL "
+                        "WHERE room_key = ?",
+                        saved,
+                    )
+                    conn.executemany(
+                        "UPDATE query_cache SET claimed_by = NULL, claimed_until = NULL "
+                        "WHERE room_key = ? AND claimed_by = ?",
+                        [(key, self.owner) for key in keys],
+                    )
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"保存查询结果缓存失败: {e}")
+
+    def _wait_for_others(self, keys: list, since: float) -> dict:
+        """
+        等待其他进程查询完这些房间。
+
+        :return: 其他进程已查询成功的房间 -> 结果；超时或查询失败的房间不在其中
+        """
+        results = {}
+        pending = list(keys)
+        deadline = time.monotonic() + self.wait_seconds
+        print(f"[信息] 其他进程正在查询其中 {len(keys)} 个房间，等待其结果...")
+        logger.info(f"等待其他进程查询 {len(keys)} 个房间")
+        while pending and time.monotonic() < deadline:
+            time.sleep(QUERY_CACHE_POLL_SECONDS)
+            try:
+                conn = self._connect()
+                try:
+                    rows = self._select(conn, pending)
+                finally:
+                    conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"读取查询结果缓存失败: {e}")
+                break
+            now, still = time.time(), []
+            for key in pending:
+                ts, outcome, claimed_by, claimed_until = rows.get(key, (None, None, None, None))
+                if outcome and ts >= since:
+                    results[key] = json.loads(outcome)
+                elif claimed_by and claimed_by != self.owner and claimed_until > now:
+                    still.append(key)
+                # 标记已清除但没有新结果：对方查询失败，由本进程重新查询
+            pending = still
+        return results
+
+    def _fetch(self, pending: dict, fetch: Callable[[list], list], fresh_seconds: float) -> dict:
+        """
+        查询缓存中没有可用结果的房间，同一房间在进程内和进程之间只查询一次。
+
+        :param pending: 房间标识 -> 房间选择
+        :param fetch: 实际查询一组房间的函数，返回与参数顺序一致的查询结果
+        :return: 房间标识 -> 查询结果
+        """
+        outcomes = {}
+        owned, joined = {}, {}
+        with self._lock:
+            for key in pending:
+                flight = self._flights.get(key)
+                if flight is None:
+                    owned[key] = self._flights[key] = _Flight()
+                else:
+                    joined[key] = flight
+
+        def query(keys: list) -> None:
+            try:
+                results = fetch([pending[key] for key in keys])
+                queried_at = time.time()
+                for key, outcome in zip(keys, results):
+                    outcome["queried_at"] = queried_at
+                    outcomes[key] = outcome
+            finally:
+                self._finish(keys, outcomes)
+
+        try:
+            if owned:
+                since = time.time()
+                mine, others, done = self._claim(list(owned), fresh_seconds)
+                for key, entry in done.items():
+                    outcomes[key] = _for_selection(entry, pending[key], _cached_note(entry["queried_at"]))
+                metrics.inc("query_cache_total", "shared", len(done))
+                if mine:
+                    query(mine)
+                if others:
+                    shared = self._wait_for_others(others, since)
+                    for key, entry in shared.items():
+                        outcomes[key] = _for_selection(entry, pending[key])
+                    metrics.inc("query_cache_total", "shared", len(shared))
+                    rest = [key for key in others if key not in shared]
+                    if rest:
+                        query(rest)
+        finally:
+            with self._lock:
+                for key, flight in owned.items():
+                    flight.outcome = outcomes.get(key)
+                    del self._flights[key]
+                    flight.done.set()
+
+        if joined:
+            metrics.inc("query_cache_total", "shared", len(joined))
+        for key, flight in joined.items():
+            flight.done.wait()
+            if flight.outcome is None:
+                # 负责查询的线程出错，由本线程重新查询
+                outcomes[key] = fetch([pending[key]])[0]
+            elif flight.outcome["success"]:
+                entry = {field: flight.outcome[field] for field in _CACHED_FIELDS}
+                entry["result_text"] = _result_text(flight.outcome)
+                # 同一进程中其他线程本次查询到的结果，仍按新结果处理
+                outcomes[key] = _for_selection(entry, pending[key], cached=flight.outcome.get("cached", False))
+            else:
+                outcomes[key] = {**flight.outcome, "room_path": format_room_path(pending[key])}
+        return outcomes
+
+    def run(
+        self,
+        selections: list,
+        fetch: Callable[[list], list],
+        refresh_fetch: Callable[[list], list] | None = None,
+        max_age: float | None = None,
+        on_refresh: Callable[[list], None] | None = None,
+    ) -> list:
+        """
+        查询已校验的房间，优先使用缓存的结果。
+
+        :param selections: 已校验的房间选择列表，可以包含重复的房间
+        :param fetch: 实际查询一组房间的函数，返回与参数顺序一致的查询结果
+        :param refresh_fetch: 后台重新查询时使用的函数（应使用单独的会话，重连失败时不退出进程）；
+            为 None 时不在后台重新查询，超过 fresh_seconds 的结果与没有缓存时一样直接查询
+        :param max_age: 可使用的结果的最长时间（秒），同时限制 fresh_seconds 和 stale_seconds；
+            守护进程中按房间的查询间隔设置，避免查询间隔较短的房间一直使用缓存
+        :param on_refresh: 后台重新查询结束后在后台线程中调用，参数为重新查询的结果列表，
+            用于记录读数和发送通知（先返回的旧结果标记为 cached，不会被处理）
+        :return: 与 selections 顺序一致的查询结果
+        """
+        fresh_seconds, stale_seconds = self.fresh_seconds, self.stale_seconds
+        if max_age is not None:
+            fresh_seconds, stale_seconds = min(fresh_seconds, max_age), min(stale_seconds, max_age)
+
+        groups: dict[str, list] = {}  # 房间标识 -> 在 selections 中的序号
+        for index, selection in enumerate(selections):
+            groups.setdefault(cache_key(selection), []).append(index)
+        cached = self._load(list(groups)) if stale_seconds > 0 else {}
+
+        results = [None] * len(selections)
+        now = time.time()
+        missing, stale = {}, {}
+        for key, indices in groups.items():
+            entry = cached.get(key)
+            age = now - entry["queried_at"] if entry else None
+            if entry is None or age > (stale_seconds if refresh_fetch else fresh_seconds):
+                missing[key] = selections[indices[0]]
+                continue
+            for index in indices:
+                results[index] = _for_selection(entry, selections[index], _cached_note(entry["queried_at"]))
+            if age > fresh_seconds:
+                stale[key] = selections[indices[0]]
+
+        hits = len(groups) - len(missing)
+        if hits:
+            metrics.inc("query_cache_total", "fresh", hits - len(stale))
+            metrics.inc("query_cache_total", "stale", len(stale))
+            print(f"[信息] {hits} 个房间使用最近的查询结果，不再访问服务器。")
+            logger.info(f"{hits} 个房间使用缓存的查询结果（其中 {len(stale)} 个在后台重新查询）")
+        if stale:
+            self._refresh_in_background(stale, refresh_fetch, fresh_seconds, on_refresh)
+        if missing:
+            metrics.inc("query_cache_total", "miss", len(missing))
+            outcomes = self._fetch(missing, fetch, fresh_seconds)
+            for key, outcome in outcomes.items():
+                first, *duplicates = groups[key]
+                results[first] = outcome
+                for index in duplicates:
+                    # 重复配置的同一房间共享一次查询的结果
+                    results[index] = {**outcome, "room_path": format_room_path(selections[index])}
+        return results
+
+    def _refresh_in_background(
+        self,
+        pending: dict,
+        fetch: Callable[[list], list],
+        fresh_seconds: float,
+        on_refresh: Callable[[list], None] | None,
+    ) -> None:
+        print(f"[信息] 正在后台重新查询 {len(pending)} 个房间...")
+        thread = threading.Thread(
+            target=self._refresh, args=(pending, fetch, fresh_seconds, on_refresh), name="TJUEcardRefresh"
+        )
+        with self._lock:
+            self._refreshes = [t for t in self._refreshes if t.is_alive()] + [thread]
+        thread.start()
+
+    def _refresh(
+        self,
+        pending: dict,
+        fetch: Callable[[list], list],
+        fresh_seconds: float,
+        on_refresh: Callable[[list], None] | None,
+    ) -> None:
+        try:
+            outcomes = self._fetch(pending, fetch, fresh_seconds)
+            if on_refresh is not None:
+                on_refresh(list(outcomes.values()))
+            succeeded = sum(1 for outcome in outcomes.values() if outcome["success"])
+            logger.info(f"后台重新查询完成：成功 {succeeded} 个，失败 {len(outcomes) - succeeded} 个")
+        except Exception as e:
+            logger.warning(f"后台重新查询失败: {e}")
+
+    def wait_for_refreshes(self, timeout: float | None = None) -> None:
+        """等待后台重新查询结束（单次运行退出前调用，使结果写入缓存、读数历史并发送通知）。"""
+        with self._lock:
+            threads = list(self._refreshes)
+        for thread in threads:
+            thread.join(timeout)
+
+
+_caches: dict = {}  # 数据库路径和缓存设置 -> QueryCache，守护进程中各轮查询复用
+_caches_lock = threading.Lock()
+
+
+def get_query_cache(config: dict | None, path: str = READINGS_FILE) -> QueryCache | None:
+    """按用户配置的 "query_cache" 部分返回缓存，未启用时返回 None。"""
+    options = (config or {}).get("query_cache") or {}
+    if not options.get("enabled", QUERY_CACHE_ENABLED):
+        return None
+    settings = (
+        path,
+        options.get("fresh_seconds", QUERY_CACHE_FRESH_SECONDS),
+        options.get("stale_seconds", QUERY_CACHE_STALE_SECONDS),
+        options.get("wait_seconds", QUERY_CACHE_WAIT_SECONDS),
+    )
+    with _caches_lock:
+        cache = _caches.get(settings)
+        if cache is None:
+            try:
+                cache = _caches[settings] = QueryCache(*settings)
+            except sqlite3.Error as e:
+                logger.warning(f"打开查询结果缓存失败，本次不使用缓存: {e}")
+                return None
+        return cache
+
+
+def wait_for_refreshes(timeout: float | None = None) -> None:
+    """等待所有缓存的后台重新查询结束。"""
+    with _caches_lock:
+        caches = list(_caches.values())
+    for cache in caches:
+        cache.wait_for_refreshes(timeout)
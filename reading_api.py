@@ -0,0 +1,343 @@
+"""
+本地只读 HTTP 接口：从读数历史（READINGS_FILE）中提供每个房间的最新读数、读数时间、近期统计和耗尽预测，
+供仪表盘和聊天机器人读取，不访问学校服务器。
+
+- 以只读方式打开数据库，不创建文件、不修改表结构；数据库还不存在时接口返回 503，创建后自动开始提供数据。
+- 后台线程每隔 refresh_seconds 用 PRAGMA data_version 检查数据库是否被其他进程（定时查询、守护进程、日志导入）写入，
+  有新数据时一次性重建全部房间的响应并替换内存中的快照；请求线程只读取快照中已序列化好的 JSON，不访问数据库。
+- 每个房间的响应带有 ETag，客户端带 If-None-Match 请求且数据未变化时返回 304。
+- 房间标识为 "sysid/房间id"，与告警状态中的房间标识相同。
+
+接口：
+    GET  /health                       服务状态与快照时间
+    GET  /rooms/<sysid>/<房间id>        单个房间
+    GET  /rooms                        全部房间
+    GET  /rooms?id=001/xxx&id=002/yyy  指定的多个房间
+    POST /rooms  {"rooms": ["001/xxx", "002/yyy"]}  指定的多个房间（房间很多时使用）
+
+用法：
+    python reading_api.py --port 18181
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+from config import (
+    READINGS_FILE,
+    READING_API_HOST,
+    READING_API_MAX_BULK_ROOMS,
+    READING_API_PORT,
+    READING_API_REFRESH_SECONDS,
+    READING_API_SUMMARY_DAYS,
+)
+from forecast import forecast_rows
+from utils import setup_logger
+
+logger = setup_logger("TJUEcardQuery")
+
+# 数据没有变化时也定期重建快照，使近期统计的时间窗口和预计可用时间跟随当前时间
+_MAX_SNAPSHOT_AGE = 3600
+
+
+def _etag(data: bytes) -> str:
+    return '"' + hashlib.sha1(data).hexdigest()[:20] + '"'
+
+
+def _dumps(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class ReadingSnapshot:
+    """
+    某一时刻全部房间的响应，构建后不再修改，可在多个请求线程中共享。
+
+    :param rooms: 房间标识 -> 该房间的响应内容
+    :param generated: 构建时间戳
+    """
+
+    def __init__(self, rooms: dict, generated: int):
+        self.generated = generated
+        self.bodies = {key: _dumps(room) for key, room in rooms.items()}  # 房间标识 -> 序列化后的 JSON
+        self.etags = {key: _etag(body) for key, body in self.bodies.items()}
+        self.all_body = self.bulk_body(sorted(self.bodies))
+        self.all_etag = _etag(self.all_body)
+
+    def bulk_body(self, keys: list) -> bytes:
+        """多个房间的响应 {"generated": ..., "rooms": {房间标识: 房间或 null}}，直接拼接已序列化的 JSON。"""
+        parts = [_dumps(key) + b":" + self.bodies.get(key, b"null") for key in keys]
+        return b'{"generated":' + str(self.generated).encode() + b',"rooms":{' + b",".join(parts) + b"}}"
+
+    def bulk_etag(self, keys: list) -> str:
+        digest = hashlib.sha1()
+        for key in keys:
+            digest.update(key.encode("utf-8") + b"\0" + self.etags.get(key, "-").encode() + b"\0")
+        return '"' + digest.hexdigest()[:20] + '"'
+
+
+def open_readonly(path: str) -> sqlite3.Connection:
+    """以只读方式打开读数数据库：文件不存在时报错而不是创建，也不会修改日志模式或表结构。"""
+    return sqlite3.connect(pathlib.Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+
+
+def build_snapshot(
+    conn: sqlite3.Connection,
+    summary_days: float = READING_API_SUMMARY_DAYS,
+    now: float | None = None,
+) -> ReadingSnapshot:
+    """用三条聚合查询读出全部电表的最新读数、近期统计和耗尽预测，组装为快照。"""
+    now = time.time() if now is None else now
+    since = int(now - summary_days * 86400)
+    # 数据库可能刚创建、还没有写入过读数或预测状态
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "readings" not in tables:
+        return ReadingSnapshot({}, int(now))
+    summaries = {
+        (sysid, room_id, meter): {"days": summary_days, "count": count, "min": low, "max": high, "since": first_ts}
+        for sysid, room_id, meter, count, low, high, first_ts in conn.execute(
+            "SELECT sysid, room_id, meter, COUNT(*), MIN(rest), MAX(rest), MIN(ts) FROM readings "
+            "WHERE ts >= ? GROUP BY sysid, room_id, meter",
+            (since,),
+        )
+    }
+    forecasts = {
+        (sysid, room_id, meter): (rate, hours_to_zero)
+        for sysid, room_id, meter, _, rate, hours_to_zero in (
+            forecast_rows(conn, now=now) if "forecast_state" in tables else []
+        )
+    }
+
+    rooms: dict = {}
+    # SQLite 中与 MAX() 一起查询的普通列取自最大值所在的行，即最新读数
+    for sysid, room_id, meter, ts, rest in conn.execute(
+        "SELECT sysid, room_id, meter, MAX(ts), rest FROM readings GROUP BY sysid, room_id, meter"
+    ):
+        room = rooms.setdefault(f"{sysid}/{room_id}", {"sysid": sysid, "room_id": room_id, "updated": 0, "meters": []})
+        rate, hours_to_zero = forecasts.get((sysid, room_id, meter), (None, None))
+        room["meters"].append({
+            "meter": meter,
+            "rest": rest,
+            "ts": ts,
+            "summary": summaries.get((sysid, room_id, meter)),
+            "rate": round(rate, 4) if rate is not None else None,
+            "hours_to_zero": round(hours_to_zero, 1) if hours_to_zero is not None else None,
+        })
+        room["updated"] = max(room["updated"], ts)
+    return ReadingSnapshot(rooms, int(now))
+
+
+class ReadingCache:
+    """
+    在后台线程中维护最新的快照。
+
+    :param path: 读数历史数据库
+    :param refresh_seconds: 检查数据库是否有新数据的间隔
+    :param summary_days: 近期统计覆盖的天数
+    """
+
+    def __init__(
+        self,
+        path: str = READINGS_FILE,
+        refresh_seconds: float = READING_API_REFRESH_SECONDS,
+        summary_days: float = READING_API_SUMMARY_DAYS,
+    ):
+        self.path = path
+        self.refresh_seconds = refresh_seconds
+        self.summary_days = summary_days
+        self.snapshot: ReadingSnapshot | None = None
+        self._stop = threading.Event()
+        self._ready = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> "ReadingCache":
+        """启动后台刷新线程，等到第一次读取数据库完成后返回；数据库还不存在时 snapshot 为 None。"""
+        self._thread = threading.Thread(target=self._run, name="ReadingCache", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _rebuild(self, conn: sqlite3.Connection) -> None:
+        start = time.perf_counter()
+        self.snapshot = build_snapshot(conn, self.summary_days)
+        logger.info(
+            f"读数接口已更新快照：{len(self.snapshot.bodies)} 个房间，耗时 {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+
+    def _run(self) -> None:
+        # SQLite 连接只在本线程中使用；data_version 只在其他连接提交写入后变化
+        conn = None
+        version = None
+        try:
+            while True:
+                try:
+                    if conn is None and os.path.exists(self.path):
+                        conn = open_readonly(self.path)
+                    if conn is not None:
+                        current = conn.execute("PRAGMA data_version").fetchone()[0]
+                        if (
+                            self.snapshot is None
+                            or current != version
+                            or time.time() - self.snapshot.generated >= _MAX_SNAPSHOT_AGE
+                        ):
+                            version = current
+                            self._rebuild(conn)
+                except sqlite3.Error as e:
+                    # 刷新失败时继续提供旧的快照
+                    logger.warning(f"读数接口更新快照失败: {e}")
+                self._ready.set()
+                if self._stop.wait(self.refresh_seconds):
+                    break
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def _etag_matches(header: str | None, etag: str) -> bool:
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "TJUEcardReadingAPI"
+    protocol_version = "HTTP/1.1"  # 支持 keep-alive
+    disable_nagle_algorithm = True  # 响应头和响应体分两次写出，避免 keep-alive 连接上每个响应都等待延迟确认
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, body: bytes, status: int = 200, etag: str | None = None):
+        if etag and _etag_matches(self.headers.get("If-None-Match"), etag):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json;charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status: int, message: str):
+        self._send(_dumps({"error": message}), status)
+
+    def _unavailable(self):
+        self._error(503, f"读数数据库尚不存在或无法读取: {self.server.cache.path}")
+
+    def _send_rooms(self, keys: list):
+        if len(keys) > self.server.max_bulk_rooms:
+            return self._error(400, f"一次最多查询 {self.server.max_bulk_rooms} 个房间")
+        snapshot = self.server.cache.snapshot
+        if snapshot is None:
+            return self._unavailable()
+        self._send(snapshot.bulk_body(keys), etag=snapshot.bulk_etag(keys))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        snapshot = self.server.cache.snapshot
+        parts = [unquote(part) for part in url.path.strip("/").split("/")]
+        if snapshot is None:
+            return self._unavailable()
+        if parts == ["health"]:
+            return self._send(_dumps({"status": "ok", "rooms": len(snapshot.bodies), "generated": snapshot.generated}))
+        if parts == ["rooms"]:
+            keys = parse_qs(url.query).get("id")
+            if keys is None:
+                return self._send(snapshot.all_body, etag=snapshot.all_etag)
+            return self._send_rooms(keys)
+        if len(parts) == 3 and parts[0] == "rooms":
+            key = f"{parts[1]}/{parts[2]}"
+            body = snapshot.bodies.get(key)
+            if body is None:
+                return self._error(404, f"没有房间 {key} 的读数")
+            return self._send(body, etag=snapshot.etags[key])
+        self._error(404, "接口不存在")
+
+    def do_POST(self):
+        if urlparse(self.path).path.rstrip("/") != "/rooms":
+            return self._error(404, "接口不存在")
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            keys = json.loads(self.rfile.read(length) or b"{}").get("rooms")
+        except (ValueError, AttributeError):
+            return self._error(400, "请求体必须是 JSON：{\"rooms\": [\"sysid/房间id\", ...]}")
+        if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+            return self._error(400, "rooms 必须是 \"sysid/房间id\" 的列表")
+        self._send_rooms(keys)
+
+
+class ReadingAPIServer:
+    """
+    读数接口服务器。
+
+    :param cache: 已启动的 ReadingCache
+    :param port: 监听端口，0 表示随机分配
+    """
+
+    def __init__(
+        self,
+        cache: ReadingCache,
+        host: str = READING_API_HOST,
+        port: int = READING_API_PORT,
+        max_bulk_rooms: int = READING_API_MAX_BULK_ROOMS,
+    ):
+        self.httpd = ThreadingHTTPServer((host, port), _Handler)
+        self.httpd.daemon_threads = True
+        self.httpd.cache = cache
+        self.httpd.max_bulk_rooms = max_bulk_rooms
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def serve_forever(self) -> None:
+        self.httpd.serve_forever()
+
+    def close(self) -> None:
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="提供电量读数的本地只读 HTTP 接口")
+    parser.add_argument("--host", default=READING_API_HOST)
+    parser.add_argument("--port", type=int, default=READING_API_PORT)
+    parser.add_argument("--db", default=READINGS_FILE, help="读数数据库路径")
+    parser.add_argument("--refresh", type=float, default=READING_API_REFRESH_SECONDS, help="检查新数据的间隔（秒）")
+    parser.add_argument("--summary-days", type=float, default=READING_API_SUMMARY_DAYS, help="近期统计覆盖的天数")
+    args = parser.parse_args()
+
+    cache = ReadingCache(args.db, args.refresh, args.summary_days).start()
+    server = ReadingAPIServer(cache, args.host, args.port)
+    if cache.snapshot is None:
+        print(f"[警告] 读数数据库 {args.db} 尚不存在，创建前接口返回 503。")
+    rooms = len(cache.snapshot.bodies) if cache.snapshot else 0
+    print(f"[信息] 读数接口已启动: {server.base_url}（{rooms} 个房间），按 Ctrl+C 停止。")
+    logger.info(f"读数接口已启动: {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        cache.stop()
+        print("\n[信息] 读数接口已停止。")
@@ -0,0 +1,179 @@
+"""
+电量读数历史存储（SQLite，WAL 模式）：
+- 每次查询成功后追加 (时间戳, sysid, 房间id, 电表名称, 剩余电量)，一房多表时每个电表一行。单表房间的电表名称为空字符串。
+- 主键为 (sysid, room_id, meter, ts) 的 WITHOUT ROWID 表，同一房间的数据在磁盘上连续存放，按房间查询时间范围只需一次索引扫描。
+- compact() 把超过保留期的数据降采样为每个电表每天一条（保留当天最后一次读数），并回收空间。
+
+用法：
+    python reading_store.py --room <sysid> <房间id> [--days 7]
+    python reading_store.py --compact 90
+"""
+
+from __future__ import annotations
+
+import argparse
+import sqlite3
+import time
+from datetime import datetime
+from typing import Iterable
+
+from config import READINGS_FILE
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    sysid   TEXT    NOT NULL,
+    room_id TEXT    NOT NULL,
+    meter   TEXT    NOT NULL,
+    ts      INTEGER NOT NULL,
+    rest    REAL    NOT NULL,
+    PRIMARY KEY (sysid, room_id, meter, ts)
+) WITHOUT ROWID;
+"""
+
+
+def readings_from_outcomes(outcomes: Iterable[dict], ts: float | None = None) -> list:
+    """
+    把 query_room 的结果转换为读数行 [(ts, sysid, room_id, meter, rest), ...]，只包含成功的房间。
+
+    :param outcomes: query_room 返回的结果列表
+    :param ts: 读数时间，默认当前时间；带有 queried_at 的结果（来自查询结果缓存）使用其实际查询时间，
+        重复记录时与已有读数相同而被忽略
+    """
+    ts = int(ts if ts is not None else time.time())
+    rows = []
+    for outcome in outcomes:
+        if not outcome or not outcome.get("success"):
+            continue
+        payload = outcome["query_payload"]
+        reading_ts = int(outcome.get("queried_at", ts))
+        for meter, rest in outcome.get("meters", []):
+            try:
+                rows.append((reading_ts, str(payload["sysid"]), str(payload["roomNo"]), meter or "", float(rest)))
+            except (TypeError, ValueError):
+                continue  # 服务器返回了非数值的读数
+    return rows
+
+
+class ReadingStore:
+    """
+    电量读数历史。
+
+    :param path: 数据库文件路径，默认 READINGS_FILE
+    """
+
+    def __init__(self, path: str = READINGS_FILE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        # auto_vacuum 只能在建表前设置，对已有数据库无影响
+        self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, readings: Iterable[tuple]) -> int:
+        """
+        批量追加读数，同一电表同一秒的重复读数会被忽略。
+
+        :param readings: (ts, sysid, room_id, meter, rest) 的可迭代对象，ts 为 Unix 时间戳（秒）
+        :return: 实际写入的行数
+        """
+        with self.conn:
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO readings (ts, sysid, room_id, meter, rest) VALUES (?, ?, ?, ?, ?)",
+                ((int(ts), str(sysid), str(room_id), meter or "", float(rest)) for ts, sysid, room_id, meter, rest in readings),
+            )
+        return cursor.rowcount
+
+    def record_outcomes(self, outcomes: Iterable[dict], ts: float | None = None) -> int:
+        """
+        记录一批查询结果中所有成功房间的全部电表读数。
+
+        :param outcomes: query_room 返回的结果列表
+        :param ts: 读数时间，默认当前时间
+        :return: 写入的行数
+        """
+        rows = readings_from_outcomes(outcomes, ts)
+        return self.append(rows) if rows else 0
+
+    def query_range(
+        self, sysid: str, room_id: str, start: float | None = None, end: float | None = None, meter: str | None = None
+    ) -> list:
+        """
+        按时间范围查询某个房间的读数，按时间升序返回 [(ts, meter, rest), ...]。
+
+        :param start: 起始时间戳（含），None 表示不限
+        :param end: 结束时间戳（不含），None 表示不限
+        :param meter: 只查询指定电表，None 表示全部电表
+        """
+        sql = "SELECT ts, meter, rest FROM readings WHERE sysid = ? AND room_id = ?"
+        params: list = [str(sysid), str(room_id)]
+        if meter is not None:
+            sql += " AND meter = ?"
+            params.append(meter)
+        if start is not None:
+            sql += " AND ts >= ?"
+            params.append(int(start))
+        if end is not None:
+            sql += " AND ts < ?"
+            params.append(int(end))
+        return self.conn.execute(sql + " ORDER BY ts, meter", params).fetchall()
+
+    def latest(self, sysid: str, room_id: str) -> list:
+        """返回某个房间每个电表的最新读数 [(ts, meter, rest), ...]。"""
+        return self.conn.execute(
+            "SELECT MAX(ts), meter, rest FROM readings WHERE sysid = ? AND room_id = ? GROUP BY meter ORDER BY meter",
+            (str(sysid), str(room_id)),
+        ).fetchall()
+
+    def compact(self, older_than_days: float) -> int:
+        """
+        把早于 older_than_days 天的读数降采样为每个电表每天一条，并回收释放的空间。
+
+        :return: 删除的行数
+        """
+        cutoff = int(time.time() - older_than_days * 86400)
+        with self.conn:
+            cursor = self.conn.execute(
+                """
+                DELETE FROM readings
+                WHERE ts < :cutoff
+                  AND EXISTS (
+                      -- 同一电表同一天内还有更晚的读数，则删除当前这条（按主键做范围查找）
+                      SELECT 1 FROM readings AS later
+                      WHERE later.sysid = readings.sysid
+                        AND later.room_id = readings.room_id
+                        AND later.meter = readings.meter
+                        AND later.ts > readings.ts
+                        AND later.ts < MIN(:cutoff, (readings.ts / 86400 + 1) * 86400)
+                  )
+                """,
+                {"cutoff": cutoff},
+            )
+        deleted = cursor.rowcount
+        self.conn.execute("PRAGMA incremental_vacuum")
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return deleted
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查看或整理电量读数历史")
+    parser.add_argument("--room", nargs=2, metavar=("SYSID", "ROOM_ID"), help="查看指定房间的读数")
+    parser.add_argument("--days", type=float, default=7, help="查看最近多少天的读数")
+    parser.add_argument("--compact", type=float, metavar="DAYS", help="把早于该天数的读数降采样为每天一条")
+    args = parser.parse_args()
+
+    with ReadingStore() as store:
+        if args.compact is not None:
+            print(f"[成功] 已整理历史读数，删除 {store.compact(args.compact)} 条。")
+        if args.room:
+            for ts, meter, rest in store.query_range(*args.room, start=time.time() - args.days * 86400):
+                print(f"{datetime.fromtimestamp(ts):%Y-%m-%d %H:%M:%S}  {meter or '-':<8} {rest} 度")
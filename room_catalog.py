@@ -0,0 +1,373 @@
+"""
+离线房间目录：并发抓取 校区(area) → 区域(district) → 楼栋(buis) → 楼层(floor) → 房间(room) 的完整树，保存到本地 SQLite。
+- 每个节点保存 id、名称和父节点链接，setup 与批量查询可以在不访问网络的情况下解析房间。
+- 增量刷新：新出现的节点总是抓取；已抓取过的节点在抓取后 max_age 的最后 CATALOG_REFRESH_SPREAD 部分内到期，
+  到期时间按节点分散，一次全量抓取得到的节点不会在同一次运行中全部重新抓取，而是分摊到之后的多次运行中。
+  每个节点仍最迟在 max_age 内刷新一次，子节点列表没有变化时只更新抓取时间、保留原有子树，
+  被服务器删除的节点连同子树一起删除。
+
+用法：
+    python room_catalog.py                 # 首次全量抓取；之后只刷新已到期的节点（每个节点最迟7天刷新一次）
+    python room_catalog.py --full          # 忽略已有数据，全量重新抓取
+    python room_catalog.py --find 301      # 按名称查找房间
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from config import (
+    API_URLS,
+    KEY_MAP,
+    TARGET_SYSTEMS,
+    LOAD_ELECTRIC_INDEX_URL,
+    CATALOG_FILE,
+    CATALOG_WORKERS,
+    CATALOG_MAX_AGE_DAYS,
+    CATALOG_REFRESH_SPREAD,
+)
+from utils import bill_page_url, get_bill_csrf_token, invalidate_bill_csrf_token
+
+# 层级顺序；PAYLOAD_KEYS 为请求下一层时，当前层 id 在请求参数中对应的字段名
+LEVELS = ["system", "area", "district", "buis", "floor", "room"]
+PAYLOAD_KEYS = {"system": "sysid", "area": "area", "district": "district", "buis": "build", "floor": "floor"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id       INTEGER PRIMARY KEY,
+    parent_id     INTEGER REFERENCES nodes(node_id) ON DELETE CASCADE,
+    sysid         TEXT NOT NULL,
+    level         TEXT NOT NULL,
+    item_id       TEXT NOT NULL,
+    name          TEXT NOT NULL,
+    children_hash TEXT,
+    fetched_at    REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_nodes_parent ON nodes(parent_id, item_id);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_nodes_system ON nodes(item_id) WHERE level = 'system';
+CREATE INDEX IF NOT EXISTS idx_nodes_name ON nodes(sysid, level, name);
+"""
+
+
+def open_catalog(path: str = CATALOG_FILE) -> sqlite3.Connection:
+    """打开（必要时创建）房间目录数据库。"""
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.executescript(_SCHEMA)
+    return conn
+
+
+# --- 抓取 ---
+
+
+def fetch_electric_systems(session: requests.Session) -> list:
+    """从电控系统选择页面获取 TARGET_SYSTEMS 中各系统的 id 和名称。"""
+    headers = session.headers.copy()
+    headers.pop("X-Requested-With", None)
+    response = session.get(LOAD_ELECTRIC_INDEX_URL, headers=headers)
+    response.raise_for_status()
+    from bs4 import BeautifulSoup  # 只有抓取目录时才需要，按需加载
+
+    soup = BeautifulSoup(response.text, "html.parser")
+    systems = []
+    for tag in soup.find_all("li", class_="my_link"):
+        name = tag.get_text(strip=True)
+        if name in TARGET_SYSTEMS:
+            try:
+                systems.append({"id": tag.get("onclick", "").split("'")[1], "name": name})
+            except IndexError:
+                continue
+    return systems
+
+
+def fetch_children(session: requests.Session, level: str, payload: dict) -> list:
+    """
+    请求某一层级的选项列表。与 setup.fetch_options 不同，失败时抛出异常，避免把网络错误当成“没有子节点”。
+
+    :param level: 要获取的层级，API_URLS / KEY_MAP 的键
+    :param payload: 请求参数，包含 sysid 以及各上级的 id
+    :return: [{'id': ..., 'name': ...}, ...]
+    """
+    sysid = payload["sysid"]
+    csrf_token = get_bill_csrf_token(session, sysid)
+    if not csrf_token:
+        raise requests.RequestException(f"无法获取电控系统 {sysid} 的CSRF Token，可能由于会话失效")
+    map_keys = KEY_MAP[level]
+    api_headers = {"X-CSRF-TOKEN": csrf_token, "Referer": bill_page_url(sysid)}
+    response = session.post(API_URLS[level], data=payload, headers=api_headers)
+    if response.status_code in (401, 403):
+        invalidate_bill_csrf_token(session, sysid)
+    response.raise_for_status()
+    data = response.json()
+    return [
+        {"id": str(item[map_keys["id"]]), "name": str(item[map_keys["name"]])}
+        for item in data.get(map_keys["list"], [])
+    ]
+
+
+def _children_hash(children: list) -> str:
+    digest = hashlib.sha1()
+    for child in sorted(children, key=lambda c: c["id"]):
+        digest.update(f"{child['id']}\x1f{child['name']}\x1e".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _node_payload(conn: sqlite3.Connection, node_id: int) -> dict:
+    """沿父节点链接向上，构造请求该节点子列表所需的参数。"""
+    payload = {}
+    while node_id is not None:
+        row = conn.execute("SELECT parent_id, level, item_id FROM nodes WHERE node_id = ?", (node_id,)).fetchone()
+        payload[PAYLOAD_KEYS[row["level"]]] = row["item_id"]
+        node_id = row["parent_id"]
+    return payload
+
+
+def _apply_children(conn: sqlite3.Connection, node: sqlite3.Row, children: list, now: float) -> bool:
+    """把抓取到的子节点写入数据库，返回子节点列表是否发生了变化。"""
+    new_hash = _children_hash(children)
+    if new_hash == node["children_hash"]:
+        conn.execute("UPDATE nodes SET fetched_at = ? WHERE node_id = ?", (now, node["node_id"]))
+        return False
+
+    child_level = LEVELS[LEVELS.index(node["level"]) + 1]
+    keep_ids = [child["id"] for child in children]
+    conn.execute(
+        f"DELETE FROM nodes WHERE parent_id = ? AND item_id NOT IN ({','.join('?' * len(keep_ids))})",
+        (node["node_id"], *keep_ids),
+    )
+    conn.executemany(
+        "INSERT INTO nodes (parent_id, sysid, level, item_id, name) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT(parent_id, item_id) DO UPDATE SET name = excluded.name",
+        [(node["node_id"], node["sysid"], child_level, child["id"], child["name"]) for child in children],
+    )
+    conn.execute(
+        "UPDATE nodes SET children_hash = ?, fetched_at = ? WHERE node_id = ?", (new_hash, now, node["node_id"])
+    )
+    return True
+
+
+def _refresh_due(node: sqlite3.Row, now: float, max_age: float) -> bool:
+    """节点是否需要重新抓取：从未抓取过，或已超过按节点分散的到期时间（介于 max_age × (1 - SPREAD) 与 max_age 之间）。"""
+    if node["fetched_at"] is None:
+        return True
+    # 按 node_id 得到 [0, 1) 内固定的偏移，同一节点每次的刷新周期相同，不同节点的到期时间相互错开
+    offset = (node["node_id"] * 2654435761 % 2**32) / 2**32
+    return now - node["fetched_at"] >= max_age * (1 - CATALOG_REFRESH_SPREAD * offset)
+
+
+def crawl_catalog(
+    session: requests.Session,
+    conn: sqlite3.Connection,
+    max_age: float | None = CATALOG_MAX_AGE_DAYS * 86400,
+    workers: int = CATALOG_WORKERS,
+) -> dict:
+    """
+    逐层并发抓取所有电控系统的房间树。
+
+    :param session: 已登录的会话
+    :param conn: open_catalog 返回的数据库连接
+    :param max_age: 每个节点最迟在该时间（秒）内重新抓取，未到期的节点直接复用已有子节点；None 表示全量重新抓取
+    :param workers: 并发请求数
+    :return: 统计信息 {'fetched': 请求数, 'changed': 子列表变化的节点数, 'failed': 失败数}
+    """
+    stats = {"fetched": 0, "changed": 0, "failed": 0}
+    now = time.time()
+
+    for system in fetch_electric_systems(session):
+        conn.execute(
+            "INSERT INTO nodes (parent_id, sysid, level, item_id, name) VALUES (NULL, ?, 'system', ?, ?) "
+            "ON CONFLICT(item_id) WHERE level = 'system' DO UPDATE SET name = excluded.name",
+            (system["id"], system["id"], system["name"]),
+        )
+    conn.commit()
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="TJUEcardCatalog") as executor:
+        for level in LEVELS[:-1]:
+            child_level = LEVELS[LEVELS.index(level) + 1]
+            nodes = conn.execute("SELECT * FROM nodes WHERE level = ?", (level,)).fetchall()
+            if max_age is not None:
+                nodes = [node for node in nodes if _refresh_due(node, now, max_age)]
+            if not nodes:
+                continue
+
+            print(f"[信息] 正在抓取 {child_level} 列表，共 {len(nodes)} 个请求...")
+            futures = [
+                (node, executor.submit(fetch_children, session, child_level, _node_payload(conn, node["node_id"])))
+                for node in nodes
+            ]
+            for node, future in futures:
+                stats["fetched"] += 1
+                try:
+                    children = future.result()
+                except (requests.RequestException, ValueError, KeyError) as e:
+                    # 抓取失败时保留原有子树，下次刷新再试
+                    stats["failed"] += 1
+                    print(f"[警告] 抓取 {node['name']} 的 {child_level} 列表失败: {e}")
+                    continue
+                if _apply_children(conn, node, children, now):
+                    stats["changed"] += 1
+            conn.commit()
+
+    return stats
+
+
+# --- 查询 ---
+
+
+def catalog_is_fresh(conn: sqlite3.Connection, max_age: float = CATALOG_MAX_AGE_DAYS * 86400) -> bool:
+    """目录中所有非房间节点都已抓取过子节点，且最早的一次抓取在 max_age（秒）以内。"""
+    count, unfetched, oldest = conn.execute(
+        "SELECT COUNT(*), SUM(fetched_at IS NULL), MIN(fetched_at) FROM nodes WHERE level != 'room'"
+    ).fetchone()
+    return bool(count) and not unfetched and time.time() - oldest < max_age
+
+
+def list_systems(conn: sqlite3.Connection) -> list:
+    """目录中的电控系统，格式与 setup.select_electric_system 的选项相同。"""
+    return [
+        {"name": row["name"], "id": row["item_id"]}
+        for row in conn.execute("SELECT item_id, name FROM nodes WHERE level = 'system' ORDER BY node_id")
+    ]
+
+
+def list_children(
+    conn: sqlite3.Connection, sysid: str, level: str, payload: dict, max_age: float | None = None
+) -> list | None:
+    """
+    从目录中读取某一层级的选项，参数与 setup.fetch_options 相同。
+
+    :param max_age: 父节点超过该时间（秒）未抓取时视为没有数据，None 表示不检查
+    :return: [{'id': ..., 'name': ...}, ...]；目录中没有该节点的数据时返回 None
+    """
+    row = conn.execute("SELECT * FROM nodes WHERE level = 'system' AND item_id = ?", (sysid,)).fetchone()
+    for parent_level in LEVELS[1:LEVELS.index(level)]:
+        if row is None:
+            return None
+        item_id = payload.get(PAYLOAD_KEYS[parent_level])
+        row = conn.execute(
+            "SELECT * FROM nodes WHERE parent_id = ? AND item_id = ?", (row["node_id"], item_id)
+        ).fetchone()
+    if row is None or row["fetched_at"] is None:
+        return None
+    if max_age is not None and time.time() - row["fetched_at"] >= max_age:
+        return None
+    return [
+        {"id": child["item_id"], "name": child["name"]}
+        for child in conn.execute("SELECT item_id, name FROM nodes WHERE parent_id = ? ORDER BY node_id", (row["node_id"],))
+    ]
+
+
+def _selection_for_node(conn: sqlite3.Connection, node_id: int) -> dict:
+    selection = {}
+    while node_id is not None:
+        row = conn.execute("SELECT parent_id, level, item_id, name FROM nodes WHERE node_id = ?", (node_id,)).fetchone()
+        selection[row["level"]] = {"id": row["item_id"], "name": row["name"]}
+        node_id = row["parent_id"]
+    return {level: selection[level] for level in LEVELS}
+
+
+def find_rooms(conn: sqlite3.Connection, room_name: str, system: str | None = None) -> list:
+    """按房间名称查找，返回完整的房间选择列表（可直接写入 selections）。"""
+    sql = "SELECT node_id FROM nodes WHERE level = 'room' AND name = ?"
+    params = [room_name]
+    if system:
+        sql += " AND sysid IN (SELECT item_id FROM nodes WHERE level = 'system' AND (item_id = ? OR name = ?))"
+        params += [system, system]
+    return [_selection_for_node(conn, row["node_id"]) for row in conn.execute(sql, params)]
+
+
+def resolve_room(conn: sqlite3.Connection, system: str, path: list) -> dict | None:
+    """
+    根据名称路径解析房间，例如 resolve_room(conn, "北洋园电控", ["31斋", "3层", "301"])。
+
+    path 从任意层级开始、以房间名结尾，逐级向上匹配；匹配到唯一房间时返回完整的房间选择，否则返回 None。
+    """
+    if not path:
+        return None
+    matches = []
+    for candidate in find_rooms(conn, str(path[-1]), system):
+        names = [candidate[level]["name"] for level in LEVELS[1:]]
+        if names[-len(path):] == [str(name) for name in path]:
+            matches.append(candidate)
+    return matches[0] if len(matches) == 1 else None
+
+
+def expand_selections(selections: list, catalog_file: str = CATALOG_FILE) -> list:
+    """
+    把房间列表中的简写条目 {"system": "北洋园电控", "path": "31斋 > 3层 > 301"} 解析为完整的房间选择。
+
+    完整的房间选择原样保留；无法解析的简写条目也原样保留，交由后续校验逐个报告错误。
+    """
+    if not any(isinstance(item, dict) and "path" in item for item in selections):
+        return selections
+    if not os.path.exists(catalog_file):
+        print(f"[警告] 房间目录 {catalog_file} 不存在，请先运行 room_catalog.py 生成。")
+        return selections
+
+    conn = open_catalog(catalog_file)
+    try:
+        expanded = []
+        for item in selections:
+            if isinstance(item, dict) and "path" in item:
+                path = item["path"]
+                if isinstance(path, str):
+                    path = [part.strip() for part in path.split(">") if part.strip()]
+                resolved = resolve_room(conn, str(item.get("system", "")), path)
+                if resolved is None:
+                    print(f"[警告] 无法在房间目录中唯一确定房间: {item}")
+                expanded.append(resolved or item)
+            else:
+                expanded.append(item)
+        return expanded
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="抓取并维护本地房间目录")
+    parser.add_argument("--full", action="store_true", help="忽略已有数据，全量重新抓取")
+    parser.add_argument("--max-age", type=float, default=CATALOG_MAX_AGE_DAYS, help="每个节点最迟在该天数内重新抓取")
+    parser.add_argument("--workers", type=int, default=CATALOG_WORKERS, help="并发请求数")
+    parser.add_argument("--find", metavar="ROOM", help="按房间名称查找，不访问网络")
+    args = parser.parse_args()
+
+    if args.find:
+        catalog = open_catalog()
+        for selection in find_rooms(catalog, args.find):
+            print(json.dumps(selection, ensure_ascii=False))
+        sys.exit(0)
+
+    # 复用主程序的登录逻辑
+    import TJUEcard_main as main_module
+    from config import USER_CONFIG_FILE, COOKIE_FILE
+    from utils import load_config, load_cookies
+
+    user_config = load_config(USER_CONFIG_FILE)
+    if not user_config:
+        sys.exit(1)
+    from http_client import create_http_session
+
+    catalog_session = create_http_session(pool_maxsize=args.workers)
+    if not (load_cookies(catalog_session, COOKIE_FILE) and main_module.verify_session(catalog_session)):
+        main_module.handle_relogin(catalog_session, user_config)
+
+    catalog = open_catalog()
+    started = time.perf_counter()
+    result = crawl_catalog(
+        catalog_session, catalog, max_age=None if args.full else args.max_age * 86400, workers=args.workers
+    )
+    rooms = catalog.execute("SELECT COUNT(*) FROM nodes WHERE level = 'room'").fetchone()[0]
+    print(
+        f"[成功] 房间目录已更新：请求 {result['fetched']} 次，变化 {result['changed']} 处，失败 {result['failed']} 次，"
+        f"共 {rooms} 个房间，用时 {time.perf_counter() - started:.1f} 秒。"
+    )
@@ -1,13 +1,193 @@
 import smtplib
 from email.mime.text import MIMEText
 from email.utils import formataddr
+from typing import Callable
+
+# 支持的邮箱域名与对应的SMTP服务器
+SMTP_SERVERS = {
+    "qq.com": ("smtp.qq.com", 465),
+    "163.com": ("smtp.163.com", 465),
+    "tju.edu.cn": ("smtp.tju.edu.cn", 465),
+}
+
+
+def get_smtp_server(sender_email: str) -> tuple[tuple[str, int] | None, str]:
+    """
+    根据发件人邮箱域名选择SMTP服务器。
+
+    :return: ((主机, 端口), "")；不支持时返回 (None, 错误信息)
+    """
+    if "@" not in sender_email:
+        return None, "邮箱地址格式不正确"
+    domain = sender_email.split("@")[1].lower()
+    if domain not in SMTP_SERVERS:
+        return None, f"不支持的邮箱域名: {domain}"
+    return SMTP_SERVERS[domain], ""
+
+
+def build_message(sender_email: str, recipient_email: str, subject: str, body: str) -> MIMEText:
+    """构造一封纯文本通知邮件。"""
+    # 创建邮件内容
+    msg = MIMEText(body, "plain", "utf-8")
+    # 设置邮件头部信息
+    msg["From"] = formataddr(["TJUEcard电费查询助手", sender_email])  # 发件人昵称和账号
+    msg["To"] = formataddr(["用户", recipient_email])  # 收件人昵称和账号
+    msg["Subject"] = subject  # 邮件主题
+    return msg
+
+
+class NotificationDispatcher:
+    """
+    在一次运行中复用SMTP连接发送通知邮件：同一发件人和SMTP服务器只建立一次连接、登录一次。
+
+    digest=True 时 queue() 只登记通知，flush() 把发往同一收件人的全部通知合并为一封汇总邮件。
+    建议以 with 语句使用，退出时会发送未发出的汇总并关闭全部连接。
+
+    :param digest: 是否合并同一收件人的通知
+    """
+
+    def __init__(self, digest: bool = False):
+        self.digest = digest
+        self._connections: dict[tuple[str, str, int], smtplib.SMTP_SSL] = {}
+        # (发件人, 收件人) -> (授权码, [(主题, 正文, 发送成功后的回调), ...])
+        self._pending: dict[tuple[str, str], tuple[str, list]] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            self.flush()
+        finally:
+            self.close()
+
+    def _connect(self, sender_email: str, auth_code: str, server: tuple[str, int]) -> smtplib.SMTP_SSL:
+        key = (sender_email, *server)
+        connection = self._connections.get(key)
+        if connection is None:
+            connection = smtplib.SMTP_SSL(*server)
+            try:
+                connection.login(sender_email, auth_code)
+            except Exception:
+                connection.close()
+                raise
+            self._connections[key] = connection
+        return connection
+
+    def _drop(self, sender_email: str, server: tuple[str, int]) -> None:
+        connection = self._connections.pop((sender_email, *server), None)
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+    def send(
+        self, sender_email: str, auth_code: str, recipient_email: str, subject: str, body: str
+    ) -> tuple[bool, str]:
+        """
+        立即发送一封邮件，复用已登录的连接；连接已被服务器关闭时重连一次。
+
+        :return: (成功状态, 错误信息)，与 send_notification_email 相同
+        """
+        server, error_msg = get_smtp_server(sender_email)
+        if server is None:
+            print(f"[错误] {error_msg}")
+            return False, error_msg
+
+        msg = build_message(sender_email, recipient_email, subject, body).as_string()
+        for attempt in range(2):
+            try:
+                connection = self._connect(sender_email, auth_code, server)
+                connection.sendmail(sender_email, [recipient_email], msg)
+                return True, ""
+            except smtplib.SMTPServerDisconnected as e:
+                # 空闲连接可能已被服务器断开，丢弃后重新连接
+                self._drop(sender_email, server)
+                if attempt == 0:
+                    continue
+                error_msg = f"邮件发送失败: {str(e)}"
+            except Exception as e:
+                # 如果发生任何异常，则认为发送失败
+                self._drop(sender_email, server)
+                error_msg = f"邮件发送失败: {str(e)}"
+            break
+        print(f"[错误] {error_msg}")
+        return False, error_msg
+
+    def queue(
+        self,
+        sender_email: str,
+        auth_code: str,
+        recipient_email: str,
+        subject: str,
+        body: str,
+        on_sent: Callable[[], None] | None = None,
+    ) -> None:
+        """
+        登记一条通知，在 flush() 时与同一收件人的其他通知合并发送。
+
+        :param on_sent: 包含这条通知的邮件发送成功后调用
+        """
+        _, messages = self._pending.setdefault((sender_email, recipient_email), (auth_code, []))
+        messages.append((subject, body, on_sent))
+
+    def has_pending(self) -> bool:
+        """是否有尚未发送的通知。"""
+        return bool(self._pending)
+
+    def flush(self) -> list:
+        """
+        发送全部已登记的通知，每个收件人一封；只有一条通知时按原主题和正文发送。
+
+        :return: [(收件人, 主题, 成功状态, 错误信息), ...]
+        """
+        results = []
+        pending, self._pending = self._pending, {}
+        for (sender_email, recipient_email), (auth_code, messages) in pending.items():
+            if len(messages) == 1:
+                subject, body, _ = messages[0]
+            else:
+                subject, body = build_digest([(item_subject, item_body) for item_subject, item_body, _ in messages])
+            success, error_msg = self.send(sender_email, auth_code, recipient_email, subject, body)
+            if success:
+                for _, _, on_sent in messages:
+                    if on_sent is not None:
+                        on_sent()
+            results.append((recipient_email, subject, success, error_msg))
+        return results
+
+    def close(self) -> None:
+        """关闭全部连接。"""
+        for connection in self._connections.values():
+            try:
+                connection.quit()
+            except Exception:
+                pass
+        self._connections.clear()
+
+
+def build_digest(messages: list) -> tuple[str, str]:
+    """
+    把多条通知合并为一封汇总邮件。
+
+    :param messages: [(主题, 正文), ...]
+    :return: (汇总主题, 汇总正文)
+    """
+    warnings = sum(1 for subject, _ in messages if subject.startswith("[警告]"))
+    subject = f"电费查询汇总：{len(messages)} 条通知"
+    if warnings:
+        subject = f"[警告] {subject}（{warnings} 条警告）"
+    separator = "\n\n" + "-" * 30 + "\n\n"
+    body = separator.join(f"【{item_subject}】\n{item_body}" for item_subject, item_body in messages)
+    return subject, body
 
 
 def send_notification_email(
     sender_email: str, auth_code: str, recipient_email: str, subject: str, body: str
 ) -> tuple[bool, str]:
     """
-    发送一封通知邮件。
+    发送一封通知邮件（单独建立连接，发送后立即关闭）。
 
     :param sender_email: 发件人的邮箱账号 (例如 '12345@qq.com')。
     :param auth_code: 发件人邮箱的SMTP授权码。
@@ -16,46 +196,8 @@ def send_notification_email(
     :param body: 邮件正文内容。
     :return: 一个元组 (成功状态, 错误信息)。发送成功返回 (True, "")，失败返回 (False, 具体错误信息)。
     """
-    ret = True
-    error_msg = ""
+    dispatcher = NotificationDispatcher()
     try:
-        # 创建邮件内容
-        msg = MIMEText(body, "plain", "utf-8")
-        # 设置邮件头部信息
-        msg["From"] = formataddr(
-            ["TJUEcard电费查询助手", sender_email]
-        )  # 发件人昵称和账号
-        msg["To"] = formataddr(["用户", recipient_email])  # 收件人昵称和账号
-        msg["Subject"] = subject  # 邮件主题
-
-        # 根据邮箱域名选择不同的SMTP服务器
-        if "@" not in sender_email:
-            error_msg = "邮箱地址格式不正确"
-            print(f"[错误] {error_msg}")
-            return False, error_msg
-
-        domain = sender_email.split("@")[1].lower()
-
-        if domain == "qq.com":
-            server = smtplib.SMTP_SSL("smtp.qq.com", 465)
-        elif domain == "163.com":
-            server = smtplib.SMTP_SSL("smtp.163.com", 465)
-        elif domain == "tju.edu.cn":
-            server = smtplib.SMTP_SSL("smtp.tju.edu.cn", 465)
-        else:
-            error_msg = f"不支持的邮箱域名: {domain}"
-            print(f"[错误] {error_msg}")
-            return False, error_msg
-
-        # 登录邮箱
-        server.login(sender_email, auth_code)
-        # 发送邮件
-        server.sendmail(sender_email, [recipient_email], msg.as_string())
-        # 关闭连接
-        server.quit()
-    except Exception as e:
-        # 如果发生任何异常，则认为发送失败
-        error_msg = f"邮件发送失败: {str(e)}"
-        print(f"[错误] {error_msg}")
-        ret = False
-    return ret, error_msg
+        return dispatcher.send(sender_email, auth_code, recipient_email, subject, body)
+    finally:
+        dispatcher.close()
@@ -1,4 +1,6 @@
+import os
 import sys
+import sqlite3
 from datetime import datetime
 import pwinput
 import requests
@@ -9,11 +11,13 @@ from send_email import send_notification_email
 from scheduler_setup import setup_system_scheduler
 
 # 导入工具函数和配置
-from utils import save_cookies, load_cookies, extract_csrf_token, load_config
+from utils import save_cookies, extract_csrf_token, extract_csrf_token_from_response, save_config_to_json
 from config import (
     BASE_DOMAIN, USER_CONFIG_FILE, LOAD_ELECTRIC_INDEX_URL, LOGIN_URL,
-    QUERY_URL, COOKIE_FILE, LOGIN_PAGE_URL, API_BASE_URL, API_URLS, KEY_MAP
+    QUERY_URL, COOKIE_FILE, LOGIN_PAGE_URL, API_URLS, KEY_MAP, CATALOG_FILE, CATALOG_MAX_AGE_DAYS
 )
+from room_catalog import open_catalog, list_children, list_systems, catalog_is_fresh
+from http_client import create_http_session
 from crypto_store import encrypt_for_storage, get_key_file_path
 
 # --- 1. 核心功能函数 ---
@@ -21,14 +25,12 @@ from crypto_store import encrypt_for_storage, get_key_file_path
 
 def perform_login(session) -> tuple[str | None, str | None]:
     try:
-        page_response = session.get(LOGIN_PAGE_URL, timeout=10)  # 设置10秒超时
+        page_response = session.get(LOGIN_PAGE_URL, timeout=10, stream=True)  # 设置10秒超时
         page_response.raise_for_status()
-        soup = BeautifulSoup(page_response.text, 'html.parser')
-        csrf_input_tag = soup.find('input', {'name': '_csrf'})
-        if not csrf_input_tag or not csrf_input_tag.has_attr('value'):
+        csrf_token = extract_csrf_token_from_response(page_response, tag='input')
+        if not csrf_token:
             print("[错误] 在登录页面中未找到 _csrf token！")
             return None, None
-        csrf_token = csrf_input_tag['value']
     except requests.RequestException as e:
         print(f"[错误] 访问登录页面失败: {e}")
         return None, None
@@ -74,7 +76,42 @@ def get_user_choice(options: list, exit_option: bool = False) -> dict | None:
             print("无效的输入，请输入一个数字。")
 
 
+def fetch_options_from_catalog(level: str, payload: dict) -> list | None:
+    """优先从本地房间目录读取选项，目录不存在、缺少该节点或该节点超过有效期时返回 None。"""
+    if not os.path.exists(CATALOG_FILE):
+        return None
+    try:
+        conn = open_catalog(CATALOG_FILE)
+        try:
+            return list_children(conn, payload['sysid'], level, payload, CATALOG_MAX_AGE_DAYS * 86400)
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"[警告] 读取本地房间目录失败: {e}")
+        return None
+
+
+def load_catalog_systems() -> list | None:
+    """本地房间目录完整且在有效期内时返回其中的电控系统，此时不需要访问电控系统选择页面；否则返回 None。"""
+    if not os.path.exists(CATALOG_FILE):
+        return None
+    try:
+        conn = open_catalog(CATALOG_FILE)
+        try:
+            if not catalog_is_fresh(conn, CATALOG_MAX_AGE_DAYS * 86400):
+                return None
+            return list_systems(conn) or None
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"[警告] 读取本地房间目录失败: {e}")
+        return None
+
+
 def fetch_options(session: requests.Session, level: str, payload: dict, csrf_token: str, token_page_url: str) -> list:
+    cached_options = fetch_options_from_catalog(level, payload)
+    if cached_options is not None:
+        return cached_options
     url = API_URLS[level]
     map_keys = KEY_MAP[level]
     normalized_options = []
@@ -187,13 +224,103 @@ def select_electric_system(session: requests.Session) -> dict | None:
         return None
 
 
-def save_config_to_json(filename: str, config_data: dict):
-    try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(config_data, f, ensure_ascii=False, indent=4)
-        print(f"[成功] 您的配置已保存到 {filename}")
-    except IOError as e:
-        print(f"[错误] 保存配置文件失败: {e}")
+def save_setup(
+    session: requests.Session,
+    username: str,
+    password: str,
+    selected_system: dict,
+    full_selection: dict,
+    user_email: str | None,
+    user_auth_code: str | None,
+):
+    """
+    询问通知阈值后保存配置（写入密文字段），并按需设置系统定时任务。
+
+    :param session: 已登录的会话，保存到会话文件
+    """
+    # 构建最终的配置文件（写入密文字段）
+    config_data = {
+        "credentials": {
+            "username": username,
+            "password_enc": encrypt_for_storage(password)
+        },
+        "selection": {
+            "system": selected_system,
+            **full_selection
+        }
+    }
+    # 只有在用户配置了邮箱的情况下才添加
+    if user_email and user_email.strip():
+        config_data["email_notifier"] = {
+            "email": user_email,
+        }
+        if user_auth_code and user_auth_code.strip():
+            config_data["email_notifier"]["auth_code_enc"] = encrypt_for_storage(user_auth_code)
+
+        # 添加电费通知阈值设置
+        print("\n--- 电费通知阈值设置 ---")
+        print("设置后，只有当剩余电量小于等于阈值时才会发送邮件通知。")
+        print("如果不设置，每次查询都会发送邮件通知。")
+        # 循环直到用户输入有效
+        while True:
+            set_threshold = input("是否需要设置电费通知阈值？(y/n, 回车默认y): ").strip().lower()
+            if set_threshold in ['y', 'n', '']:
+                break
+            print("[错误] 无效输入，请输入 'y' 或 'n'。")
+
+        if set_threshold in ['y', '']:
+            while True:
+                try:
+                    threshold_input = input("请输入电量阈值（单位：度，0-1024，最多两位小数）: ")
+                    # 检查输入是否为数字且最多两位小数
+                    threshold = float(threshold_input)
+                    # 验证范围
+                    if 0 <= threshold <= 1024:
+                        # 检查小数位数
+                        if '.' in threshold_input and len(threshold_input.split('.')[1]) > 2:
+                            print("[错误] 最多只能输入两位小数。")
+                            continue
+                        config_data["email_notifier"]["notification_threshold"] = threshold
+                        print(f"[成功] 已设置电费通知阈值: {threshold} 度")
+                        break
+                    else:
+                        print("[错误] 电量阈值必须在0到1024之间。")
+                except ValueError:
+                    print("[错误] 请输入有效的数字。")
+        else:
+            # 不设置阈值，保存-1
+            config_data["email_notifier"]["notification_threshold"] = -1
+            print("[成功] 未设置电费通知阈值，每次查询都会发送邮件。")
+
+    # 验证成功后，才保存所有配置
+    save_config_to_json(USER_CONFIG_FILE, config_data)
+    save_cookies(session, COOKIE_FILE)
+
+    # 记录当前时间并设置定时任务
+    current_time = datetime.now()
+    print(f"\n记录执行时间: {current_time.strftime('%H:%M')}")
+
+    # 询问是否设置系统定时任务
+    # 循环直到用户输入有效
+    while True:
+        setup_scheduler = input("是否自动设置系统定时任务？(y/n, 回车默认y): ").strip().lower()
+        if setup_scheduler in ['y', 'n', '']:
+            break
+        print("[错误] 无效输入，请输入 'y' 或 'n'。")
+
+    if setup_scheduler in ['', 'y']:
+        try:
+            # 导入并执行定时任务设置
+            setup_system_scheduler()
+        except ImportError:
+            print("[错误] 定时任务设置模块未找到")
+        except Exception as e:
+            print(f"[错误] 定时任务设置失败: {e}")
+    else:
+        print("[提示] 您可以选择稍后手动设置定时任务")
+
+    print("\n所有配置已成功保存！现在您可以使用 TJUEcard 进行一次快速查询，记录保存在TJUEcard.log。")
+
 
 # --- 3. 主程序 ---
 if __name__ == "__main__":
@@ -204,17 +331,18 @@ if __name__ == "__main__":
     print("请确保您已经把 TJUEcardSetup 和 TJUEcard 程序都放在了同一个目录下，")
     print("并且移动到你想安装的文件夹下，日后不再移动。\n")
 
-    session = requests.Session()
-    session.headers.update({
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/128.0.0.0 Safari/537.36',
-        'X-Requested-With': 'XMLHttpRequest'
-    })
+    session = create_http_session()
 
+    # 无论是否使用本地房间目录，都先登录验证账号密码，保存到配置中的凭据一定可用
     username, password = perform_login(session)
     if not username:
         input("按回车键退出。")
         sys.exit(1)
 
+    catalog_systems = load_catalog_systems()
+    if catalog_systems:
+        print("[信息] 本地房间目录在有效期内，将直接从目录中读取电控系统和房间列表。")
+
     # 循环以允许用户在邮件测试失败后重试
     email_configured = False
     while not email_configured:
@@ -260,7 +388,11 @@ if __name__ == "__main__":
             print(f"[错误] 测试邮件发送失败！错误信息: {email_error}")
 
     while True:
-        selected_system = select_electric_system(session)
+        if catalog_systems:
+            print("\n--- 请选择电控系统 ---")
+            selected_system = get_user_choice(catalog_systems, exit_option=True)
+        else:
+            selected_system = select_electric_system(session)
         if not selected_system:
             input("用户在主菜单选择退出，程序结束。按回车键退出。")
             sys.exit(0)
@@ -325,88 +457,7 @@ if __name__ == "__main__":
                     print("========================")
                     result_text = f"剩余电量: {remaining_electricity} 度"
 
-                # 构建最终的配置文件（写入密文字段）
-                config_data = {
-                    "credentials": {
-                        "username": username,
-                        "password_enc": encrypt_for_storage(password)
-                    },
-                    "selection": {
-                        "system": selected_system,
-                        **full_selection
-                    }
-                }
-                # 只有在用户配置了邮箱的情况下才添加
-                if user_email and user_email.strip():
-                    config_data["email_notifier"] = {
-                        "email": user_email,
-                    }
-                    if user_auth_code and user_auth_code.strip():
-                        config_data["email_notifier"]["auth_code_enc"] = encrypt_for_storage(user_auth_code)
-
-                    # 添加电费通知阈值设置
-                    print("\n--- 电费通知阈值设置 ---")
-                    print("设置后，只有当剩余电量小于等于阈值时才会发送邮件通知。")
-                    print("如果不设置，每次查询都会发送邮件通知。")
-                    # 循环直到用户输入有效
-                    while True:
-                        set_threshold = input("是否需要设置电费通知阈值？(y/n, 回车默认y): ").strip().lower()
-                        if set_threshold in ['y', 'n', '']:
-                            break
-                        print("[错误] 无效输入，请输入 'y' 或 'n'。")
-
-                    if set_threshold in ['y', '']:
-                        while True:
-                            try:
-                                threshold_input = input("请输入电量阈值（单位：度，0-1024，最多两位小数）: ")
-                                # 检查输入是否为数字且最多两位小数
-                                threshold = float(threshold_input)
-                                # 验证范围
-                                if 0 <= threshold <= 1024:
-                                    # 检查小数位数
-                                    if '.' in threshold_input and len(threshold_input.split('.')[1]) > 2:
-                                        print("[错误] 最多只能输入两位小数。")
-                                        continue
-                                    config_data["email_notifier"]["notification_threshold"] = threshold
-                                    print(f"[成功] 已设置电费通知阈值: {threshold} 度")
-                                    break
-                                else:
-                                    print("[错误] 电量阈值必须在0到1024之间。")
-                            except ValueError:
-                                print("[错误] 请输入有效的数字。")
-                    else:
-                        # 不设置阈值，保存-1
-                        config_data["email_notifier"]["notification_threshold"] = -1
-                        print("[成功] 未设置电费通知阈值，每次查询都会发送邮件。")
-
-                # 验证成功后，才保存所有配置
-                save_config_to_json(USER_CONFIG_FILE, config_data)
-                save_cookies(session, COOKIE_FILE)
-
-                # 记录当前时间并设置定时任务
-                current_time = datetime.now()
-                print(f"\n记录执行时间: {current_time.strftime('%H:%M')}")
-
-                # 询问是否设置系统定时任务
-                # 循环直到用户输入有效
-                while True:
-                    setup_scheduler = input("是否自动设置系统定时任务？(y/n, 回车默认y): ").strip().lower()
-                    if setup_scheduler in ['y', 'n', '']:
-                        break
-                    print("[错误] 无效输入，请输入 'y' 或 'n'。")
-
-                if setup_scheduler in ['', 'y']:
-                    try:
-                        # 导入并执行定时任务设置
-                        setup_system_scheduler()
-                    except ImportError:
-                        print("[错误] 定时任务设置模块未找到")
-                    except Exception as e:
-                        print(f"[错误] 定时任务设置失败: {e}")
-                else:
-                    print("[提示] 您可以选择稍后手动设置定时任务")
-
-                print("\n所有配置已成功保存！现在您可以使用 TJUEcard 进行一次快速查询，记录保存在TJUEcard.log。")
+                save_setup(session, username, password, selected_system, full_selection, user_email, user_auth_code)
                 break
             else:
                 print(f"[错误] 验证失败: {result.get('retmsg')}")
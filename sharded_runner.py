@@ -0,0 +1,147 @@
+"""
+多进程分片查询：房间很多时，把房间列表分成若干分片交给工作进程池查询，结果按原顺序合并后由主进程统一处理
+（记录读数、预测、发送通知和汇总），与单进程查询的输出相同。
+
+- 每个工作进程有自己的会话，启动时从 COOKIE_FILE 加载主进程已验证/登录过的会话；
+  会话失效时通过 handle_relogin 在文件锁内重连，多个进程同时发现失效时只有一个真正登录，其余直接复用新会话。
+- 工作进程不直接写日志文件，日志记录经队列交给主进程写入，避免多个进程同时轮转同一个日志文件；
+  工作进程的终端输出被丢弃，进度和汇总由主进程输出。
+- 每个主机的限速（async_query.requests_per_second）是全部进程合计的上限，平均分给各工作进程。
+- 运行指标由工作进程在每个分片结束后导出（在文件锁内合并），房间计数由主进程记录。
+
+在用户配置中启用：
+    "sharding": {"processes": 8, "min_rooms": 200}
+或在命令行中指定：
+    python TJUEcard_main.py --processes 8
+"""
+
+from __future__ import annotations
+
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from logging.handlers import QueueListener
+
+from config import ASYNC_REQUESTS_PER_SECOND, COOKIE_FILE, SHARD_CHUNKS_PER_PROCESS
+from utils import build_query_payload, forward_logger_to_queue, format_room_path, load_cookies, setup_logger, split_evenly
+
+logger = setup_logger("TJUEcardQuery")
+
+# 工作进程内的会话和配置，由 _init_worker 设置
+_worker_session = None
+_worker_config: dict | None = None
+
+
+class _ParentLogHandler(logging.Handler):
+    """把工作进程发来的日志记录交给主进程中同名的日志记录器处理。"""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        logging.getLogger(record.name).handle(record)
+
+
+def worker_config(config: dict, processes: int) -> dict:
+    """工作进程使用的配置：不再分片，限速按进程数平均分配。"""
+    config = dict(config)
+    config["sharding"] = {"processes": 1}
+    async_options = dict(config.get("async_query") or {})
+    rate = async_options.get("requests_per_second", ASYNC_REQUESTS_PER_SECOND)
+    if rate:
+        async_options["requests_per_second"] = rate / processes
+    config["async_query"] = async_options
+    if config.get("accounts"):
+        # 多账号时每个账号的限速同样是全部进程合计的上限
+        config["accounts"] = [
+            {**account, "requests_per_second": account["requests_per_second"] / processes}
+            if isinstance(account, dict) and account.get("requests_per_second") else account
+            for account in config["accounts"]
+        ]
+    return config
+
+
+def _init_worker(config: dict, log_queue) -> None:
+    global _worker_session, _worker_config
+    sys.stdout = open(os.devnull, "w", encoding="utf-8")
+    forward_logger_to_queue("TJUEcardQuery", log_queue)
+    from TJUEcard_main import create_session
+
+    _worker_config = config
+    _worker_session = create_session()
+    load_cookies(_worker_session, COOKIE_FILE)
+
+
+def _run_shard(selections: list) -> list:
+    """在工作进程中查询一个分片，返回与 selections 顺序一致的查询结果。"""
+    from TJUEcard_main import export_metrics, handle_relogin, query_selections
+
+    # 多账号时全部账号不可用的通知由主进程按房间结果发送，各工作进程不再各自发送
+    outcomes = query_selections(
+        _worker_session,
+        _worker_config,
+        selections,
+        lambda: handle_relogin(_worker_session, _worker_config, fatal=False),
+        notify_exhausted=False,
+    )
+    export_metrics(_worker_config)
+    return outcomes
+
+
+def _failed_outcome(selection: dict, error: Exception) -> dict:
+    room_path = format_room_path(selection)
+    return {
+        "room_path": room_path,
+        "query_payload": build_query_payload(selection),
+        "success": False,
+        "message": f"查询房间: {room_path}\n\n查询脚本在执行过程中遇到一个错误: 工作进程异常: {error}",
+        "current_elec": -1,
+        "meters": [],
+    }
+
+
+def run_sharded(config: dict, selections: list, processes: int) -> list:
+    """
+    用 processes 个工作进程查询已校验的房间。
+
+    :param config: 用户配置
+    :param selections: 已校验的房间选择列表
+    :param processes: 工作进程数
+    :return: 与 selections 顺序一致的查询结果
+    """
+    processes = max(1, min(processes, len(selections)))
+    shards, start = [], 0
+    for shard in split_evenly(selections, processes * SHARD_CHUNKS_PER_PROCESS):
+        shards.append((start, shard))
+        start += len(shard)
+    print(f"[信息] 正在使用 {processes} 个进程查询 {len(selections)} 个房间（{len(shards)} 个分片）...")
+    logger.info(f"多进程分片查询：{processes} 个进程，{len(selections)} 个房间，{len(shards)} 个分片")
+
+    # 使用 spawn 启动工作进程，避免 fork 时复制后台写日志线程持有的锁；各平台行为一致
+    context = multiprocessing.get_context("spawn")
+    log_queue = context.Queue()
+    listener = QueueListener(log_queue, _ParentLogHandler())
+    listener.start()
+    outcomes = [None] * len(selections)
+    try:
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(worker_config(config, processes), log_queue),
+        ) as executor:
+            futures = {executor.submit(_run_shard, shard): (start, shard) for start, shard in shards}
+            for done, future in enumerate(as_completed(futures), 1):
+                start, shard = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    logger.error(f"分片查询失败（第 {start + 1}-{start + len(shard)} 个房间）: {e}")
+                    results = [_failed_outcome(selection, e) for selection in shard]
+                outcomes[start:start + len(shard)] = results
+                succeeded = sum(1 for outcome in results if outcome["success"])
+                print(f"[信息] 分片 {done}/{len(shards)} 完成：成功 {succeeded} 个，失败 {len(results) - succeeded} 个")
+    finally:
+        listener.stop()
+        log_queue.close()
+
+    return outcomes
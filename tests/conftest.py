@@ -0,0 +1,163 @@
+"""
+测试夹具：在临时目录中的程序副本里运行查询，访问在测试进程内启动的模拟服务器（benchmarks/mock_epay_server.py）。
+
+项目模块在导入时按 config.BASE_DIR 确定会话、日志、读数数据库和密钥文件的位置，
+因此会读写这些文件的测试都在程序副本中用子进程运行，不会改动仓库目录下的任何文件。
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+from mock_epay_server import MockEpayServer, MockOptions, iter_room_selections  # noqa: E402
+
+# 子进程输出结果时使用的行前缀，与程序自身的输出区分开
+RESULT_PREFIX = "RESULT "
+
+
+class App:
+    """
+    临时目录中的程序副本。
+
+    :param path: 副本所在目录
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def read_json(self, name: str):
+        with open(self.file(name), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _env(self, server: MockEpayServer | None) -> dict:
+        env = dict(os.environ, PYTHONIOENCODING="utf-8")
+        env.pop("TJUECARD_BASE_DOMAIN", None)
+        if server is not None:
+            env["TJUECARD_BASE_DOMAIN"] = server.base_url
+        return env
+
+    def run(
+        self, *args: str, server: MockEpayServer | None = None, input: str | None = None, timeout: float = 120
+    ) -> subprocess.CompletedProcess:
+        """在副本目录中运行 python *args。"""
+        return subprocess.run(
+            [sys.executable, *args],
+            cwd=self.path,
+            env=self._env(server),
+            input=input,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            timeout=timeout,
+        )
+
+    def start(self, *args: str, server: MockEpayServer | None = None) -> subprocess.Popen:
+        """在副本目录中启动 python *args，不等待结束。"""
+        return subprocess.Popen(
+            [sys.executable, *args],
+            cwd=self.path,
+            env=self._env(server),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding="utf-8",
+        )
+
+    def script(self, code: str, server: MockEpayServer | None = None, timeout: float = 120):
+        """在副本中执行一段代码，返回代码用 RESULT_PREFIX 输出的 JSON。"""
+        result = self.run("-c", code, server=server, timeout=timeout)
+        assert result.returncode == 0, result.stdout + result.stderr
+        for line in reversed(result.stdout.splitlines()):
+            if line.startswith(RESULT_PREFIX):
+                return json.loads(line[len(RESULT_PREFIX):])
+        raise AssertionError(f"脚本没有输出结果:\n{result.stdout}{result.stderr}")
+
+    def write_config(self, config: dict) -> None:
+        """
+        写入用户配置；credentials / accounts 中的 password 和 email_notifier 中的 auth_code
+        在副本中加密为 password_enc / auth_code_enc（使用副本自己的密钥）。
+        """
+        code = (
+            "import json, sys\n"
+            "from crypto_store import encrypt_for_storage\n"
+            "config = json.load(sys.stdin)\n"
+            "for entry in [config.get('credentials')] + list(config.get('accounts') or []):\n"
+            "    if entry and 'password' in entry:\n"
+            "        entry['password_enc'] = encrypt_for_storage(entry.pop('password'))\n"
+            "notifier = config.get('email_notifier') or {}\n"
+            "if 'auth_code' in notifier:\n"
+            "    notifier['auth_code_enc'] = encrypt_for_storage(notifier.pop('auth_code'))\n"
+            "with open('TJUEcard_user_config.json', 'w', encoding='utf-8') as f:\n"
+            "    json.dump(config, f, ensure_ascii=False)\n"
+        )
+        result = self.run("-c", code, input=json.dumps(config, ensure_ascii=False))
+        assert result.returncode == 0, result.stdout + result.stderr
+
+
+def room_selections(count: int) -> list:
+    """模拟目录中的前 count 个房间。"""
+    return list(iter_room_selections(limit=count))
+
+
+def make_config(rooms: int, username: str = "u", **sections) -> dict:
+    """查询 rooms 个模拟房间的用户配置，默认不限速；sections 覆盖或追加配置中的各部分。"""
+    config = {
+        "credentials": {"username": username, "password": "p"},
+        "selections": room_selections(rooms),
+        "async_query": {"requests_per_second": 0},
+    }
+    config.update(sections)
+    return config
+
+
+def summary_lines(output: str) -> list:
+    """print_batch_summary 输出的逐个房间结果行。"""
+    lines = output.splitlines()
+    for index, line in enumerate(lines):
+        if line.startswith("--- 批量查询完成"):
+            return [line.strip() for line in lines[index + 1:] if line.startswith("  [")]
+    return []
+
+
+@pytest.fixture
+def app(tmp_path) -> App:
+    """复制顶层模块和 benchmarks/ 到临时目录。"""
+    path = tmp_path / "app"
+    path.mkdir()
+    for name in os.listdir(REPO_DIR):
+        if name.endswith(".py"):
+            shutil.copy2(os.path.join(REPO_DIR, name), path / name)
+    shutil.copytree(
+        os.path.join(REPO_DIR, "benchmarks"),
+        path / "benchmarks",
+        ignore=shutil.ignore_patterns("__pycache__", "*.json"),
+    )
+    return App(str(path))
+
+
+@pytest.fixture
+def mock_server():
+    """启动模拟服务器的工厂函数，参数与 MockOptions 相同；测试结束时关闭全部服务器。"""
+    servers = []
+
+    def start(**options) -> MockEpayServer:
+        server = MockEpayServer(options=MockOptions(**options)).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
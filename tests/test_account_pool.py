@@ -0,0 +1,95 @@
+"""account_pool：登录失败的账号被暂停使用，其房间改由其他账号查询，暂停状态跨次运行有效。"""
+
+from __future__ import annotations
+
+import time
+
+from conftest import make_config, summary_lines
+
+ROOMS = 10
+
+
+def test_rejected_account_is_disabled_and_rooms_reassigned(app, mock_server):
+    server = mock_server(reject_users=("bad",))
+    app.write_config(
+        make_config(
+            ROOMS,
+            accounts=[{"username": "bad", "password": "p"}],
+            account_pool={"max_login_failures": 1, "cooldown_minutes": 30},
+        )
+    )
+
+    started = time.time()
+    result = app.run("TJUEcard_main.py", server=server)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "使用 2 个账号查询 10 个房间" in result.stdout
+    assert "账号 bad 连续 1 次自动登录失败" in result.stdout
+    assert "改用其他账号重新查询" in result.stdout
+
+    # bad 负责的房间全部由 u 重新查询成功
+    lines = summary_lines(result.stdout)
+    assert len(lines) == ROOMS
+    assert all(line.startswith("[成功]") for line in lines)
+    assert server.stats["queries"] == ROOMS
+
+    state = app.read_json("TJUEcard_accounts.json")
+    assert state["bad"]["failures"] >= 1
+    assert started + 29 * 60 < state["bad"]["disabled_until"] <= time.time() + 30 * 60
+    assert state["u"] == {"failures": 0, "disabled_until": 0}
+
+    # 暂停期间再次运行时不再尝试登录 bad，失败次数和暂停时间保持不变
+    result = app.run("TJUEcard_main.py", server=server)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "使用 1 个账号查询 10 个房间" in result.stdout
+    assert "账号 bad" not in result.stdout
+    assert all(line.startswith("[成功]") for line in summary_lines(result.stdout))
+    assert app.read_json("TJUEcard_accounts.json")["bad"] == state["bad"]
+
+
+def _failure_notices(app) -> int:
+    """日志中决定发送失败通知邮件的次数。"""
+    with open(app.file("TJUEcard.log"), "r", encoding="utf-8") as f:
+        return f.read().count("查询失败，发送失败通知。")
+
+
+# 不支持的邮箱域名使发送在本地失败，不访问网络
+_NOTIFIER = {"email": "notify@example.invalid", "auth_code": "x"}
+
+
+def test_one_failure_notice_when_all_accounts_fail(app, mock_server):
+    server = mock_server(reject_users=("bad1", "bad2"))
+    app.write_config(
+        make_config(
+            ROOMS,
+            username="bad1",
+            accounts=[{"username": "bad2", "password": "p"}],
+            account_pool={"max_login_failures": 1},
+            email_notifier=_NOTIFIER,
+        )
+    )
+
+    result = app.run("TJUEcard_main.py", server=server)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert result.stdout.count("全部账号都不可用") == 1
+    assert all(line.startswith("[失败]") for line in summary_lines(result.stdout))
+    # 各账号登录失败时不单独通知：只有账号池的一封，以及汇总中每个失败房间各一条
+    assert _failure_notices(app) == 1 + ROOMS
+    assert server.stats["queries"] == 0
+
+
+def test_no_failure_notice_when_another_account_takes_over(app, mock_server):
+    server = mock_server(reject_users=("bad",))
+    app.write_config(
+        make_config(
+            ROOMS,
+            accounts=[{"username": "bad", "password": "p"}],
+            account_pool={"max_login_failures": 1},
+            email_notifier=_NOTIFIER,
+        )
+    )
+
+    result = app.run("TJUEcard_main.py", server=server)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert all(line.startswith("[成功]") for line in summary_lines(result.stdout))
+    assert "全部账号都不可用" not in result.stdout
+    assert _failure_notices(app) == 0
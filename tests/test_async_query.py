@@ -0,0 +1,64 @@
+"""async_query：并发查询的结果顺序与会话失效时的重新登录。"""
+
+from __future__ import annotations
+
+import json
+
+from conftest import room_selections
+
+ROOMS = 12
+
+# 在程序副本中用未登录的会话并发查询，会话失效时调用计数的 relogin
+_SCRIPT = """
+import json
+from async_query import run_batch_async
+from TJUEcard_main import create_session, perform_auto_login
+from utils import format_room_path
+
+selections = json.load(open("selections.json", encoding="utf-8"))
+session = create_session()
+relogins = []
+
+def relogin():
+    relogins.append(1)
+    return {relogin_result}
+
+outcomes = run_batch_async(session, selections, relogin, {{"requests_per_second": 0, "max_in_flight": 4}})
+print("RESULT " + json.dumps({{
+    "relogins": len(relogins),
+    "rooms": [outcome["room_path"] for outcome in outcomes],
+    "expected_rooms": [format_room_path(selection) for selection in selections],
+    "success": [outcome["success"] for outcome in outcomes],
+    "messages": [outcome["message"] for outcome in outcomes],
+}}, ensure_ascii=False))
+"""
+
+
+def _run(app, server, relogin_result: str) -> dict:
+    with open(app.file("selections.json"), "w", encoding="utf-8") as f:
+        json.dump(room_selections(ROOMS), f, ensure_ascii=False)
+    return app.script(_SCRIPT.format(relogin_result=relogin_result), server=server)
+
+
+def test_relogin_once_and_keep_order(app, mock_server):
+    server = mock_server(latency_ms=5)
+    result = _run(app, server, 'perform_auto_login(session, "u", "p")')
+
+    # 全部房间同时发现会话失效，只重新登录一次
+    assert result["relogins"] == 1
+    assert server.stats["logins"] == 1
+    assert all(result["success"])
+    assert server.stats["queries"] == ROOMS
+    assert result["rooms"] == result["expected_rooms"]
+
+
+def test_failed_relogin_skips_remaining_rooms(app, mock_server):
+    server = mock_server(latency_ms=5)
+    result = _run(app, server, "False")
+
+    # 重新登录失败后不再重复登录，其余房间直接失败，不退出进程
+    assert result["relogins"] == 1
+    assert not any(result["success"])
+    assert server.stats["logins"] == 0
+    assert server.stats["queries"] == 0
+    assert any("重新登录失败" in message for message in result["messages"])
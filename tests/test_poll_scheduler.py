@@ -0,0 +1,89 @@
+"""poll_scheduler：到达提醒线的时间、查询配额和查询间隔，以及守护进程按配额查询。"""
+
+from __future__ import annotations
+
+import signal
+import sys
+import time
+
+import pytest
+
+from conftest import make_config
+from poll_scheduler import PollPolicy, RequestBudget, hours_to_alert
+
+
+def _outcome(meters: list, meter_hours: dict) -> dict:
+    return {"success": True, "current_elec": meters[0][1], "meters": meters, "meter_hours": meter_hours}
+
+
+def test_hours_to_alert_uses_earliest_meter():
+    outcome = _outcome([("A", "100"), ("B", "20")], {"A": 10, "B": 200})
+    # A：10 小时耗尽 100 度，降到 10 度需要 9 小时；B：降到 10 度需要 100 小时
+    assert hours_to_alert(outcome, threshold=10) == pytest.approx(9.0)
+    # 即将耗尽提醒：A 在耗尽前 5 小时提醒
+    assert hours_to_alert(outcome, depletion_alert_hours=5) == pytest.approx(5.0)
+    assert hours_to_alert(outcome, threshold=10, depletion_alert_hours=5) == pytest.approx(5.0)
+
+
+def test_hours_to_alert_at_or_below_threshold():
+    # 任意一个电表已低于提醒线时为 0，即使该电表没有用电速率
+    assert hours_to_alert(_outcome([("A", "100"), ("B", "8")], {"A": 10}), threshold=10) == 0.0
+    assert hours_to_alert(_outcome([("A", "0")], {}), threshold=-1) == 0.0
+
+
+def test_hours_to_alert_without_forecast():
+    assert hours_to_alert(_outcome([("A", "100")], {}), threshold=10) is None
+    assert hours_to_alert({"success": False, "current_elec": -1}, threshold=10) is None
+    # 单表房间没有 meters 时使用 current_elec
+    assert hours_to_alert({"success": True, "current_elec": 50, "meter_hours": {"": 5}}) == pytest.approx(5.0)
+
+
+def test_request_budget():
+    budget = RequestBudget(3)
+    assert budget.remaining(0) == 3
+    budget.spend(2, 0)
+    budget.spend(1, 600)
+    assert budget.remaining(601) == 0
+    # 第一批查询满一小时后释放 2 个房间的配额
+    assert budget.next_available(601) == 3600
+    assert budget.remaining(3600) == 2
+    assert budget.next_available(3600, pending=2) == 600 + 3600
+    assert RequestBudget(0).remaining(0) is None
+
+
+def test_poll_interval_is_clamped():
+    policy = PollPolicy(
+        {
+            "daemon": {"adaptive": True, "min_interval_minutes": 30, "lead_fraction": 0.5, "retry_minutes": 10},
+            "email_notifier": {"notification_threshold": 10},
+        }
+    )
+    day = 24 * 3600
+    # 9 小时后到达提醒线，按一半的时间再查询
+    assert policy.interval(_outcome([("A", "100")], {"A": 10}), day) == pytest.approx(4.5 * 3600)
+    # 不早于最短间隔，不晚于房间的查询间隔
+    assert policy.interval(_outcome([("A", "8")], {"A": 10}), day) == 30 * 60
+    assert policy.interval(_outcome([("A", "100")], {"A": 1000}), day) == day
+    assert policy.interval(_outcome([("A", "100")], {}), day) == day
+    assert policy.interval({"success": False}, day) == 10 * 60
+    assert PollPolicy({"daemon": {"adaptive": False}}).interval(_outcome([("A", "8")], {"A": 10}), day) == day
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="需要 SIGTERM")
+def test_daemon_respects_requests_per_hour(app, mock_server):
+    server = mock_server()
+    app.write_config(make_config(3, daemon={"adaptive": True, "requests_per_hour": 2}))
+    process = app.start("TJUEcard_main.py", "--daemon", server=server)
+    try:
+        deadline = time.time() + 60
+        while server.stats["queries"] < 2 and time.time() < deadline and process.poll() is None:
+            time.sleep(0.1)
+        time.sleep(1)  # 留出时间确认没有额外的查询
+    finally:
+        process.send_signal(signal.SIGTERM)
+        output, _ = process.communicate(timeout=60)
+
+    assert process.returncode == 0, output
+    assert "1 个房间推迟到" in output
+    assert "守护进程已退出" in output
+    assert server.stats["queries"] == 2
@@ -0,0 +1,82 @@
+"""query_cache：最近的查询结果直接复用、过期后后台重新查询、多个进程同时查询同一房间时只查询一次。"""
+
+from __future__ import annotations
+
+from conftest import make_config, summary_lines
+
+ROOMS = 6
+
+
+def _run(app, server):
+    result = app.run("TJUEcard_main.py", server=server)
+    assert result.returncode == 0, result.stdout + result.stderr
+    lines = summary_lines(result.stdout)
+    assert len(lines) == ROOMS
+    assert all(line.startswith("[成功]") for line in lines)
+    return result
+
+
+def test_disabled_by_default(app, mock_server):
+    server = mock_server()
+    app.write_config(make_config(ROOMS))
+    _run(app, server)
+    _run(app, server)
+    assert server.stats["queries"] == 2 * ROOMS
+
+
+def test_fresh_results_are_reused(app, mock_server):
+    server = mock_server()
+    app.write_config(make_config(ROOMS, query_cache={"enabled": True, "fresh_seconds": 3600}))
+    _run(app, server)
+    result = _run(app, server)
+    assert f"{ROOMS} 个房间使用最近的查询结果" in result.stdout
+    assert server.stats["queries"] == ROOMS
+
+
+def test_stale_results_are_refreshed_in_background(app, mock_server):
+    server = mock_server()
+    app.write_config(make_config(ROOMS, query_cache={"enabled": True, "fresh_seconds": 0, "stale_seconds": 3600}))
+    _run(app, server)
+    result = _run(app, server)
+    # 第二次运行先返回上次的结果，退出前等待后台重新查询完成
+    assert f"正在后台重新查询 {ROOMS} 个房间" in result.stdout
+    assert server.stats["queries"] == 2 * ROOMS
+
+
+def test_concurrent_processes_share_queries(app, mock_server):
+    server = mock_server(latency_ms=200)
+    app.write_config(make_config(ROOMS, query_cache={"enabled": True, "fresh_seconds": 3600, "wait_seconds": 60}))
+    processes = [app.start("TJUEcard_main.py", server=server) for _ in range(2)]
+    for process in processes:
+        output, _ = process.communicate(timeout=120)
+        assert process.returncode == 0, output
+        assert all(line.startswith("[成功]") for line in summary_lines(output))
+        assert len(summary_lines(output)) == ROOMS
+    # 后启动的进程等待先启动的进程的查询结果，每个房间只查询一次
+    assert server.stats["queries"] == ROOMS
+
+
+def test_background_refresh_still_alerts(app, mock_server):
+    server = mock_server()
+    # 阈值高于任何房间的电量，每次实际查询到的结果都触发低电量提醒；
+    # 不支持的邮箱域名使发送在本地失败，告警状态不保存，每次查询都会重新告警
+    notifier = {"email": "notify@example.invalid", "auth_code": "x", "notification_threshold": 100000}
+    app.write_config(
+        make_config(
+            ROOMS,
+            query_cache={"enabled": True, "fresh_seconds": 0, "stale_seconds": 3600},
+            email_notifier=notifier,
+        )
+    )
+
+    def alerts() -> int:
+        with open(app.file("TJUEcard.log"), "r", encoding="utf-8") as f:
+            return f.read().count("低于设置的通知阈值")
+
+    _run(app, server)
+    assert alerts() == ROOMS
+    result = _run(app, server)
+    # 第二次运行先返回缓存的结果（不据此告警），后台重新查询到的结果仍然触发告警
+    assert f"{ROOMS} 个房间使用最近的查询结果" in result.stdout
+    assert alerts() == 2 * ROOMS
+    assert server.stats["queries"] == 2 * ROOMS
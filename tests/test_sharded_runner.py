@@ -0,0 +1,28 @@
+"""sharded_runner：多进程分片查询的结果汇总。"""
+
+from __future__ import annotations
+
+from conftest import make_config, summary_lines
+
+ROOMS = 30
+
+
+def test_sharded_query_keeps_order(app, mock_server):
+    server = mock_server(latency_ms=5)
+    app.write_config(make_config(ROOMS, sharding={"min_rooms": 1}))
+    expected = app.script(
+        "import json\n"
+        "from utils import format_room_path\n"
+        "config = json.load(open('TJUEcard_user_config.json', encoding='utf-8'))\n"
+        "print('RESULT ' + json.dumps([format_room_path(s) for s in config['selections']], ensure_ascii=False))\n"
+    )
+
+    result = app.run("TJUEcard_main.py", "--processes", "2", server=server)
+    assert result.returncode == 0, result.stdout + result.stderr
+    assert "个进程查询 30 个房间" in result.stdout
+
+    # 各分片完成的顺序不确定，汇总仍按配置中的房间顺序输出，每个房间只查询一次
+    lines = summary_lines(result.stdout)
+    assert [line.split("] ", 1)[1].split(":", 1)[0] for line in lines] == expected
+    assert all(line.startswith("[成功]") for line in lines)
+    assert server.stats["queries"] == ROOMS
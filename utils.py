@@ -2,84 +2,471 @@
 工具函数模块，包含项目中重复使用的函数
 """
 
-import pickle
 import os
+import re
+import html
 import json
 import logging
 import sys
+import threading
+import tempfile
+import time
+import weakref
+from contextlib import contextmanager
 import requests
-from bs4 import BeautifulSoup
-from config import LOG_FILE, LOG_FORMAT, LOG_DATE_FORMAT
+from config import (
+    LOG_FILE, LOG_FORMAT, LOG_DATE_FORMAT, LOG_ASYNC, LOG_ROTATE_MAX_BYTES, LOG_ROTATE_WHEN, LOG_BACKUP_COUNT,
+    LOG_COMPRESS, LOG_JSON_FILE, BASE_DIR, BASE_DOMAIN, QUERY_URL, LOAD_ELECTRIC_INDEX_URL,
+    LOGIN_PAGE_URL, FILE_LOCK_TIMEOUT, ROOMS_FILE
+)
 
 
 # 日志配置函数
-def setup_logger(logger_name='TJUEcardLogger'):
+# 结构化日志中从 LogRecord 上读取的附加字段，通过 logger.info(..., extra={...}) 传入
+LOG_FIELDS = ('room', 'sysid', 'phase', 'duration_ms', 'retcode', 'remaining', 'result')
+
+_log_listeners: dict = {}  # 日志记录器名称 -> 写文件的后台 QueueListener
+_log_atexit_registered = False
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """把日志记录格式化为一行 JSON，包含时间、级别、消息以及 LOG_FIELDS 中出现的附加字段。"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': round(record.created, 3),
+            'time': self.formatTime(record, LOG_DATE_FORMAT),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _gzip_namer(name: str) -> str:
+    return name + '.gz'
+
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    """轮转时把旧日志压缩为 dest（已带 .gz 后缀）并删除原文件。"""
+    import gzip
+    import shutil
+
+    with open(source, 'rb') as src, gzip.open(dest, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _build_file_handler(path: str, formatter: logging.Formatter, options: dict) -> logging.Handler:
+    """按配置创建普通、按大小轮转或按时间轮转的文件处理器。"""
+    from logging.handlers import RotatingFileHandler, TimedRotatingFileHandler
+
+    when = options.get('when', LOG_ROTATE_WHEN)
+    max_bytes = options.get('max_bytes', LOG_ROTATE_MAX_BYTES)
+    backup_count = options.get('backup_count', LOG_BACKUP_COUNT)
+    if when:
+        handler = TimedRotatingFileHandler(path, when=when, backupCount=backup_count, encoding='utf-8')
+    elif max_bytes:
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+    else:
+        handler = logging.FileHandler(path, encoding='utf-8')
+    if options.get('compress', LOG_COMPRESS) and isinstance(handler, (RotatingFileHandler, TimedRotatingFileHandler)):
+        handler.namer = _gzip_namer
+        handler.rotator = _gzip_rotator
+    handler.setFormatter(formatter)
+    return handler
+
+
+def _close_log_handlers(logger: logging.Logger) -> None:
+    """停止后台写日志线程（会先写完队列中剩余的记录）并关闭全部处理器。"""
+    listener = _log_listeners.pop(logger.name, None)
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+
+def _shutdown_log_listeners() -> None:
+    for name in list(_log_listeners):
+        _close_log_handlers(logging.getLogger(name))
+
+
+def setup_logger(logger_name='TJUEcardLogger', options: dict | None = None):
     """
     配置并返回日志记录器
-    
+
+    默认在首次调用时按 config.py 中的日志配置添加处理器，之后的调用直接返回已配置的记录器；
+    传入 options（用户配置中的 "logging" 部分）时按新的配置重新创建处理器。
+
     :param logger_name: 日志记录器名称
+    :param options: 覆盖 config.py 日志配置的选项，可包含 async / max_bytes / when / backup_count / compress / json_file
     :return: 配置好的日志记录器
     """
     logger = logging.getLogger(logger_name)
     logger.setLevel(logging.INFO)
 
     # 检查是否已经有处理器，避免重复添加
-    if not logger.handlers:
-        try:
-            file_handler = logging.FileHandler(LOG_FILE, encoding='utf-8')
-            formatter = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
-            file_handler.setFormatter(formatter)
-            logger.addHandler(file_handler)
-        except PermissionError:
-            print(f"[错误] 权限不足，无法在 '{LOG_FILE}' 创建日志文件。")
-            print("请尝试以管理员身份运行程序。")
-            sys.exit(1)
+    if logger.handlers and options is None:
+        return logger
+    _close_log_handlers(logger)
+    options = options or {}
+
+    try:
+        handlers = [_build_file_handler(LOG_FILE, logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT), options)]
+        json_file = options.get('json_file', LOG_JSON_FILE)
+        if json_file:
+            handlers.append(_build_file_handler(json_file, JsonLinesFormatter(), options))
+    except PermissionError:
+        print(f"[错误] 权限不足，无法在 '{LOG_FILE}' 创建日志文件。")
+        print("请尝试以管理员身份运行程序。")
+        sys.exit(1)
+
+    if options.get('async', LOG_ASYNC):
+        # 查询线程只把记录放进队列，由后台线程写文件；进程退出时写完剩余的记录
+        import atexit
+        import queue
+        from logging.handlers import QueueHandler, QueueListener
 
+        log_queue = queue.SimpleQueue()
+        listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        listener.start()
+        _log_listeners[logger_name] = listener
+        logger.addHandler(QueueHandler(log_queue))
+        global _log_atexit_registered
+        if not _log_atexit_registered:
+            atexit.register(_shutdown_log_listeners)
+            _log_atexit_registered = True
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    return logger
+
+
+def forward_logger_to_queue(logger_name: str, log_queue) -> logging.Logger:
+    """
+    把日志记录器的处理器替换为写入 log_queue 的 QueueHandler，用于多进程查询的工作进程：
+    各进程不直接写日志文件（多个进程同时轮转同一个文件会出错），由主进程统一写入。
+
+    :param log_queue: 主进程创建的 multiprocessing 队列
+    """
+    from logging.handlers import QueueHandler
+
+    logger = logging.getLogger(logger_name)
+    logger.setLevel(logging.INFO)
+    _close_log_handlers(logger)
+    logger.addHandler(QueueHandler(log_queue))
     return logger
 
 
+# 文件持久化相关函数
+_held_locks = threading.local()  # 当前线程已持有的文件锁，同一线程内可重入
+
+
+@contextmanager
+def file_lock(path: str, timeout: float = FILE_LOCK_TIMEOUT):
+    """
+    跨进程的排他文件锁（锁文件为 path + ".lock"），用于多个进程/线程同时读写同一个会话或配置文件。
+    同一线程内可以嵌套获取同一个锁。
+
+    :param path: 被保护的文件路径
+    :param timeout: 等待锁的最长时间（秒），超时抛出 TimeoutError
+    """
+    held = _held_locks.__dict__.setdefault('paths', set())
+    lock_path = os.path.abspath(path) + '.lock'
+    if lock_path in held:
+        yield
+        return
+    fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                if os.name == 'nt':
+                    import msvcrt
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"等待文件锁超时: {path}")
+                time.sleep(0.05)
+        held.add(lock_path)
+        try:
+            yield
+        finally:
+            held.discard(lock_path)
+            if os.name == 'nt':
+                import msvcrt
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: str, data: str | bytes, mode: int | None = None) -> None:
+    """
+    原子地写入文件：先写入同目录下的临时文件并刷盘，再重命名覆盖目标文件。
+    其他进程读到的要么是旧文件，要么是完整的新文件；写入中途崩溃也不会留下半个文件。
+    临时文件以 0600 权限创建，重命名后目标文件保持该权限。
+
+    :param path: 目标文件路径
+    :param data: 文件内容，str 按 UTF-8 编码
+    :param mode: 需要其他用户读取的文件（例如交给 node_exporter 的指标文件）在重命名前改为该权限，如 0o644
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_json_atomic(path: str, data, indent: int | None = None, mode: int | None = None) -> None:
+    """在文件锁保护下原子地写入 JSON 文件，mode 的含义与 atomic_write 相同。"""
+    with file_lock(path):
+        atomic_write(path, json.dumps(data, ensure_ascii=False, indent=indent), mode)
+
+
 # Cookie相关函数
+# 每个 session 最近一次从磁盘加载/保存的会话文件版本，用于判断其他进程是否已经刷新了会话
+_cookie_file_versions: "weakref.WeakKeyDictionary[requests.Session, int]" = weakref.WeakKeyDictionary()
+
+
+def _file_version(file_name: str) -> int | None:
+    try:
+        return os.stat(file_name).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _cookie_to_dict(cookie) -> dict:
+    return {
+        'name': cookie.name,
+        'value': cookie.value,
+        'domain': cookie.domain,
+        'path': cookie.path,
+        'secure': cookie.secure,
+        'expires': cookie.expires,
+        'rest': dict(cookie._rest),
+    }
+
+
 def save_cookies(session: requests.Session, file_name: str) -> None:
     """
-    保存会话cookies到文件
-    
+    保存会话cookies到文件（JSON格式，原子写入）
+
     :param session: 请求会话对象
     :param file_name: 保存的文件名
     """
-    with open(file_name, 'wb') as file:
-        pickle.dump(session.cookies, file)
+    data = {'version': 1, 'cookies': [_cookie_to_dict(cookie) for cookie in session.cookies]}
+    with file_lock(file_name):
+        atomic_write(file_name, json.dumps(data, ensure_ascii=False, separators=(',', ':')))
+        _cookie_file_versions[session] = _file_version(file_name)
     print(f"[信息] 新的会话已保存到 {file_name}")
 
 
+def _migrate_legacy_cookies(session: requests.Session, file_name: str) -> bool:
+    """把旧版本保存的 pickle 会话文件（同名 .pkl）一次性转换为 JSON 格式。"""
+    legacy_file = os.path.splitext(file_name)[0] + '.pkl'
+    if legacy_file == file_name or not os.path.exists(legacy_file):
+        return False
+    import pickle
+
+    try:
+        with open(legacy_file, 'rb') as file:
+            session.cookies.update(pickle.load(file))
+    except Exception as e:
+        print(f"[警告] 读取旧的会话文件失败: {e}")
+        return False
+    save_cookies(session, file_name)
+    try:
+        os.remove(legacy_file)
+    except OSError:
+        pass
+    return True
+
+
 def load_cookies(session: requests.Session, file_name: str) -> bool:
     """
     从文件加载cookies到会话
-    
+
     :param session: 请求会话对象
     :param file_name: 加载的文件名
     :return: 是否成功加载
     """
     if not os.path.exists(file_name):
+        if _migrate_legacy_cookies(session, file_name):
+            print("[信息] 已从本地加载会话。")
+            return True
         return False
-    with open(file_name, 'rb') as file:
-        session.cookies.update(pickle.load(file))
+    version = _file_version(file_name)
+    try:
+        # 写入方总是原子替换文件，读取时无需加锁
+        with open(file_name, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+        now = time.time()
+        for item in data['cookies']:
+            if item.get('expires') is not None and item['expires'] <= now:
+                continue
+            session.cookies.set_cookie(requests.cookies.create_cookie(**item))
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"[警告] 本地会话文件已损坏，将重新登录: {e}")
+        return False
+    _cookie_file_versions[session] = version
     print("[信息] 已从本地加载会话。")
     return True
 
 
+def cookies_changed_on_disk(session: requests.Session, file_name: str) -> bool:
+    """会话文件是否在该 session 上次加载/保存之后被其他进程更新过。"""
+    version = _file_version(file_name)
+    return version is not None and version != _cookie_file_versions.get(session)
+
+
+def mark_session_verified(meta_file: str) -> None:
+    """
+    记录会话最近一次确认有效的时间（登录成功、预检通过或查询成功后调用）
+
+    :param meta_file: 会话元数据文件，与cookie文件放在一起
+    """
+    try:
+        atomic_write(meta_file, json.dumps({"last_verified": time.time()}))
+    except OSError as e:
+        print(f"[警告] 保存会话元数据失败: {e}")
+
+
+def is_session_recently_verified(meta_file: str, trust_seconds: float) -> bool:
+    """
+    判断会话是否在 trust_seconds 秒内确认过有效
+
+    :param meta_file: 会话元数据文件
+    :param trust_seconds: 信任时长（秒）
+    :return: 是否可以跳过会话预检
+    """
+    try:
+        with open(meta_file, 'r', encoding='utf-8') as f:
+            last_verified = float(json.load(f).get("last_verified", 0))
+    except (OSError, ValueError, AttributeError):
+        return False
+    return 0 <= time.time() - last_verified < trust_seconds
+
+
 # CSRF Token相关函数
-def extract_csrf_token(html_content: str) -> str | None:
+# 快速路径：直接在字节流中匹配 <meta name="_csrf" content="..."> / <input name="_csrf" value="...">，不构建DOM
+# \b 保证不会误匹配 Spring 页面中同时存在的 name="_csrf_header"
+_CSRF_TAG_PATTERNS = {
+    'meta': re.compile(rb'<meta\b(?=[^>]*\bname\s*=\s*["\']?_csrf\b)[^>]*>', re.IGNORECASE),
+    'input': re.compile(rb'<input\b(?=[^>]*\bname\s*=\s*["\']?_csrf\b)[^>]*>', re.IGNORECASE),
+}
+_CSRF_VALUE_PATTERNS = {
+    'meta': re.compile(rb'\bcontent\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE),
+    'input': re.compile(rb'\bvalue\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE),
+}
+_CSRF_VALUE_ATTRS = {'meta': 'content', 'input': 'value'}
+_CSRF_SCAN_OVERLAP = 1024  # 流式读取时保留的重叠字节数，防止标签被分块截断
+_CSRF_DRAIN_LIMIT = 64 * 1024  # 找到Token后剩余内容不超过该大小时读完丢弃，以便连接回到连接池复用
+
+
+def _scan_csrf_token(data: bytes, tag: str, pos: int = 0) -> str | None:
+    """在原始字节中查找CSRF Token，找不到返回None。"""
+    tag_match = _CSRF_TAG_PATTERNS[tag].search(data, pos)
+    if not tag_match:
+        return None
+    value_match = _CSRF_VALUE_PATTERNS[tag].search(tag_match.group(0))
+    if not value_match:
+        return None
+    raw_value = next(group for group in value_match.groups() if group is not None)
+    return html.unescape(raw_value.decode('utf-8', errors='replace'))
+
+
+def _extract_csrf_token_bs(html_content: str, tag: str) -> str | None:
+    """使用 BeautifulSoup 完整解析页面提取CSRF Token（快速路径未命中时的兜底方案）。"""
+    from bs4 import BeautifulSoup  # 仅在兜底时加载，避免拖慢每次启动
+
+    soup = BeautifulSoup(html_content, 'html.parser')
+    csrf_tag = soup.find(tag, {'name': '_csrf'})
+    attr = _CSRF_VALUE_ATTRS[tag]
+    if csrf_tag and csrf_tag.has_attr(attr):
+        return csrf_tag[attr]
+    return None
+
+
+def extract_csrf_token(html_content: str, tag: str = 'meta') -> str | None:
     """
     从HTML内容中提取CSRF Token
-    
+
     :param html_content: HTML内容
+    :param tag: 'meta' 读取 <meta name="_csrf"> 的 content；'input' 读取 <input name="_csrf"> 的 value
     :return: CSRF Token或None
     """
-    soup = BeautifulSoup(html_content, 'html.parser')
-    csrf_meta_tag = soup.find('meta', {'name': '_csrf'})
-    if csrf_meta_tag and csrf_meta_tag.has_attr('content'):
-        return csrf_meta_tag['content']
-    return None
+    token = _scan_csrf_token(html_content.encode('utf-8'), tag)
+    if token is not None:
+        return token
+    return _extract_csrf_token_bs(html_content, tag)
+
+
+def extract_csrf_token_from_response(
+    response: requests.Response, tag: str = 'meta', chunk_size: int = 4096
+) -> str | None:
+    """
+    以流的方式从响应中提取CSRF Token，找到后立即停止解析
+
+    请求时应使用 stream=True，否则响应体已经整体读入内存，只能省去DOM构建的开销。
+    快速路径未命中时读完剩余内容并使用 BeautifulSoup 兜底。调用结束后响应会被关闭。
+
+    :param response: 请求响应对象
+    :param tag: 'meta' 或 'input'，见 extract_csrf_token
+    :param chunk_size: 每次读取的字节数
+    :return: CSRF Token或None
+    """
+    buffer = bytearray()
+    try:
+        chunks = response.iter_content(chunk_size=chunk_size)
+        for chunk in chunks:
+            scan_from = max(0, len(buffer) - _CSRF_SCAN_OVERLAP)
+            buffer += chunk
+            token = _scan_csrf_token(buffer, tag, scan_from)
+            if token is not None:
+                content_length = response.headers.get('Content-Length', '')
+                if not content_length.isdigit() or int(content_length) - len(buffer) <= _CSRF_DRAIN_LIMIT:
+                    # 分块传输时不知道剩余大小，最多读取 _CSRF_DRAIN_LIMIT 字节，超过时放弃并关闭连接
+                    drained = 0
+                    for chunk in chunks:
+                        drained += len(chunk)
+                        if drained > _CSRF_DRAIN_LIMIT:
+                            break
+                return token
+
+        encoding = response.encoding or response.apparent_encoding or 'utf-8'
+        return _extract_csrf_token_bs(bytes(buffer).decode(encoding, errors='replace'), tag)
+    finally:
+        response.close()
 
 
 # 配置文件相关函数
@@ -108,33 +495,286 @@ def load_config(filename: str, logger=None) -> dict | None:
             logger.error(msg)
         return None
 
-    if "selection" not in data:
+    if (
+        "selection" not in data and "selections" not in data and "rooms_file" not in data
+        and not os.path.exists(ROOMS_FILE)
+    ):
         msg = "配置文件缺少'selection'部分。"
         print(f"[错误] {msg}")
         if logger:
             logger.error(msg)
         return None
 
-    required_keys = ['system', 'area', 'district', 'buis', 'floor', 'room']
-    for key in required_keys:
-        msg = ""
-        if key not in data["selection"]:
-            msg = f"配置文件校验失败：缺少顶级键 '{key}'。"
-        elif not isinstance(data["selection"].get(key), dict) or 'id' not in data["selection"].get(key):
-            msg = f"配置文件校验失败：'{key}' 的内容格式不正确。"
-        elif not data["selection"].get(key)['id']:
-            msg = f"配置文件校验失败：'{key}' 的 'id' 不能为空。"
-
-        if msg:
-            print(f"[错误] {msg}")
-            if logger:
-                logger.error(msg)
-            return None
+    # 单房间模式下严格校验；批量模式下逐个房间在查询时校验，避免一个房间出错影响全部
+    msg = ""
+    if "selections" in data:
+        if not isinstance(data["selections"], list):
+            msg = "配置文件校验失败：'selections' 必须是房间列表。"
+    elif "selection" in data and "rooms_file" not in data:
+        msg = validate_selection(data["selection"])
+    if not msg and "accounts" in data and not isinstance(data["accounts"], list):
+        msg = "配置文件校验失败：'accounts' 必须是账号列表。"
+    if msg:
+        print(f"[错误] {msg}")
+        if logger:
+            logger.error(msg)
+        return None
 
     print("[成功] 配置文件校验通过。")
     return data
 
 
+def validate_selection(selection) -> str:
+    """
+    校验单个房间选择是否完整
+
+    :param selection: 房间选择，包含 system/area/district/buis/floor/room
+    :return: 错误信息，校验通过时返回空字符串
+    """
+    if not isinstance(selection, dict):
+        return "配置文件校验失败：房间选择的内容格式不正确。"
+
+    required_keys = ['system', 'area', 'district', 'buis', 'floor', 'room']
+    for key in required_keys:
+        if key not in selection:
+            return f"配置文件校验失败：缺少顶级键 '{key}'。"
+        elif not isinstance(selection.get(key), dict) or 'id' not in selection.get(key):
+            return f"配置文件校验失败：'{key}' 的内容格式不正确。"
+        elif not selection.get(key)['id']:
+            return f"配置文件校验失败：'{key}' 的 'id' 不能为空。"
+    return ""
+
+
+def load_selections(config: dict, base_dir: str = BASE_DIR) -> list:
+    """
+    获取本次需要查询的全部房间
+
+    优先级：config["selections"] > config["rooms_file"] 指向的房间文件 > config["selection"]；
+    三者都没有时使用程序目录下的 ROOMS_FILE（存在时）。房间文件可以是房间选择的列表，也可以是 {"selections": [...]}。
+
+    :param config: 用户配置
+    :param base_dir: 房间文件使用相对路径时的基准目录
+    :return: 房间选择列表（未逐个校验）
+    """
+    if isinstance(config.get("selections"), list):
+        return list(config["selections"])
+
+    rooms_file = config.get("rooms_file")
+    if not rooms_file and "selection" not in config and os.path.exists(ROOMS_FILE):
+        rooms_file = ROOMS_FILE
+    if rooms_file:
+        if not os.path.isabs(rooms_file):
+            rooms_file = os.path.join(base_dir, rooms_file)
+        try:
+            with open(rooms_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[错误] 读取房间列表文件 '{rooms_file}' 失败: {e}")
+            return []
+        if isinstance(data, dict):
+            data = data.get("selections", [])
+        return data if isinstance(data, list) else []
+
+    if "selection" in config:
+        return [config["selection"]]
+    return []
+
+
+# 电费查询相关函数
+def build_query_payload(selection: dict) -> dict:
+    """
+    根据房间选择构建 QUERY_URL 的请求参数
+
+    :param selection: 房间选择
+    :return: 查询参数
+    """
+    return {
+        "sysid": selection["system"]["id"],
+        "elcarea": selection["area"]["id"],
+        "elcbuis": selection["buis"]["id"],
+        "roomNo": selection["room"]["id"],
+    }
+
+
+def log_fields(query_payload: dict | None = None, **fields) -> dict:
+    """
+    生成结构化日志的附加字段，用作 logger.info(..., extra=log_fields(...))
+
+    :param query_payload: build_query_payload 生成的查询参数，提供 room / sysid
+    :param fields: 其他 LOG_FIELDS 中的字段，例如 phase / duration_ms / retcode
+    """
+    if query_payload:
+        fields.setdefault('room', query_payload.get('roomNo'))
+        fields.setdefault('sysid', query_payload.get('sysid'))
+    return fields
+
+
+def split_evenly(items: list, count: int) -> list:
+    """
+    把列表按顺序分成 count 段，段长相差不超过 1（相邻房间通常属于同一电控系统，可以共用电费页面Token）。
+
+    :return: 非空的分段列表，段数不超过 len(items)
+    """
+    count = max(1, min(count, len(items)))
+    size, extra = divmod(len(items), count)
+    groups, start = [], 0
+    for index in range(count):
+        end = start + size + (1 if index < extra else 0)
+        groups.append(items[start:end])
+        start = end
+    return groups
+
+
+def format_room_path(selection: dict) -> str:
+    """
+    生成便于阅读的房间路径，例如 "北洋园电控 > ... > 101"
+
+    :param selection: 房间选择
+    :return: 房间路径
+    """
+    levels = ['system', 'area', 'district', 'buis', 'floor', 'room']
+    names = []
+    for key in levels:
+        level = selection.get(key) if isinstance(selection, dict) else None
+        names.append(str(level.get('name', '?')) if isinstance(level, dict) else '?')
+    return " > ".join(names)
+
+
+def bill_page_url(sysid: str) -> str:
+    """返回指定电控系统的电费页面地址（CSRF Token 所在页面）。"""
+    return f"{BASE_DOMAIN}/epay/electric/load4electricbill?elcsysid={sysid}"
+
+
+def fetch_bill_csrf_token(session: requests.Session, sysid: str) -> str | None:
+    """
+    访问电费页面并提取查询所需的CSRF Token
+
+    :param session: 请求会话对象
+    :param sysid: 电控系统ID
+    :return: CSRF Token，页面中不存在时返回None（通常意味着会话失效）
+    :raises requests.RequestException: 网络错误或HTTP状态码异常
+    """
+    page_headers = session.headers.copy()
+    page_headers.pop("X-Requested-With", None)
+    page_headers["Referer"] = LOAD_ELECTRIC_INDEX_URL
+    page_response = session.get(bill_page_url(sysid), headers=page_headers, stream=True)
+    try:
+        page_response.raise_for_status()
+    except requests.RequestException:
+        page_response.close()
+        raise
+    if page_response.history and page_response.url.split('?')[0] == LOGIN_PAGE_URL:
+        # 会话失效时服务器会把电费页面重定向到登录页，登录页中的Token不能用于查询
+        page_response.close()
+        return None
+    return extract_csrf_token_from_response(page_response)
+
+
+class CsrfTokenRejected(requests.RequestException):
+    """查询被服务器拒绝（403 或返回了登录页），说明缓存的CSRF Token或会话已失效。"""
+
+
+# 电费页面CSRF Token缓存：{session: ({sysid: token}, {sysid: 获取该Token时持有的锁})}
+# Token属于会话和电控系统而不是房间，同一会话内同一系统的所有房间、所有重试都可以复用；
+# 锁和Token保存在同一个条目中，会话被回收时一起释放
+_bill_csrf_cache: "weakref.WeakKeyDictionary[requests.Session, tuple[dict, dict]]" = weakref.WeakKeyDictionary()
+_bill_csrf_guard = threading.Lock()
+
+
+def get_bill_csrf_token(session: requests.Session, sysid: str) -> str | None:
+    """
+    获取电费查询所需的CSRF Token，优先使用缓存
+
+    并发场景下同一 (session, sysid) 只会发起一次页面请求，其余调用等待并复用结果。
+
+    :param session: 请求会话对象
+    :param sysid: 电控系统ID
+    :return: CSRF Token，页面中不存在时返回None（不会缓存None）
+    :raises requests.RequestException: 网络错误或HTTP状态码异常
+    """
+    with _bill_csrf_guard:
+        tokens, locks = _bill_csrf_cache.setdefault(session, ({}, {}))
+        if sysid in tokens:
+            return tokens[sysid]
+        lock = locks.setdefault(sysid, threading.Lock())
+
+    with lock:
+        with _bill_csrf_guard:
+            if sysid in tokens:
+                return tokens[sysid]
+        token = fetch_bill_csrf_token(session, sysid)
+        if token:
+            with _bill_csrf_guard:
+                tokens[sysid] = token
+        return token
+
+
+def invalidate_bill_csrf_token(session: requests.Session, sysid: str | None = None) -> None:
+    """
+    使缓存的CSRF Token失效
+
+    :param session: 请求会话对象
+    :param sysid: 电控系统ID，为None时清空该会话的全部Token（例如重新登录后）
+    """
+    with _bill_csrf_guard:
+        entry = _bill_csrf_cache.get(session)
+        if entry is None:
+            return
+        tokens = entry[0]
+        if sysid is None:
+            tokens.clear()
+        else:
+            tokens.pop(sysid, None)
+
+
+def post_electric_query(session: requests.Session, csrf_token: str, query_payload: dict) -> dict:
+    """
+    向 QUERY_URL 提交电费查询
+
+    :param session: 请求会话对象
+    :param csrf_token: 电费页面中的CSRF Token
+    :param query_payload: build_query_payload 生成的查询参数
+    :return: 服务器返回的JSON
+    :raises CsrfTokenRejected: CSRF Token被拒绝或会话已失效
+    :raises requests.RequestException: 网络错误或HTTP状态码异常
+    :raises json.JSONDecodeError: 服务器未返回有效JSON
+    """
+    query_headers = {
+        "X-CSRF-TOKEN": csrf_token,
+        "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+        "Referer": bill_page_url(query_payload["sysid"]),
+    }
+    query_response = session.post(QUERY_URL, data=query_payload, headers=query_headers)
+    if query_response.status_code in (401, 403):
+        raise CsrfTokenRejected(f"服务器拒绝了查询请求（HTTP {query_response.status_code}）", response=query_response)
+    query_response.raise_for_status()
+    if "j_spring_security_check" in query_response.text:
+        raise CsrfTokenRejected("查询请求被重定向到登录页面，会话已失效", response=query_response)
+    return query_response.json()
+
+
+def parse_query_result(result: dict) -> tuple[str, float, list]:
+    """
+    解析 QUERY_URL 返回的成功结果（retcode == 0）
+
+    :param result: 服务器返回的JSON
+    :return: (结果文本, 用于阈值判断的电量, [(电表名称, 剩余电量), ...])
+    """
+    if result.get("multiflag"):
+        meters = [
+            (meter.get("name"), meter.get("restElecDegree"))
+            for meter in result.get("elecRoomData", [])
+        ]
+        result_text = " | ".join(f"- {name}: 剩余电量 {degree} 度" for name, degree in meters)
+        current_elec = float(meters[0][1] if meters else 0)
+    else:
+        remaining_electricity = result.get("restElecDegree")
+        meters = [("", remaining_electricity)]
+        result_text = f"剩余电量: {remaining_electricity} 度"
+        current_elec = float(remaining_electricity)
+    return result_text, current_elec, meters
+
+
 def save_config_to_json(filename: str, config_data: dict):
     """
     保存配置数据到JSON文件
@@ -143,8 +783,7 @@ def save_config_to_json(filename: str, config_data: dict):
     :param config_data: 配置数据
     """
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(config_data, f, ensure_ascii=False, indent=4)
+        write_json_atomic(filename, config_data, indent=4)
         print(f"[成功] 您的配置已保存到 {filename}")
-    except IOError as e:
+    except (IOError, TimeoutError) as e:
         print(f"[错误] 保存配置文件失败: {e}")